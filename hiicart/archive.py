@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Move old terminal carts to cold storage and back.
+
+Carts which have been in a state listed in the ARCHIVE_AFTER setting for
+longer than its age are serialized along with their line items, payments,
+notes and payment responses, then deleted from the hot tables.  Where they
+go depends on ARCHIVE_BACKEND:
+
+ * "db" -- an ArchivedCart row holding the serialized cart.
+ * "file" -- a line in a gzipped JSON-lines file in ARCHIVE_DIR.  Each
+   chunk of carts is written to its own file, which is closed before the
+   chunk's rows are deleted.
+
+Either way a CartTombstone is left with the cart's UUID, state and totals,
+so hiicart.utils.cart_by_uuid still finds archived carts; it restores them
+on the way.  Carts are archived in chunks, each in its own transaction.
+With SHARDS set, tombstones and ArchivedCart rows are kept on the default
+database, whose transaction is committed along with the shard's.
+
+Use the hiicart_archive and hiicart_restore management commands.
+"""
+
+import gzip
+import json
+import logging
+import os
+
+from django.contrib.contenttypes.models import ContentType
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import get_model
+from django.utils import timezone
+
+from hiicart import sharding
+from hiicart.models import (CART_TYPES, ArchivedCart, CartTombstone, HiiCart,
+                            Note, PaymentResponse)
+from hiicart.settings import SETTINGS as hiicart_settings
+from hiicart.utils import keyset_chunks
+
+log = logging.getLogger("hiicart.archive")
+
+BACKENDS = ("db", "file")
+
+
+def _model_label(obj):
+    return "%s.%s" % (obj._meta.app_label, obj._meta.object_name)
+
+
+def _by_cart(objects):
+    grouped = {}
+    for obj in objects:
+        grouped.setdefault(obj.cart_id, []).append(obj)
+    return grouped
+
+
+def _notes(objects):
+    """Notes attached to objects, keyed by (model, object_id)."""
+    by_type = {}
+    for obj in objects:
+        by_type.setdefault(obj.__class__, []).append(obj.pk)
+    notes = {}
+    for cls, pks in by_type.items():
+        ct = ContentType.objects.get_for_model(cls)
+        for note in Note.objects.filter(content_type=ct, object_id__in=pks):
+            notes.setdefault((cls, note.object_id), []).append(note)
+    return notes
+
+
+def serialize_carts(carts):
+    """Serialize carts with everything attached to them.
+
+    Returns {cart pk: [serialized object, ...]} with the cart first so the
+    objects can be restored in order.  Related rows are read with a few
+    queries for all the carts, not per cart."""
+    if not carts:
+        return {}
+    cart_class = carts[0].__class__
+    related = {}
+    for cls in cart_class.lineitem_types:
+        for cart_id, items in _by_cart(cls.objects.filter(cart__in=carts)).items():
+            related.setdefault(cart_id, []).extend(items)
+    for cart_id, payments in _by_cart(cart_class.payment_class.objects.filter(cart__in=carts)).items():
+        related.setdefault(cart_id, []).extend(payments)
+    responses = {}
+    if issubclass(cart_class, HiiCart):
+        responses = _by_cart(PaymentResponse.objects.filter(cart__in=carts))
+    notes = _notes(list(carts) + [obj for objs in related.values() for obj in objs])
+    serialized = {}
+    for cart in carts:
+        objects = [cart] + related.get(cart.pk, [])
+        objects += [note for obj in objects for note in notes.get((obj.__class__, obj.pk), [])]
+        objects += responses.get(cart.pk, [])
+        serialized[cart.pk] = serializers.serialize("python", objects)
+    return serialized
+
+
+def _write_file(directory, records):
+    """Write records to a new gzipped JSON-lines file, returning its path."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, "hiicart-archive-%s-%s.jsonl.gz" % (
+        timezone.now().strftime("%Y%m%d%H%M%S%f"), records[0]["uuid"]))
+    f = gzip.open(path, "wb")
+    try:
+        for record in records:
+            f.write(json.dumps(record, cls=DjangoJSONEncoder) + "\n")
+    finally:
+        f.close()
+    return path
+
+
+def archive_cart_type(cart_class, state, age, backend=None, chunk_size=100, now=None):
+    """Archive carts of cart_class in `state` last updated over `age` ago.
+
+    Returns the number of carts archived."""
+    backend = backend or hiicart_settings.get("ARCHIVE_BACKEND", "db")
+    if backend not in BACKENDS:
+        raise ValueError("Unknown ARCHIVE_BACKEND: %s" % backend)
+    cutoff = (now or timezone.now()) - age
+    old = cart_class.objects.filter(_cart_state=state, last_updated__lt=cutoff)
+    archived = 0
+    for chunk in keyset_chunks(old, chunk_size, "last_updated"):
+        with transaction.atomic(using=sharding.current_shard()), \
+                transaction.atomic(using=DEFAULT_DB_ALIAS):
+            carts = list(cart_class.objects.select_for_update().filter(
+                pk__in=[cart.pk for cart in chunk], _cart_state=state,
+                last_updated__lt=cutoff))
+            if not carts:
+                continue
+            serialized = serialize_carts(carts)
+            records = [{"uuid": cart.cart_uuid, "objects": serialized[cart.pk]}
+                       for cart in carts]
+            location = ""
+            if backend == "file":
+                location = _write_file(hiicart_settings["ARCHIVE_DIR"], records)
+            CartTombstone.objects.bulk_create([
+                CartTombstone(cart_uuid=cart.cart_uuid, cart_model=_model_label(cart),
+                              cart_id=cart.pk, state=cart.state, sub_total=cart._sub_total,
+                              total=cart._total, location=location)
+                for cart in carts])
+            if backend == "db":
+                tombstones = dict(CartTombstone.objects.filter(
+                    cart_uuid__in=[record["uuid"] for record in records]
+                ).values_list("cart_uuid", "pk"))
+                ArchivedCart.objects.bulk_create([
+                    ArchivedCart(tombstone_id=tombstones[record["uuid"]],
+                                 payload=json.dumps(record["objects"], cls=DjangoJSONEncoder))
+                    for record in records])
+            cart_class.objects.filter(pk__in=[cart.pk for cart in carts]).delete()
+        archived += len(carts)
+    if archived:
+        log.info("Archived %i %s %s carts" % (archived, state, cart_class.__name__))
+    return archived
+
+
+def archive_carts(ages=None, backend=None, chunk_size=100, now=None):
+    """Archive every cart type on every shard, returning {state: carts archived}.
+
+    `ages` maps states to timedeltas and defaults to ARCHIVE_AFTER."""
+    if ages is None:
+        ages = hiicart_settings.get("ARCHIVE_AFTER") or {}
+    now = now or timezone.now()
+    counts = dict((state, 0) for state in ages)
+    for alias in sharding.shard_aliases():
+        with sharding.use_shard(alias):
+            for state, age in ages.items():
+                counts[state] += sum([archive_cart_type(cart_class, state, age, backend,
+                                                        chunk_size, now)
+                                      for cart_class in CART_TYPES])
+    return counts
+
+
+def _load_objects(tombstone):
+    if not tombstone.location:
+        return json.loads(tombstone.archive.payload)
+    f = gzip.open(tombstone.location, "rb")
+    try:
+        for line in f:
+            record = json.loads(line)
+            if record["uuid"] == tombstone.cart_uuid:
+                return record["objects"]
+    finally:
+        f.close()
+    raise ValueError("Cart %s not found in %s" % (tombstone.cart_uuid, tombstone.location))
+
+
+def restore_cart(uuid):
+    """Restore an archived cart by UUID, returning it (or None if unknown)."""
+    with transaction.atomic(using=sharding.current_shard()), \
+            transaction.atomic(using=DEFAULT_DB_ALIAS):
+        try:
+            tombstone = CartTombstone.objects.select_for_update().get(cart_uuid=uuid)
+        except CartTombstone.DoesNotExist:
+            return None
+        for obj in serializers.deserialize("python", _load_objects(tombstone)):
+            obj.save()
+        cart_class = get_model(*tombstone.cart_model.split("."))
+        tombstone.delete()
+        log.info("Restored %s from the archive" % uuid)
+        return cart_class.objects.get(pk=tombstone.cart_id)
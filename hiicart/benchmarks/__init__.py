@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks for HiiCart.
+
+Benchmarks are plain functions registered with `register` which yield
+`BenchmarkResult` records.  They are run with the `hiicart_benchmark`
+management command, which prints the results as JSON so they can be
+diffed between revisions.
+"""
+
+import time
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+# storage for benchmark functions, in registration order
+BENCHMARKS = []
+
+
+class BenchmarkResult(object):
+    """Timing and query count for a single benchmarked step."""
+
+    def __init__(self, benchmark, step, params, timings, queries):
+        self.benchmark = benchmark
+        self.step = step
+        self.params = params
+        self.timings = timings
+        self.queries = queries
+
+    def as_dict(self):
+        timings = sorted(self.timings)
+        return {"benchmark": self.benchmark,
+                "step": self.step,
+                "params": self.params,
+                "runs": len(timings),
+                "min_ms": round(timings[0] * 1000, 3),
+                "median_ms": round(timings[len(timings) // 2] * 1000, 3),
+                "mean_ms": round(sum(timings) / len(timings) * 1000, 3),
+                "queries": self.queries}
+
+
+class Timer(object):
+    """Collects timings and query counts for named steps across runs.
+
+    The query count reported for a step is the maximum seen in any run, so
+    that a single N+1 regression is not averaged away."""
+
+    def __init__(self, benchmark, params):
+        self.benchmark = benchmark
+        self.params = params
+        self._steps = []
+        self._timings = {}
+        self._queries = {}
+
+    def step(self, name, func, *args, **kwargs):
+        """Run func, recording its wall time and queries under `name`."""
+        contexts = [CaptureQueriesContext(c) for c in connections.all()]
+        for ctx in contexts:
+            ctx.__enter__()
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            for ctx in contexts:
+                ctx.__exit__(None, None, None)
+            if name not in self._timings:
+                self._steps.append(name)
+                self._timings[name] = []
+                self._queries[name] = 0
+            self._timings[name].append(elapsed)
+            count = sum([len(ctx) for ctx in contexts])
+            self._queries[name] = max(self._queries[name], count)
+
+    def results(self):
+        return [BenchmarkResult(self.benchmark, name, self.params,
+                                self._timings[name], self._queries[name])
+                for name in self._steps]
+
+
+def register(func):
+    """Decorator to add a benchmark function to BENCHMARKS."""
+    BENCHMARKS.append(func)
+    return func
+
+
+def run_benchmarks(names=None, **options):
+    """Run the named benchmarks (or all of them), returning result dicts."""
+    # importing now registers the bundled benchmarks
+    import hiicart.benchmarks.lifecycle
+    import hiicart.benchmarks.paypal_ipn
+    import hiicart.benchmarks.unicodeconverter
+    results = []
+    for func in BENCHMARKS:
+        if names and func.__name__ not in names:
+            continue
+        for result in func(**options):
+            results.append(result.as_dict())
+    return results
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Cart lifecycle benchmark.
+
+Builds carts with a growing number of line items and payment history and
+times each stage of their life: creation, submission, IPN handling, state
+updates, cloning and expiration checks.  Gateways that would normally talk
+to the network are only exercised through code paths that don't (form
+based submission and the IPN handler methods themselves).
+"""
+
+import uuid
+from decimal import Decimal
+
+from hiicart.benchmarks import Timer, register
+from hiicart.models import HiiCart, LineItem, RecurringLineItem, Payment
+from hiicart.settings import SETTINGS as hiicart_settings
+
+# Credentials for gateways whose IPN handlers or form submission refuse to
+# start without them.  Nothing is ever sent to the gateway.
+STANDIN_SETTINGS = {
+    "COMP": {"ALLOW_RECURRING_COMP": True},
+    "PAYPAL": {"BUSINESS": "benchmark@example.com"},
+    "GOOGLE": {"MERCHANT_ID": "benchmark", "MERCHANT_KEY": "benchmark"},
+    "AMAZON": {"AWS_KEY": "benchmark", "AWS_SECRET": "benchmark"},
+}
+
+
+def _settings():
+    settings = hiicart_settings.copy()
+    for key, value in STANDIN_SETTINGS.items():
+        merged = dict(settings.get(key, {}))
+        merged.update(value)
+        settings[key] = merged
+    return settings
+
+
+def _make_cart(lineitems, recurring):
+    """Create a cart with `lineitems` one-time and `recurring` recurring items."""
+    cart = HiiCart.objects.create()
+    cart.hiicart_settings = _settings()
+    for i in range(lineitems):
+        LineItem.objects.create(cart=cart, name="Item %i" % i, quantity=1,
+                                sku="sku-%i" % i, unit_price=Decimal("1.99"))
+    for i in range(recurring):
+        RecurringLineItem.objects.create(cart=cart, name="Recurring %i" % i,
+                                         quantity=1, sku="rsku-%i" % i,
+                                         duration=1, duration_unit="MONTH",
+                                         recurring_price=Decimal("5.00"))
+    return cart
+
+
+def _add_payment_history(cart, payments):
+    """Attach `payments` PAID payments without going through save()."""
+    Payment.objects.bulk_create([
+        Payment(cart=cart, amount=Decimal("0.01"), gateway="BENCH",
+                state="PAID", transaction_id="history-%i" % i)
+        for i in range(payments)])
+
+
+def _paypal_data(cart):
+    return {"txn_id": uuid.uuid4().hex[:17], "mc_gross": "1.00",
+            "invoice": cart.cart_uuid, "payer_email": "buyer@example.com",
+            "first_name": "Bench", "last_name": "Mark"}
+
+
+def _google_data():
+    return {"google-order-number": uuid.uuid4().hex[:20],
+            "latest-charge-amount": "1.00"}
+
+
+def _amazon_data():
+    return {"transactionId": uuid.uuid4().hex, "transactionStatus": "SUCCESS",
+            "transactionAmount": "USD 1.00"}
+
+
+@register
+def lifecycle(sizes=(1, 10, 50), payments=(0, 10, 100), recurring=1, runs=3, **kwargs):
+    """Benchmark the full cart lifecycle for each (size, payments) pair."""
+    # importing now prevents circular import issues.
+    from hiicart.gateway.amazon.ipn import AmazonIPN
+    from hiicart.gateway.google.ipn import GoogleIPN
+    from hiicart.gateway.paypal.ipn import PaypalIPN
+
+    for size in sizes:
+        for history in payments:
+            timer = Timer("lifecycle", {"lineitems": size,
+                                        "recurring": recurring,
+                                        "payments": history})
+            for run in range(runs):
+                carts = []
+                try:
+                    cart = timer.step("create", _make_cart, size, recurring)
+                    carts.append(cart)
+                    timer.step("submit.comp", cart.submit, "comp")
+
+                    cart = _make_cart(size, recurring)
+                    carts.append(cart)
+                    timer.step("submit.paypal", cart.submit, "paypal")
+                    _add_payment_history(cart, history)
+                    timer.step("ipn.paypal.accept_payment",
+                               PaypalIPN(cart).accept_payment, _paypal_data(cart))
+                    timer.step("ipn.google.charge_amount",
+                               GoogleIPN(cart).charge_amount, _google_data())
+                    timer.step("ipn.amazon.accept_payment",
+                               AmazonIPN(cart).accept_payment, _amazon_data())
+                    timer.step("update_state", cart.update_state)
+                    carts.append(timer.step("clone", cart.clone))
+                    timer.step("cancel_if_expired", cart.cancel_if_expired)
+                finally:
+                    for cart in carts:
+                        cart.delete()
+            for result in timer.results():
+                yield result
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""PayPal IPN decoding benchmark.
+
+Times decoding of IPN bodies as PayPal actually sends them: plain ASCII,
+UTF-8, windows-1252 (PayPal's default) and shift-jis, comparing
+hiicart.gateway.paypal.views.decode_ipn_data with the per-field re-parsing
+the listener used to do.
+"""
+
+from urllib import quote_plus, unquote_plus
+from urlparse import parse_qs
+
+from django.http import QueryDict
+
+from hiicart.benchmarks import Timer, register
+from hiicart.gateway.paypal.views import decode_ipn_data
+
+_FIELDS = [
+    ("mc_gross", "19.95"), ("protection_eligibility", "Eligible"),
+    ("address_status", "confirmed"), ("payer_id", "LPLWNMTBWMFAY"),
+    ("tax", "0.00"), ("payment_date", "20:12:59 Jan 13, 2009 PST"),
+    ("payment_status", "Completed"), ("first_name", u"Test"),
+    ("last_name", u"User"), ("address_name", u"Test User"),
+    ("address_street", u"1 Main St"), ("address_city", u"San Jose"),
+    ("address_state", "CA"), ("address_zip", "95131"),
+    ("address_country", u"United States"), ("address_country_code", "US"),
+    ("notify_version", "2.6"), ("custom", ""), ("payer_status", "verified"),
+    ("business", "seller@example.com"), ("quantity", "1"),
+    ("verify_sign", "AtkOfCXbDm2hu0ZELryHFjY-Vb7PAUvS6nMXgysbElEn9v-1XcmSoGtf"),
+    ("payer_email", "buyer@example.com"), ("txn_id", "61E67681CH3238416"),
+    ("payment_type", "instant"), ("receiver_email", "seller@example.com"),
+    ("payment_fee", "0.88"), ("receiver_id", "S8XGHLYDW9T3S"),
+    ("txn_type", "express_checkout"), ("item_name", u"Widget"),
+    ("mc_currency", "USD"), ("item_number", ""), ("residence_country", "US"),
+    ("handling_amount", "0.00"), ("transaction_subject", ""),
+    ("payment_gross", "19.95"), ("shipping", "0.00"),
+    ("invoice", "a0e2b4f4-7bc7-4b4c-9d8e-3f0a5c6d7e8f"),
+]
+
+# (sample name, charset, names used for the buyer and item)
+_SAMPLES = [
+    ("ascii", "windows-1252", None),
+    ("utf-8", "UTF-8", {"first_name": u"José", "last_name": u"Müller",
+                        "address_city": u"東京都", "item_name": u"ウィジェット"}),
+    ("windows-1252", "windows-1252", {"first_name": u"José", "last_name": u"Müller",
+                                      "address_street": u"Straße 1",
+                                      "item_name": u"Widget – Pro"}),
+    ("shift-jis", "shift_jis", {"first_name": u"太郎", "last_name": u"山田",
+                                "address_city": u"東京都", "item_name": u"ウィジェット"}),
+]
+
+
+def ipn_body(charset, overrides=None):
+    """Build a urlencoded IPN body encoded with `charset`."""
+    overrides = overrides or {}
+    fields = [(k, overrides.get(k, v)) for k, v in _FIELDS] + [("charset", charset)]
+    return "&".join(["%s=%s" % (k, quote_plus(unicode(v).encode(charset)))
+                     for k, v in fields])
+
+
+def _legacy_decode(body):
+    """The listener's decoding before decode_ipn_data."""
+    def try_charset(value, charset):
+        decoded = unicode(unquote_plus(value), charset)
+        if u'\ufffd' in decoded or u'\x1a' in decoded:
+            raise ValueError("Invalid encoding")
+        return decoded
+    data = QueryDict(body).copy()
+    parsed_raw = parse_qs(body)
+    for key, value in data.iteritems():
+        if (u'\ufffd' in value or u'\x1a' in value) and 'charset' in data:
+            try:
+                data[key] = value = try_charset(parsed_raw[key][-1], data['charset'])
+            except Exception:
+                pass
+        if u'\ufffd' in value or u'\x1a' in value:
+            try:
+                data[key] = try_charset(parsed_raw[key][-1], 'cp1252')
+            except Exception:
+                try:
+                    data[key] = try_charset(parsed_raw[key][-1], 'shift-jis')
+                except Exception:
+                    pass
+    return data
+
+
+def _repeat(func, body, count):
+    for i in xrange(count):
+        func(body)
+
+
+@register
+def paypal_ipn(runs=3, iterations=1000, **kwargs):
+    """Benchmark decoding `iterations` IPN bodies of each sample charset."""
+    for name, charset, overrides in _SAMPLES:
+        body = ipn_body(charset, overrides)
+        timer = Timer("paypal_ipn", {"sample": name, "iterations": iterations,
+                                     "bytes": len(body)})
+        for run in range(runs):
+            timer.step("legacy", _repeat, _legacy_decode, body, iterations)
+            timer.step("decode_ipn_data", _repeat, decode_ipn_data, body, iterations)
+        for result in timer.results():
+            yield result
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Unicode conversion benchmark.
+
+Times hiicart.lib.unicodeconverter.convertToUTF8 on Google Checkout style
+cart XML of growing size, with and without the fast path, for the inputs it
+sees: rendered templates (unicode), UTF-8 and windows-1252 encoded strs.
+"""
+
+from hiicart.benchmarks import Timer, register
+from hiicart.lib.unicodeconverter import convertToUTF8
+
+_ITEM = u"""    <item>
+      <item-name>Widget – %(i)i</item-name>
+      <item-description>Straße, café &amp; crème brûlée</item-description>
+      <unit-price currency="USD">1.99</unit-price>
+      <quantity>1</quantity>
+      <merchant-item-id>sku-%(i)i</merchant-item-id>
+    </item>
+"""
+
+
+def cart_xml(lineitems):
+    """Build a unicode checkout-shopping-cart document."""
+    items = u"".join([_ITEM % {"i": i} for i in range(lineitems)])
+    return (u'<?xml version="1.0" encoding="UTF-8"?>\n'
+            u'<checkout-shopping-cart xmlns="http://checkout.google.com/schema/2">\n'
+            u'  <shopping-cart>\n    <items>\n%s    </items>\n  </shopping-cart>\n'
+            u'</checkout-shopping-cart>\n' % items)
+
+
+def _repeat(func, markup, fast, count):
+    for i in xrange(count):
+        func(markup, fast=fast)
+
+
+@register
+def unicode_conversion(sizes=(1, 10, 50), runs=3, iterations=100, **kwargs):
+    """Benchmark convertToUTF8 on each input type and cart size."""
+    for size in sizes:
+        xml = cart_xml(size)
+        inputs = [("unicode", xml), ("utf-8", xml.encode("utf-8")),
+                  ("windows-1252", xml.encode("windows-1252"))]
+        for name, markup in inputs:
+            timer = Timer("unicode_conversion", {"input": name, "lineitems": size,
+                                                 "iterations": iterations,
+                                                 "bytes": len(markup)})
+            for run in range(runs):
+                timer.step("legacy", _repeat, convertToUTF8, markup, False, iterations)
+                timer.step("fast", _repeat, convertToUTF8, markup, True, iterations)
+            for result in timer.results():
+                yield result
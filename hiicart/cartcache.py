@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Cache-aside lookups of carts by id and uuid.
+
+The same cart is looked up again and again between the checkout redirect,
+IPNs and the return page.  With the CART_CACHE_TIMEOUT setting on,
+hiicart.utils.cart_by_id and cart_by_uuid keep in Django's cache:
+
+ * each cart's field values, by class, shard and id;
+ * each uuid's cart class, shard and id, or that no cart has the uuid.
+   Unknown uuids, which bots and stale IPNs ask for a lot, are remembered
+   for CART_CACHE_MISS_TIMEOUT seconds.
+
+Cart, line item and payment saves drop their cart's entries, along with its
+snapshot (hiicart.snapshot), and so do deletes.  Inside a unit of work
+(hiicart.lib.unitofwork) they're dropped again after it commits, as another
+process may have cached the old rows in between.  Code changing carts with
+QuerySet.update(), such as hiicart.sweeper, must call `invalidate` itself,
+or the change isn't seen until the entries expire.  Carts read inside a
+transaction or from a replica aren't cached, as the transaction may roll
+back and the replica may lag.  A cart from the cache is a new instance, so
+IPN handlers still lock() and reload it before changing it.
+
+Hits and misses are counted per process; see `stats`.
+"""
+
+import threading
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.db.models import get_model
+from django.db.models.signals import post_delete
+
+from hiicart import sharding
+from hiicart.lib import unitofwork
+from hiicart.settings import SETTINGS as hiicart_settings
+
+# Cached for uuids no cart has
+MISSING = "missing"
+
+_lock = threading.Lock()
+_stats = Counter()
+
+
+def count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def stats():
+    """Hits and misses so far: {"cart_hits": 3, "uuid_misses": 1, ...}."""
+    with _lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _lock:
+        _stats.clear()
+
+
+def enabled():
+    return bool(hiicart_settings.get("CART_CACHE_TIMEOUT"))
+
+
+def _shard(db):
+    # Replicas and the default database share keys; shards have their own
+    return db if db in sharding.shards() else ""
+
+
+def cart_key(cart_class, pk, db=None):
+    return "hiicart.cart.%s.%s.%s.%s" % (cart_class._meta.app_label,
+                                         cart_class._meta.object_name, _shard(db), pk)
+
+
+def uuid_key(uuid):
+    return "hiicart.uuid.%s" % uuid
+
+
+def snapshot_key(cart_class, pk, db=None):
+    return "hiicart.snapshot.%s.%s.%s.%s" % (cart_class._meta.app_label,
+                                             cart_class._meta.object_name, _shard(db), pk)
+
+
+def _cacheable(cart):
+    db = cart._state.db or DEFAULT_DB_ALIAS
+    return db in connections and not connections[db].in_atomic_block and (
+        db == DEFAULT_DB_ALIAS or db in sharding.shards())
+
+
+def _store(cart):
+    if not enabled() or not _cacheable(cart):
+        return
+    values = dict((f.attname, cart.__dict__[f.attname]) for f in cart._meta.concrete_fields
+                  if f.attname in cart.__dict__)
+    db = cart._state.db
+    cache.set_many({cart_key(cart.__class__, cart.pk, db): values,
+                    uuid_key(cart.cart_uuid): (cart._meta.app_label, cart._meta.object_name,
+                                               db, cart.pk)},
+                   hiicart_settings["CART_CACHE_TIMEOUT"])
+
+
+def _load(cart_class, values, db):
+    cart = cart_class(**values)
+    cart._state.adding = False
+    cart._state.db = db
+    return cart
+
+
+def get_cart(cart_class, pk, db=None):
+    """A cart by id from the cache, or from the database and then cached.
+
+    Raises cart_class.DoesNotExist like get()."""
+    if not enabled():
+        return cart_class.objects.using(db).get(pk=pk)
+    db = db or router.db_for_read(cart_class)
+    values = cache.get(cart_key(cart_class, pk, db))
+    if values is not None:
+        count("cart_hits")
+        return _load(cart_class, values, db)
+    count("cart_misses")
+    cart = cart_class.objects.using(db).get(pk=pk)
+    _store(cart)
+    return cart
+
+
+def find_uuid(uuid):
+    """The cached cart with `uuid`, MISSING if there's known to be none,
+    or None if the cache doesn't know."""
+    if not enabled():
+        return None
+    identity = cache.get(uuid_key(uuid))
+    if identity == MISSING:
+        count("uuid_negative_hits")
+        return MISSING
+    if identity is None:
+        count("uuid_misses")
+        return None
+    count("uuid_hits")
+    app_label, object_name, db, pk = identity
+    cart_class = get_model(app_label, object_name)
+    try:
+        return get_cart(cart_class, pk, db)
+    except cart_class.DoesNotExist:
+        cache.delete(uuid_key(uuid))
+        return None
+
+
+def remember_uuid(uuid, cart):
+    """Cache what a database lookup of `uuid` found; None caches a miss."""
+    if not enabled():
+        return
+    if cart is None:
+        cache.set(uuid_key(uuid), MISSING, hiicart_settings.get("CART_CACHE_MISS_TIMEOUT"))
+    else:
+        _store(cart)
+
+
+def forget_uuids(uuids):
+    """Drop what's cached for `uuids`, ex. misses for carts since inserted
+    without a save()."""
+    if enabled():
+        cache.delete_many([uuid_key(uuid) for uuid in uuids])
+
+
+def invalidate(instance):
+    """Drop the cached entries of the cart `instance` is or belongs to."""
+    from hiicart.models import HiiCartBase, LineItemBase, PaymentBase
+    if isinstance(instance, HiiCartBase):
+        cart_class, pk = instance.__class__, instance.pk
+    elif isinstance(instance, (LineItemBase, PaymentBase)):
+        cart_class, pk = instance._meta.get_field("cart").rel.to, instance.cart_id
+    else:
+        return
+    if not (enabled() or hiicart_settings.get("SNAPSHOT_TIMEOUT")) or pk is None:
+        return
+    db = instance._state.db
+    keys = [cart_key(cart_class, pk, db), snapshot_key(cart_class, pk, db)]
+    if cart_class is instance.__class__:
+        keys.append(uuid_key(instance.cart_uuid))
+    cache.delete_many(keys)
+    if unitofwork.current() is not None:
+        unitofwork.on_commit(cache.delete_many, keys)
+
+
+def _deleted(sender, instance, **kwargs):
+    invalidate(instance)
+
+
+def connect():
+    # Saves invalidate directly; deletes, including cascades, come through here
+    post_delete.connect(_deleted, dispatch_uid="hiicart.cartcache.post_delete")
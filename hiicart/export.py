@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Streaming export of carts with their line items and payments.
+
+`export_rows` yields one flat row per line item and per payment, each
+carrying its cart's columns, and one bare "cart" row for a cart with
+neither.  Carts are read in keyset chunks and each chunk's line items (one
+query per registered line item type) and payments are streamed with
+.iterator(), so memory stays at one chunk however many rows are exported.
+`csv_lines` and `jsonl_lines` turn the rows into lines for a file or a
+StreamingHttpResponse.
+
+Used by the hiicart_export management command and the export view.
+"""
+
+import csv
+import json
+from datetime import datetime, time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_date, parse_datetime
+
+from hiicart import sharding
+from hiicart.models import CART_TYPES
+from hiicart.utils import keyset_chunks
+
+FORMATS = ("csv", "jsonl")
+CART_COLUMNS = ("cart_id", "cart_uuid", "cart_state", "cart_gateway", "cart_created",
+                "cart_total", "bill_email")
+LINEITEM_COLUMNS = ("item_type", "item_id", "sku", "name", "quantity", "unit_price",
+                    "recurring_price", "duration", "duration_unit", "item_total")
+PAYMENT_COLUMNS = ("payment_id", "payment_state", "payment_gateway", "amount",
+                   "transaction_id", "payment_created")
+COLUMNS = ("record",) + CART_COLUMNS + LINEITEM_COLUMNS + PAYMENT_COLUMNS
+
+
+def parse_when(value):
+    """A datetime from "YYYY-MM-DD" or "YYYY-MM-DD HH:MM[:SS]", or None."""
+    if not value:
+        return None
+    when = parse_datetime(value)
+    if when is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError("Invalid date: %s" % value)
+        when = datetime.combine(day, time())
+    return when
+
+
+def filter_carts(queryset, start=None, end=None, states=None, gateways=None):
+    """Carts created in [start, end), in one of `states`, through one of `gateways`."""
+    if start:
+        queryset = queryset.filter(created__gte=start)
+    if end:
+        queryset = queryset.filter(created__lt=end)
+    if states:
+        queryset = queryset.filter(_cart_state__in=states)
+    if gateways:
+        queryset = queryset.filter(gateway__in=gateways)
+    return queryset
+
+
+def _cart_row(cart):
+    return {"cart_id": cart.pk, "cart_uuid": cart.cart_uuid, "cart_state": cart.state,
+            "cart_gateway": cart.gateway, "cart_created": cart.created,
+            "cart_total": cart._total, "bill_email": cart.bill_email}
+
+
+def _lineitem_row(item):
+    return {"record": "lineitem", "item_type": item.__class__.__name__, "item_id": item.pk,
+            "sku": item.sku, "name": item.name, "quantity": item.quantity,
+            "unit_price": getattr(item, "unit_price", None),
+            "recurring_price": getattr(item, "recurring_price", None),
+            "duration": getattr(item, "duration", None),
+            "duration_unit": getattr(item, "duration_unit", None),
+            "item_total": item._total}
+
+
+def _payment_row(payment):
+    return {"record": "payment", "payment_id": payment.pk, "payment_state": payment.state,
+            "payment_gateway": payment.gateway, "amount": payment.amount,
+            "transaction_id": payment.transaction_id, "payment_created": payment.created}
+
+
+def _by_cart(queryset, pks, row_fn, rows):
+    for obj in queryset.filter(cart__in=pks).order_by("cart", "pk").iterator():
+        rows.setdefault(obj.cart_id, []).append(row_fn(obj))
+
+
+def _chunk_rows(cart_class, carts, alias):
+    pks = [cart.pk for cart in carts]
+    children = {}
+    for cls in sorted(cart_class.lineitem_types, key=lambda cls: cls.__name__):
+        _by_cart(cls.objects.using(alias), pks, _lineitem_row, children)
+    _by_cart(cart_class.payment_class.objects.using(alias), pks, _payment_row, children)
+    for cart in carts:
+        cart_row = _cart_row(cart)
+        rows = children.pop(cart.pk, None)
+        if not rows:
+            cart_row["record"] = "cart"
+            yield cart_row
+        for row in rows or []:
+            row.update(cart_row)
+            yield row
+
+
+def export_rows(start=None, end=None, states=None, gateways=None, chunk_size=500,
+                cart_classes=None):
+    """Yield a row dict (see COLUMNS) per line item and payment of the matching carts.
+
+    Every shard is exported in turn."""
+    for alias in sharding.shard_aliases():
+        for cart_class in cart_classes or CART_TYPES:
+            carts = filter_carts(cart_class.objects.using(alias), start, end, states, gateways)
+            for chunk in keyset_chunks(carts, chunk_size):
+                for row in _chunk_rows(cart_class, chunk, alias):
+                    yield row
+
+
+class _Line(object):
+    """File-like object handing back what csv.writer writes."""
+
+    def write(self, value):
+        return value
+
+
+def _encode(value):
+    if value is None:
+        return ""
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+
+def csv_lines(rows, header=True):
+    """Yield the header and then each row as a line of CSV."""
+    writer = csv.writer(_Line())
+    if header:
+        yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow([_encode(row.get(column)) for column in COLUMNS])
+
+
+def jsonl_lines(rows):
+    """Yield each row as a line of JSON."""
+    for row in rows:
+        yield json.dumps(dict((column, row.get(column)) for column in COLUMNS),
+                         cls=DjangoJSONEncoder, sort_keys=True) + "\n"
+
+
+def export_lines(format="csv", **filters):
+    """Lines of an export in `format`; `filters` are passed to export_rows."""
+    rows = export_rows(**filters)
+    if format == "jsonl":
+        return jsonl_lines(rows)
+    return csv_lines(rows)
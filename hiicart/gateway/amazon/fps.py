@@ -4,13 +4,14 @@ import base64
 import hashlib
 import hmac
 import urllib
-import urllib2
 import urlparse
 from datetime import datetime
 from decimal import Decimal
 from django.utils.datastructures import SortedDict
 from django.utils.safestring import mark_safe
 from urllib2 import HTTPError
+from hiicart.lib import http
+from hiicart.lib.instrumentation import http_call
 
 
 LIVE_FPS_URL = "https://fps.amazonaws.com/"
@@ -25,6 +26,7 @@ def _fps_base_url(settings):
     return url
 
 
+@http_call
 def do_fps(action, method, settings, **params):
     """Make a request against the FPS api."""
     values = {"AWSAccessKeyId" : settings["AWS_KEY"],
@@ -37,18 +39,11 @@ def do_fps(action, method, settings, **params):
     values["Signature"] = generate_signature(method, values,
                                              _fps_base_url(settings), settings)
     url = "%s?%s" % (_fps_base_url(settings), urllib.urlencode(values))
-    request = urllib2.Request(url)
-    #request.add_header("Content-type", "application/x-www-form-urlencoded")
-    try:
-        req = urllib2.urlopen(request)
-        response = req.read()
-        #response = urllib2.urlopen(request).read()
-    except HTTPError, e:
-        if e.code == 400:
-            response = e.read()
-        else:
-            raise
-    return response
+    response, content = http.request(url)
+    # FPS errors come back as 400s with an XML body describing them
+    if response.status >= 400 and response.status != 400:
+        raise HTTPError(url, response.status, response.reason, response, None)
+    return content
 
 
 def generate_signature(verb, values, request_url, settings):
@@ -123,7 +123,7 @@ class AmazonGateway(PaymentGatewayBase):
             item.recurring = False
             item.save()
 
-    def sanitize_clone(self):
+    def sanitize_clone(self, cart):
         "Nothing to do here..."
         return self.cart
 
@@ -8,7 +8,7 @@ from decimal import Decimal
 import logging
 from hiicart.gateway.amazon import fps
 from hiicart.gateway.amazon.settings import SETTINGS as default_settings
-from hiicart.gateway.base import IPNBase
+from hiicart.gateway.base import IPNBase, locks_cart
 
 logger = logging.getLogger("hiicart.gateway.amazon.ipn")
 
@@ -17,6 +17,9 @@ _FPS_NS = "{http://fps.amazonaws.com/doc/2008-09-17/}"
 class AmazonIPN(IPNBase):
     """Payment Gateway for Amazon Payments."""
 
+    # Pay requests lock the cart only to record Amazon's response
+    unlocked_methods = ("make_pay_request",)
+
     def __init__(self, cart):
         super(AmazonIPN, self).__init__("amazon", cart, default_settings)
 
@@ -102,6 +105,11 @@ class AmazonIPN(IPNBase):
                               SenderTokenId=token,
                               **{"TransactionAmount.CurrencyCode": "USD",
                                  "TransactionAmount.Value": self.cart.total})
+        return self._record_pay_response(response)
+
+    @locks_cart
+    def _record_pay_response(self, response):
+        """Record the result of a Pay request, returning its status."""
         xml = ET.XML(response)
         self.log.debug("FPS response: %s" % xml)
         status = xml.find(".//%sTransactionStatus" % _FPS_NS)
@@ -9,6 +9,7 @@ from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 from hiicart.gateway.amazon.ipn import AmazonIPN
 from hiicart.gateway.countries import COUNTRIES
+from hiicart.lib.unitofwork import unit_of_work
 from hiicart.utils import format_exceptions, cart_by_uuid, format_data
 from hiicart.models import HiiCart
 
@@ -25,6 +26,7 @@ def _find_cart(request_data):
 
 @csrf_exempt
 @format_exceptions
+@unit_of_work
 @never_cache
 def cbui(request, settings=None):
     """
@@ -97,6 +99,7 @@ def cbui(request, settings=None):
 
 @csrf_exempt
 @format_exceptions
+@unit_of_work
 @never_cache
 def ipn(request):
     """Instant Payment Notification handler."""
@@ -10,6 +10,7 @@ from hiicart.gateway.base import PaymentGatewayBase, CancelResult, SubmitResult,
 from hiicart.gateway.authorizenet.forms import PaymentForm
 from hiicart.gateway.authorizenet.ipn import AuthorizeNetIPN, FORM_MODEL_TRANSLATION
 from hiicart.gateway.authorizenet.settings import SETTINGS as default_settings
+from hiicart.lib.unitofwork import unit_of_work
 
 POST_URL = "https://secure.authorize.net/gateway/transact.dll"
 POST_TEST_URL = "https://test.authorize.net/gateway/transact.dll"
@@ -125,6 +126,7 @@ class AuthorizeNetGateway(PaymentGatewayBase):
             else:
                 data['return_url'] = data['return_url'] + "?http_status=200"
 
+    @unit_of_work
     def confirm_payment(self, request):
         """
         Confirms payment result with AuthorizeNet.
@@ -10,6 +10,7 @@ from django.shortcuts import render_to_response
 from hiicart.gateway.base import GatewayError
 from hiicart.gateway.authorizenet.ipn import AuthorizeNetIPN
 from hiicart.gateway.authorizenet.gateway import AuthorizeNetGateway
+from hiicart.lib.unitofwork import unit_of_work
 from hiicart.utils import format_exceptions, cart_by_uuid, format_data
 from urllib import unquote_plus
 from urlparse import parse_qs
@@ -24,6 +25,7 @@ def _find_cart(data):
 
 @csrf_exempt
 @format_exceptions
+@unit_of_work
 @never_cache
 def ipn(request):
     """
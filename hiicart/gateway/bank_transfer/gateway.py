@@ -1,5 +1,6 @@
 from hiicart.gateway.base import PaymentGatewayBase, TransactionResult, SubmitResult, GatewayError, CancelResult
 from hiicart.gateway.bank_transfer.forms import PaymentForm, FORM_MODEL_TRANSLATION
+from hiicart.lib.unitofwork import unit_of_work
 
 class BankTransferGateway(PaymentGatewayBase):
     """Bank Transfer processor"""
@@ -12,6 +13,7 @@ class BankTransferGateway(PaymentGatewayBase):
         """Returns an instance of PaymentForm."""
         return PaymentForm()
 
+    @unit_of_work
     def confirm_payment(self, request):
         """
         Records billing and shipping info for Bank Transfers
@@ -90,6 +92,6 @@ class BankTransferGateway(PaymentGatewayBase):
         """Refund a payment."""
         return SubmitResult(None)
 
-    def sanitize_clone(self):
+    def sanitize_clone(self, cart):
         """Nothing to fix here."""
         pass
@@ -1,5 +1,11 @@
+import functools
 import logging
 import os
+import types
+from django.db import router
+from hiicart import sharding
+from hiicart.lib import unitofwork
+from hiicart.lib.instrumentation import instrumented
 from hiicart.utils import call_func
 
 
@@ -12,6 +18,8 @@ class _SharedBase(object):
 
     Created because they have significant overlapping functionality.
     """
+    # Cart-specific settings resolved ahead of time, or None to call CART_SETTINGS_FN
+    resolved_cart_settings = None
 
     def __init__(self, name, cart, default_settings=None):
         """Initalize logger and settings.
@@ -43,16 +51,28 @@ class _SharedBase(object):
         we're able to have different carts use different google accounts."""
         if self.cart.hiicart_settings.get("STORE_SETTINGS_FN"):
             s = call_func(self.cart.hiicart_settings["STORE_SETTINGS_FN"], self.cart)
+            # Queries made for this cart go to its store's shard
+            sharding.activate_cart(self.cart, s or {})
             if s:
                 self.settings.update(s)
                 return
+        else:
+            sharding.activate_cart(self.cart)
         self.settings = self._settings_base.copy()  # reset to defaults
 
     def _update_with_cart_settings(self, cart_settings_kwargs):
         """Pull cart-specific settings and update self.settings with them.
         We need an DI facility to get cart-specific settings in. This way,
-        we're able to have different carts use different google accounts."""
-        if self.cart.hiicart_settings.get("CART_SETTINGS_FN"):
+        we're able to have different carts use different google accounts.
+
+        Settings already resolved for the cart, by HiiCartBase.submit_many,
+        are used as they are."""
+        if self.resolved_cart_settings is not None:
+            s = self.resolved_cart_settings
+            if s:
+                self.settings.update(s)
+                return
+        elif self.cart.hiicart_settings.get("CART_SETTINGS_FN"):
             cart_settings_kwargs = cart_settings_kwargs or {}
             s = call_func(self.cart.hiicart_settings["CART_SETTINGS_FN"],
                           self.cart, **cart_settings_kwargs)
@@ -82,12 +102,73 @@ class _SharedBase(object):
                                 self.name, ", ".join(errors)))
 
 
+def _ipn_operation(method):
+    """Name IPN operations after the class of the handler actually in use."""
+    return lambda handler, *args, **kwargs: "ipn.%s.%s" % (
+        handler.__class__.__name__, method)
+
+
+def locks_cart(method):
+    """Run an IPN handler method with the handler's cart locked.
+
+    IPNMetaclass applies this to public methods.  Methods listed in
+    `unlocked_methods` because they call the gateway can use it on a
+    private method recording what the gateway returned."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._cart_locked or self.cart.pk is None:
+            return method(self, *args, **kwargs)
+        db = router.db_for_write(self.cart.__class__, instance=self.cart)
+        # Signals and cache invalidations wait for the commit
+        with unitofwork.unit_of_work(db):
+            self.cart.lock()
+            self._cart_locked = True
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self._cart_locked = False
+    return wrapper
+
+
+class IPNMetaclass(type):
+    """Instrument and lock the public methods of IPN handlers.
+
+    Each public method is measured as "ipn.<HandlerClass>.<method>".
+    See hiicart.lib.instrumentation.
+
+    Public methods other than those listed in `unlocked_methods` run in a
+    unit of work holding a row lock on the handler's cart, which is reloaded
+    once locked.  IPNs for the same cart, ex. PayPal's subscr_signup and
+    subscr_payment arriving together, are handled one after the other and
+    each sees the other's payments and state; IPNs for different carts run
+    in parallel.  Inside an outer unit of work the lock is held until it
+    commits.  Methods which call the gateway over HTTP are listed in
+    `unlocked_methods` so the lock isn't held during the call."""
+    def __new__(cls, name, bases, attrs):
+        unlocked = attrs.get("unlocked_methods", ())
+        for base in bases:
+            unlocked += getattr(base, "unlocked_methods", ())
+        for attr, value in attrs.items():
+            if not attr.startswith("_") and isinstance(value, types.FunctionType):
+                if attr not in unlocked:
+                    value = locks_cart(value)
+                attrs[attr] = instrumented(_ipn_operation(attr))(value)
+        return super(IPNMetaclass, cls).__new__(cls, name, bases, attrs)
+
+
 class IPNBase(_SharedBase):
     """
     Base class for IPN handlers.
 
     Provides shared functionality among IPN implementations
     """
+    __metaclass__ = IPNMetaclass
+
+    # Methods which don't need the cart locked, ex. ones verifying the IPN
+    # with the gateway over HTTP
+    unlocked_methods = ("confirm_ipn_data", "confirm_cvs_ipn_data", "verify_signature")
+    _cart_locked = False
+
     def __init__(self, *args, **kwargs):
         super(IPNBase, self).__init__(*args, **kwargs)
         self.log = logging.getLogger("hiicart.gateway.%s.ipn" % self.name)
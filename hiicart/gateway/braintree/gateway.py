@@ -15,6 +15,7 @@ from hiicart.gateway.braintree.ipn import BraintreeIPN
 from hiicart.gateway.braintree.settings import SETTINGS as default_settings
 from hiicart.gateway.braintree.tasks import update_payment_status
 from hiicart.models import HiiCart
+from hiicart.lib.unitofwork import unit_of_work
 
 logger = logging.getLogger('hiicart.gateway.braintree.gateway')
 
@@ -98,6 +99,7 @@ class BraintreeGateway(PaymentGatewayBase):
             tr_data = braintree.Transaction.tr_data_for_sale(data, redirect_url)
         return tr_data
 
+    @unit_of_work
     def confirm_payment(self, request, gateway_dict=None):
         """
         Confirms payment result with Braintree.
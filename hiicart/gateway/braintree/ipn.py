@@ -2,7 +2,8 @@ import logging
 import braintree
 from datetime import datetime
 from decimal import Decimal
-from hiicart.gateway.base import IPNBase, TransactionResult, SubscriptionResult
+from hiicart.gateway.base import (GatewayError, IPNBase, SubscriptionResult,
+                                  TransactionResult, locks_cart)
 from hiicart.gateway.braintree.settings import SETTINGS as default_settings
 from hiicart.models import CART_TYPES
 
@@ -20,6 +21,9 @@ BRAINTREE_STATUS = {"PAID": ["settled", "authorized", "settling",
 class BraintreeIPN(IPNBase):
     """Braintree IPN Handler."""
 
+    # These call Braintree, then lock the cart to record the result
+    unlocked_methods = ("update_order_status", "void_order", "create_subscription")
+
     def __init__(self, cart):
         super(BraintreeIPN, self).__init__("braintree", cart, default_settings)
         self._require_settings(["MERCHANT_ID", "MERCHANT_KEY",
@@ -138,10 +142,7 @@ class BraintreeIPN(IPNBase):
         """
         result = braintree.Transaction.void(transaction_id)
         if result.is_success:
-            payment = self.cart.payments.filter(transaction_id=transaction_id)
-            if payment:
-                payment[0].state = "FAILED"
-                payment[0].save()
+            self._fail_payment(transaction_id)
             status = 'success'
         else:
             status = result.transaction.status if getattr(result, 'transaction', None) else 'error'
@@ -149,6 +150,13 @@ class BraintreeIPN(IPNBase):
                                  success=result.is_success, status=status,
                                  gateway_result=result)
 
+    @locks_cart
+    def _fail_payment(self, transaction_id):
+        payment = self.cart.payments.filter(transaction_id=transaction_id)
+        if payment:
+            payment[0].state = "FAILED"
+            payment[0].save()
+
     def create_subscription(self, payment_method, gateway_plan_id=None, gateway_dict=None):
         item = self.cart.recurring_lineitems[0]
 
@@ -169,15 +177,18 @@ class BraintreeIPN(IPNBase):
 
         transaction_id = None
         if result.is_success:
-            item.payment_token = result.subscription.id
-            item.is_active = True
-            item.save()
-            self.cart.update_state()
-            self.cart.save()
-
+            self._activate_subscription(item, result.subscription.id)
             transaction_id = result.subscription.id
             status = 'success'
         else:
             status = result.transaction.status if hasattr(result, 'transaction') else result.subscription.status
         return SubscriptionResult(transaction_id=transaction_id, success=result.is_success,
                                   status=status, gateway_result=result)
+
+    @locks_cart
+    def _activate_subscription(self, item, subscription_id):
+        item.payment_token = subscription_id
+        item.is_active = True
+        item.save()
+        self.cart.update_state()
+        self.cart.save()
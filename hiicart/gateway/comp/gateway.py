@@ -34,7 +34,7 @@ class CompGateway(PaymentGatewayBase):
             payment = self._create_payment(self.cart.total, None, "PAID")
             payment.save()
 
-    def sanitize_clone(self):
+    def sanitize_clone(self, cart):
         """Nothing gateway-specific here."""
         pass
 
@@ -1,5 +1,4 @@
 import base64
-import httplib2
 import xml.etree.cElementTree as ET
 from decimal import Decimal
 
@@ -8,6 +7,8 @@ from django.template import Context, loader
 from hiicart.gateway.base import PaymentGatewayBase, SubmitResult, CancelResult
 from hiicart.gateway.google.settings import SETTINGS as default_settings
 from hiicart.lib.unicodeconverter import convertToUTF8
+from hiicart.lib import http
+from hiicart.lib.instrumentation import http_call
 
 
 class GoogleGateway(PaymentGatewayBase):
@@ -40,9 +41,9 @@ class GoogleGateway(PaymentGatewayBase):
         # TODO: Query Google to validate credentials
         return True
 
+    @http_call
     def _send_xml(self, url, xml):
         """Send a command to the Checkout Order Processing API."""
-        http = httplib2.Http()
         headers = {"Content-type": "application/x-www-form-urlencoded",
                    "Authorization": "Basic %s" % self.get_basic_auth()}
         return http.request(url, "POST", xml, headers=headers)
@@ -76,7 +77,7 @@ class GoogleGateway(PaymentGatewayBase):
         return base64.b64encode("%s:%s" % (self.settings["MERCHANT_ID"],
                                            self.settings["MERCHANT_KEY"]))
 
-    def sanitize_clone(self):
+    def sanitize_clone(self, cart):
         """Remove any gateway-specific changes to a cloned cart."""
         pass
 
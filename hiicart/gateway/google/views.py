@@ -9,6 +9,7 @@ from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 from hiicart.gateway.google.gateway import GoogleGateway
 from hiicart.gateway.google.ipn import GoogleIPN
+from hiicart.lib.unitofwork import unit_of_work
 from hiicart.utils import format_exceptions, call_func, cart_by_uuid, format_data
 
 
@@ -38,6 +39,7 @@ def _find_cart(data):
 
 @csrf_exempt
 @format_exceptions
+@unit_of_work
 @never_cache
 def ipn(request):
     """View to receive notifications from Google"""
@@ -1,7 +1,6 @@
 import os
 import urllib
 import urllib2
-import httplib2
 from cgi import parse_qs
 
 from decimal import Decimal
@@ -15,6 +14,8 @@ from django.utils.safestring import mark_safe
 
 from hiicart.gateway.base import PaymentGatewayBase, CancelResult, SubmitResult, GatewayError
 from hiicart.gateway.paypal.settings import SETTINGS as default_settings
+from hiicart.lib import http
+from hiicart.lib.instrumentation import http_call
 
 PAYMENT_CMD = {
     "BUY_NOW" : "_xclick",
@@ -77,10 +78,10 @@ class PaypalGateway(PaymentGatewayBase):
             url = NVP_SIGNATURE_TEST_URL
         return mark_safe(url)
 
+    @http_call
     def _do_nvp(self, method, params_dict):
         if not self.settings['API_USERNAME']:
             raise GatewayError("You must have NVP API credentials to do API operations (%s) with Paypal" % method)
-        http = httplib2.Http()
         params_dict['method'] = method
         params_dict['user'] = self.settings['API_USERNAME']
         params_dict['pwd'] = self.settings['API_PASSWORD']
@@ -255,7 +256,7 @@ class PaypalGateway(PaymentGatewayBase):
         """This Paypal API doesn't support manually charging subscriptions."""
         pass
 
-    def sanitize_clone(self):
+    def sanitize_clone(self, cart):
         """Nothing to fix here."""
         pass
 
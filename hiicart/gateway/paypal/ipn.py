@@ -1,7 +1,8 @@
-import urllib2
 from django.utils.safestring import mark_safe
 from hiicart.gateway.base import IPNBase
 from hiicart.gateway.paypal.settings import SETTINGS as default_settings
+from hiicart.lib import http
+from hiicart.lib.instrumentation import http_call
 
 
 POST_URL = "https://www.paypal.com/cgi-bin/webscr"
@@ -149,17 +150,15 @@ class PaypalIPN(IPNBase):
         self.cart.update_state()
         self.cart.save()
 
+    @http_call
     def confirm_ipn_data(self, raw_data):
         """Confirm IPN data using string raw post data.
 
         Overcomes issues with unicode and urlencode.
         """
         raw_data += "&cmd=_notify-validate"
-        req = urllib2.Request(self.submit_url)
-        req.add_header("Content-type", "application/x-www-form-urlencoded")
-        result = urllib2.urlopen(req, raw_data)
-        ret = result.read()
-        if ret == "VERIFIED":
+        response, content = http.post_form(self.submit_url, raw_data)
+        if content == "VERIFIED":
             return True
         else:
             return False
@@ -4,14 +4,14 @@
 """Paypal Views"""
 
 import logging
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import HttpResponse, HttpResponseBadRequest, QueryDict
 from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 from hiicart.gateway.base import GatewayError
 from hiicart.gateway.paypal.ipn import PaypalIPN
+from hiicart.lib.unitofwork import unit_of_work
 from hiicart.utils import format_exceptions, cart_by_uuid, format_data
 from urllib import unquote_plus
-from urlparse import parse_qs
 
 
 logger = logging.getLogger("hiicart.gateway.paypal")
@@ -26,14 +26,60 @@ def _find_cart(data):
     return cart_by_uuid(invoice[:36])
 
 
-def try_charset(value, charset):
-    decoded = unicode(unquote_plus(value), charset)
+# Paypal defaults to cp1252, because it hates you, and some accounts send
+# shift-jis.  Fields are tried against these after utf-8 and the declared
+# charset.
+FALLBACK_CHARSETS = ("cp1252", "shift-jis")
+
+
+def _decode(value, charset):
+    """Decode value, returning None if it doesn't decode cleanly."""
+    try:
+        decoded = unicode(value, charset)
+    except (UnicodeDecodeError, LookupError):
+        return None
     # Check for invalid chars after decoding
     if u'\ufffd' in decoded or u'\x1a' in decoded:
-        raise "Invalid encoding"
+        return None
     return decoded
 
 
+def decode_ipn_data(body):
+    """Decode a raw IPN body into an immutable QueryDict.
+
+    The body is split and unquoted once.  Bodies which are pure ASCII (the
+    usual case) are done after that.  Otherwise the values are decoded with
+    utf-8, or the declared `charset` if utf-8 fails, and only fields which
+    fail with that fall back to the others and FALLBACK_CHARSETS in turn."""
+    pairs = []
+    for chunk in body.split("&"):
+        if chunk:
+            key, _, value = chunk.partition("=")
+            pairs.append((unquote_plus(key), unquote_plus(value)))
+    values = "".join([value for key, value in pairs])
+    try:
+        values.decode("ascii")
+        charsets = ["ascii"]
+    except UnicodeDecodeError:
+        declared = [v for k, v in pairs if k == "charset"]
+        charsets = ["utf-8"] + declared[-1:] + list(FALLBACK_CHARSETS)
+        # The fallbacks decode almost anything, so are never used wholesale
+        if _decode(values, "utf-8") is None and declared:
+            if _decode(values, declared[-1]) is not None:
+                charsets.insert(0, charsets.pop(1))
+    data = QueryDict("", mutable=True)
+    for key, value in pairs:
+        for charset in charsets:
+            decoded = _decode(value, charset)
+            if decoded is not None:
+                break
+        else:
+            decoded = unicode(value, "utf-8", "replace")
+        data.appendlist(unicode(key, "utf-8", "replace"), decoded)
+    data._mutable = False
+    return data
+
+
 def _base_paypal_ipn_listener(request, ipn_class):
     """
     PayPal IPN (Instant Payment Notification)
@@ -47,7 +93,7 @@ def _base_paypal_ipn_listener(request, ipn_class):
         logger.error("IPN Request not POSTed")
         return HttpResponseBadRequest("Requests must be POSTed")
 
-    data = request.POST.copy()
+    data = decode_ipn_data(request.body)
     logger.info("IPN Received:\n%s" % format_data(data))
     # Verify the data with Paypal
     cart = _find_cart(data)
@@ -58,28 +104,6 @@ def _base_paypal_ipn_listener(request, ipn_class):
     if not handler.confirm_ipn_data(request.body):
         logger.error("Paypal IPN Confirmation Failed.")
         raise GatewayError("Paypal IPN Confirmation Failed.")
-    # Paypal defaults to cp1252, because it hates you
-    # So, if we end up with the unicode char that means
-    # "unknown char" (\ufffd), try to transcode from cp1252
-    parsed_raw = parse_qs(request.body)
-    for key, value in data.iteritems():
-        # If paypal provided a charset attempt to decode with that
-        if (u'\ufffd' in value or u'\x1a' in value) and 'charset' in data:
-            try:
-                data[key] = value = try_charset(parsed_raw[key][-1], data['charset'])
-            except Exception:
-                pass
-
-        # Otherwise fallback to original behavior
-        if u'\ufffd' in value or u'\x1a' in value:
-            try:
-                data[key] = try_charset(parsed_raw[key][-1], 'cp1252')
-            except:
-                # Fallback to shift-jis if cp1252 fails
-                try:
-                    data[key] = try_charset(parsed_raw[key][-1], 'shift-jis')
-                except:
-                    pass
     txn_type = data.get("txn_type", "")
     status = data.get("payment_status", "unknown")
     if txn_type == "subscr_cancel" or txn_type == "subscr_eot":
@@ -106,6 +130,7 @@ def _base_paypal_ipn_listener(request, ipn_class):
 
 @csrf_exempt
 @format_exceptions
+@unit_of_work
 @never_cache
 def ipn(request):
     return _base_paypal_ipn_listener(request, PaypalIPN)
@@ -4,7 +4,6 @@ API Reference: https://cms.paypal.com/us/cgi-bin/?cmd=_render-content&content_ID
 """
 # TODO: Make this an object that gets its own settings (using _SharedBase?)
 
-import httplib2
 import urllib
 import urllib2
 
@@ -12,6 +11,8 @@ from django.utils import timezone
 from decimal import Decimal
 from django.core.urlresolvers import reverse
 from urllib import unquote
+from hiicart.lib import http
+from hiicart.lib.instrumentation import http_call
 
 LIVE_ENDPOINT = "https://api-3t.paypal.com/nvp"
 SANDBOX_ENDPOINT = "https://api-3t.sandbox.paypal.com/nvp"
@@ -27,6 +28,7 @@ def _ipn_url(settings):
     else:
         return settings["IPN_URL"]
 
+@http_call
 def _send_command(params, settings):
     """Send a command to the NVP API."""
     params["VERSION"] = "64.4"
@@ -37,8 +39,7 @@ def _send_command(params, settings):
     keys.sort()
     pairs = [(k,params[k]) for k in keys]
     url = LIVE_ENDPOINT if settings["LIVE"] else SANDBOX_ENDPOINT
-    response, data = httplib2.Http().request(url, "POST",
-                                             urllib.urlencode(pairs))
+    response, data = http.request(url, "POST", urllib.urlencode(pairs))
     data = unquote(data)
     # TODO: logging
     return dict([(l,r) for l,r in [p.split('=') for p in data.split('&')]])
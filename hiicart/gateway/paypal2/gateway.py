@@ -38,7 +38,7 @@ class Paypal2Gateway(PaymentGatewayBase):
         #       takes care of the recurring charges.
         pass
 
-    def sanitize_clone(self):
+    def sanitize_clone(self, cart):
         """Nothing to do here..."""
         return self.cart
 
@@ -1,6 +1,7 @@
-import urllib2
 from hiicart.gateway.base import IPNBase
 from hiicart.gateway.paypal2.settings import SETTINGS as default_settings
+from hiicart.lib import http
+from hiicart.lib.instrumentation import http_call
 
 
 class Paypal2IPN(IPNBase):
@@ -51,6 +52,7 @@ class Paypal2IPN(IPNBase):
         self.cart.update_state()
         self.cart.save()
 
+    @http_call
     def confirm_ipn_data(self, raw_data):
         """Confirm IPN data using string raw post data.
 
@@ -62,10 +64,8 @@ class Paypal2IPN(IPNBase):
         else:
             submit_url = "https://www.sandbox.paypal.com/cgi-bin/webscr"
         raw_data += "&cmd=_notify-validate"
-        req = urllib2.Request(submit_url)
-        req.add_header("Content-type", "application/x-www-form-urlencoded")
-        result = urllib2.urlopen(req, raw_data).read()
-        return urllib2.urlopen(req, raw_data).read() == "VERIFIED"
+        response, content = http.post_form(submit_url, raw_data)
+        return content == "VERIFIED"
 
     def recurring_payment_profile_cancelled(self, data):
         """Notification that a recurring profile was cancelled."""
@@ -13,6 +13,7 @@ from django.views.decorators.csrf import csrf_exempt
 from hiicart.gateway.base import GatewayError
 from hiicart.gateway.paypal2 import api
 from hiicart.gateway.paypal2.ipn import Paypal2IPN
+from hiicart.lib.unitofwork import unit_of_work
 from hiicart.utils import format_exceptions, cart_by_uuid, format_data
 
 
@@ -41,6 +42,7 @@ def _find_cart(data):
 
 @csrf_exempt
 @format_exceptions
+@unit_of_work
 @never_cache
 def ipn(request):
     """Instant Payment Notification ipn.
@@ -1,9 +1,10 @@
 """Common functions to make calls to Paypal's Adaptive Payment API."""
 
-import httplib2
 import simplejson
 import urllib
 import urllib2
+from hiicart.lib import http
+from hiicart.lib.instrumentation import http_call
 
 LIVE_ENDPOINT = "https://svcs.paypal.com/AdaptivePayments/%s"
 SANDBOX_ENDPOINT = "https://svcs.sandbox.paypal.com/AdaptivePayments/%s"
@@ -14,9 +15,9 @@ def _endpoint_url(settings):
     else:
         return SANDBOX_ENDPOINT
 
+@http_call
 def _send_command(settings, operation, params):
     """Send a command to the Adaptive API."""
-    http = httplib2.Http()
     headers = {"X-PAYPAL-SECURITY-USERID": settings["USERID"],
                "X-PAYPAL-SECURITY-PASSWORD": settings["PASSWORD"],
                "X-PAYPAL-SECURITY-SIGNATURE": settings["SIGNATURE"],
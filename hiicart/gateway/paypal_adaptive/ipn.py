@@ -1,9 +1,10 @@
 import re
-import urllib2
 from decimal import Decimal
 from hiicart.gateway.base import IPNBase
 from hiicart.gateway.paypal_adaptive.settings import SETTINGS as default_settings
 from hiicart.utils import cart_by_uuid
+from hiicart.lib import http
+from hiicart.lib.instrumentation import http_call
 
 
 # Payment State translation between Adaptive API and HiiCart
@@ -93,6 +94,7 @@ class PaypalAPIPN(IPNBase):
         self.cart.update_state()
         self.cart.save()
 
+    @http_call
     def confirm_ipn_data(self, raw_data):
         """Confirm IPN data using string raw post data.
 
@@ -103,7 +105,5 @@ class PaypalAPIPN(IPNBase):
         else:
             submit_url = "https://www.sandbox.paypal.com/cgi-bin/webscr"
         raw_data += "&cmd=_notify-validate"
-        req = urllib2.Request(submit_url)
-        req.add_header("Content-type", "application/x-www-form-urlencoded")
-        result = urllib2.urlopen(req, raw_data).read()
-        return urllib2.urlopen(req, raw_data).read() == "VERIFIED"
+        response, content = http.post_form(submit_url, raw_data)
+        return content == "VERIFIED"
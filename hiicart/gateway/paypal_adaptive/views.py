@@ -7,6 +7,7 @@ from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 from hiicart.gateway.base import GatewayError
 from hiicart.gateway.paypal_adaptive.ipn import PaypalAPIPN
+from hiicart.lib.unitofwork import unit_of_work
 from hiicart.utils import format_exceptions, cart_by_uuid, format_data
 
 
@@ -24,6 +25,7 @@ def _find_cart(data):
 
 @csrf_exempt
 @format_exceptions
+@unit_of_work
 @never_cache
 def ipn(request):
     """Instant Payment Notification ipn.
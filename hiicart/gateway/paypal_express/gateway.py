@@ -1,5 +1,4 @@
 import urllib
-import httplib2
 from cgi import parse_qs
 
 from decimal import Decimal
@@ -11,6 +10,8 @@ from dateutil.relativedelta import relativedelta
 from hiicart.gateway.base import PaymentGatewayBase, SubmitResult, GatewayError, CancelResult
 from hiicart.gateway.paypal_express.settings import SETTINGS as default_settings
 from hiicart.models import HiiCartError
+from hiicart.lib import http
+from hiicart.lib.instrumentation import http_call
 
 NVP_SIGNATURE_TEST_URL = "https://api-3t.sandbox.paypal.com/nvp"
 NVP_SIGNATURE_URL = "https://api-3t.paypal.com/nvp"
@@ -54,8 +55,8 @@ class PaypalExpressCheckoutGateway(PaymentGatewayBase):
             url = NVP_SIGNATURE_TEST_URL
         return mark_safe(url)
 
+    @http_call
     def _do_nvp(self, method, params_dict):
-        http = httplib2.Http()
         params_dict['method'] = method
         params_dict['user'] = self.settings['API_USERNAME']
         params_dict['pwd'] = self.settings['API_PASSWORD']
@@ -400,6 +401,6 @@ class PaypalExpressCheckoutGateway(PaymentGatewayBase):
         """This Paypal API doesn't support manually charging subscriptions."""
         pass
 
-    def sanitize_clone(self):
+    def sanitize_clone(self, cart):
         """Nothing to fix here."""
         pass
@@ -7,6 +7,7 @@ from django.http import HttpResponseRedirect
 from hiicart.gateway.paypal_express.gateway import PaypalExpressCheckoutGateway
 from hiicart.gateway.paypal_express.ipn import PaypalExpressCheckoutIPN
 from hiicart.gateway.paypal.views import _base_paypal_ipn_listener
+from hiicart.lib.unitofwork import unit_of_work
 from hiicart.utils import format_exceptions, cart_by_uuid
 from hiicart.gateway.base import GatewayError
 
@@ -50,6 +51,7 @@ def finalize(request):
 
 @csrf_exempt
 @format_exceptions
+@unit_of_work
 @never_cache
 def ipn(request):
     return _base_paypal_ipn_listener(request, PaypalExpressCheckoutIPN)
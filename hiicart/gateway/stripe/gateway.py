@@ -6,6 +6,7 @@ from hiicart.gateway.base import PaymentGatewayBase, SubmitResult, TransactionRe
 from hiicart.gateway.stripe.ipn import StripeIPN
 from hiicart.gateway.stripe.forms import PaymentForm, FORM_MODEL_TRANSLATION
 from hiicart.gateway.stripe.settings import SETTINGS as default_settings
+from hiicart.lib.unitofwork import unit_of_work
 
 log = logging.getLogger('hiicart.gateway.stripe.gateway')
 
@@ -81,10 +82,11 @@ class StripeGateway(PaymentGatewayBase):
             currency=self.settings['CURRENCY_CODE'],
             source=token,
             description="Order #%s (%s)" % (self.cart.id, self.cart.bill_email),
-            **kwargs,
+            **kwargs
         )
         return charge
 
+    @unit_of_work
     def confirm_payment(self, request):
         """
         Charges tokenized credit card on Stripe.
@@ -8,6 +8,7 @@ import json
 from django.http import HttpResponseBadRequest, HttpResponse
 from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
+from hiicart.lib.unitofwork import unit_of_work
 from hiicart.utils import format_exceptions, format_data
 
 
@@ -16,6 +17,7 @@ logger = logging.getLogger("hiicart.gateway.stripe")
 
 @csrf_exempt
 @format_exceptions
+@unit_of_work
 @never_cache
 def ipn(request):
     """
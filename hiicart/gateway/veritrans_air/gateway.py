@@ -1,5 +1,4 @@
 import urllib
-import httplib2
 import hashlib
 import re
 from cgi import parse_qs
@@ -15,6 +14,9 @@ from hiicart.gateway.base import PaymentGatewayBase, TransactionResult, SubmitRe
 from hiicart.gateway.veritrans_air.settings import SETTINGS as default_settings
 from hiicart.gateway.veritrans_air.forms import PaymentForm, FORM_MODEL_TRANSLATION
 from hiicart.models import HiiCartError, PaymentResponse
+from hiicart.lib import http
+from hiicart.lib.instrumentation import http_call
+from hiicart.lib.unitofwork import unit_of_work
 
 TOKEN_ENDPOINT = "https://air.veritrans.co.jp/web/commodityRegist.action"
 PAYMENT_ENDPOINT = "https://air.veritrans.co.jp/web/paymentStart.action"
@@ -27,9 +29,8 @@ class VeritransAirGateway(PaymentGatewayBase):
         super(VeritransAirGateway, self).__init__('veritrans_air', cart, default_settings)
         self._require_settings(['MERCHANT_ID', 'MERCHANT_ID'])
 
+    @http_call
     def _get_token(self, params_dict):
-        #httplib2.debuglevel = 1
-        http = httplib2.Http()
         params_dict['MERCHANT_ID'] = self.settings['MERCHANT_ID']
         params_dict['SESSION_ID'] = self.settings['SESSION_ID']
         params_dict["SETTLEMENT_TYPE"] = self.settings["SETTLEMENT_TYPE"]
@@ -130,6 +131,7 @@ class VeritransAirGateway(PaymentGatewayBase):
         return params
 
 
+    @unit_of_work
     def confirm_payment(self, request):
         """
         Records billing and shipping info for Veritrans AIR
@@ -243,6 +245,6 @@ class VeritransAirGateway(PaymentGatewayBase):
         """Refund a payment."""
         return SubmitResult(None)
 
-    def sanitize_clone(self):
+    def sanitize_clone(self, cart):
         """Nothing to fix here."""
         pass
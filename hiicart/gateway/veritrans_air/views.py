@@ -7,6 +7,7 @@ from django.http import HttpResponse
 from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
 from hiicart.gateway.veritrans_air.ipn import VeritransAirIPN
+from hiicart.lib.unitofwork import unit_of_work
 from hiicart.utils import format_exceptions, cart_by_id, format_data
 
 
@@ -24,6 +25,7 @@ def _find_cart(data):
 
 @csrf_exempt
 @format_exceptions
+@unit_of_work
 @never_cache
 def ipn(request):
     """
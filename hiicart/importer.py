@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Bulk import of historical carts, e.g. when migrating a store.
+
+The input is JSON lines, one cart per line, with its line items and
+payments nested:
+
+    {"cart_uuid": "...", "state": "COMPLETED", "user": 12, "gateway": "PAYPAL",
+     "created": "2013-05-01 12:00:00", "bill_email": "buyer@example.com",
+     "lineitems": [{"type": "LineItem", "name": "Shirt", "sku": "S1",
+                    "quantity": 2, "unit_price": "9.99"}],
+     "payments": [{"amount": "19.98", "state": "PAID", "transaction_id": "X1",
+                   "created": "2013-05-01 12:05:00"}]}
+
+Other keys are model field names ("user" takes a user id).  A line item's
+"type" names one of the cart's line item classes and defaults to LineItem.
+A cart's "state" must be a state in VALID_TRANSITIONS; an optional
+"history" lists the states it went through first, which must each be a
+valid transition.  Totals are calculated in memory, uuids are generated
+for carts without one and created/last_updated are kept as given.
+
+Records are written in chunks, one transaction per chunk, with one bulk
+insert per table in dependency order: carts, then line items and
+payments.  The inserts are raw, as loaddata's are, so the given timestamps
+are kept without touching the auto_now fields other threads save with.  Carts whose uuid is already in the database are skipped, so a
+failed import can be run again.  No save() runs, so with `signals` on,
+post_save is sent for every new row once its chunk has committed;
+otherwise no signals are sent at all.  Cached misses for the imported
+uuids (hiicart.cartcache) are dropped once each chunk commits.  All carts
+go to one database, so import each shard's carts separately.
+"""
+
+import json
+import time
+import uuid
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import AutoField
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from hiicart import cartcache, sharding
+from hiicart.models import (CartLocation, HiiCart, HiiCartError, PAYMENT_STATES,
+                            VALID_TRANSITIONS)
+
+VALID_PAYMENT_STATES = set([state for state, name in PAYMENT_STATES])
+
+
+def validate_history(states):
+    """Check that carts can go OPEN -> states[0] -> states[1] ..."""
+    old = "OPEN"
+    for new in states:
+        if new not in VALID_TRANSITIONS:
+            raise HiiCartError("Unknown cart state: %s" % new)
+        if new != old and new not in VALID_TRANSITIONS[old]:
+            raise HiiCartError("Invalid transition: %s -> %s" % (old, new))
+        old = new
+
+
+def _build(cls, data, now):
+    """An unsaved `cls` from a record's field values."""
+    values = {}
+    for name, value in data.items():
+        try:
+            field = cls._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise HiiCartError("Unknown %s field: %s" % (cls.__name__, name))
+        try:
+            values[field.attname] = field.to_python(value)
+        except ValidationError, e:
+            raise HiiCartError("%s.%s: %s" % (cls.__name__, name, "; ".join(e.messages)))
+    if "created" in values:
+        values["created"] = values["created"] or now
+        values.setdefault("last_updated", values["created"])
+    return cls(**values)
+
+
+def build_cart(record, cart_class=HiiCart):
+    """(cart, line items, payments) from one input record, totals calculated."""
+    record = dict(record)
+    now = timezone.now()
+    lineitem_types = dict([(cls.__name__, cls) for cls in cart_class.lineitem_types])
+    lineitems, payments = [], []
+    for data in record.pop("lineitems", None) or []:
+        data = dict(data)
+        name = data.pop("type", "LineItem")
+        if name not in lineitem_types:
+            raise HiiCartError("Unknown line item type: %s" % name)
+        item = _build(lineitem_types[name], data, now)
+        item._recalc()
+        lineitems.append(item)
+    for data in record.pop("payments", None) or []:
+        payment = _build(cart_class.payment_class, dict(data, created=data.get("created")), now)
+        if payment.state not in VALID_PAYMENT_STATES:
+            raise HiiCartError("Unknown payment state: %s" % payment.state)
+        payments.append(payment)
+    state = record.pop("state", "OPEN")
+    validate_history(list(record.pop("history", None) or []) + [state])
+    record["_cart_state"] = state
+    record["_cart_uuid"] = record.pop("cart_uuid", None) or str(uuid.uuid4())
+    record["created"] = record.get("created")
+    cart = _build(cart_class, record, now)
+    cart._recalc(lineitems)
+    return cart, lineitems, payments
+
+
+def _bulk_insert(model, objs, db):
+    """
+    Insert objs like bulk_create, keeping their created/last_updated values.
+
+    bulk_create runs Field.pre_save, which sets auto_now and auto_now_add
+    fields to the current time.  The rows are inserted raw instead, as
+    loaddata saves them, so every value is taken from the instance as it
+    is; the model's fields are left alone for other threads saving rows.
+    """
+    if not objs:
+        return
+    fields = [f for f in model._meta.local_concrete_fields if not isinstance(f, AutoField)]
+    batch_size = max(connections[db].ops.bulk_batch_size(fields, objs), 1)
+    for start in range(0, len(objs), batch_size):
+        model._base_manager._insert(objs[start:start + batch_size], fields=fields,
+                                    using=db, raw=True)
+
+
+def _records(lines):
+    for number, line in enumerate(lines, 1):
+        if line.strip():
+            try:
+                yield number, json.loads(line)
+            except ValueError, e:
+                raise HiiCartError("Line %i: %s" % (number, e))
+
+
+def _import_chunk(cart_class, chunk, db, signals, counts):
+    built = []
+    for number, record in chunk:
+        try:
+            built.append(build_cart(record, cart_class))
+        except HiiCartError, e:
+            raise HiiCartError("Line %i: %s" % (number, e))
+    uuids = [cart._cart_uuid for cart, items, payments in built]
+    if len(set(uuids)) != len(uuids):
+        raise HiiCartError("Duplicate cart_uuid in lines %i-%i" % (chunk[0][0], chunk[-1][0]))
+    existing = set(cart_class.objects.using(db).filter(
+        _cart_uuid__in=uuids).values_list("_cart_uuid", flat=True))
+    built = [b for b in built if b[0]._cart_uuid not in existing]
+    counts["skipped"] += len(chunk) - len(built)
+    if not built:
+        return
+    payment_class = cart_class.payment_class
+    with transaction.atomic(using=db):
+        _bulk_insert(cart_class, [cart for cart, items, payments in built], db)
+        # Bulk inserts don't set pks, so fetch them to point the rows at
+        pks = dict(cart_class.objects.using(db).filter(
+            _cart_uuid__in=[cart._cart_uuid for cart, items, payments in built]
+        ).values_list("_cart_uuid", "pk"))
+        new_items = dict([(cls, []) for cls in cart_class.lineitem_types])
+        new_payments = []
+        for cart, items, payments in built:
+            cart.pk = cart.id = pks[cart._cart_uuid]
+            cart._state.adding, cart._state.db = False, db
+            for obj in items + payments:
+                obj.cart = cart
+            for item in items:
+                new_items[item.__class__].append(item)
+            new_payments.extend(payments)
+        for cls, items in new_items.items():
+            if items:
+                _bulk_insert(cls, items, db)
+                counts["lineitems"] += len(items)
+        _bulk_insert(payment_class, new_payments, db)
+        if sharding.shards():
+            CartLocation.objects.using(DEFAULT_DB_ALIAS).bulk_create([
+                CartLocation(cart_uuid=cart._cart_uuid, shard=db)
+                for cart, items, payments in built])
+    # Lookups may have cached these uuids as missing
+    cartcache.forget_uuids([cart._cart_uuid for cart, items, payments in built])
+    counts["carts"] += len(built)
+    counts["payments"] += len(new_payments)
+    if signals:
+        carts = [cart for cart, items, payments in built]
+        for cart in carts:
+            post_save.send(sender=cart_class, instance=cart, created=True, raw=False,
+                           using=db, update_fields=None)
+        # Reload the rest, whose pks the inserts didn't set
+        for cls in list(cart_class.lineitem_types) + [payment_class]:
+            for obj in cls.objects.using(db).filter(cart__in=carts).iterator():
+                post_save.send(sender=cls, instance=obj, created=True, raw=False,
+                               using=db, update_fields=None)
+
+
+def import_carts(lines, cart_class=HiiCart, chunk_size=500, signals=True, using=None):
+    """
+    Import carts from JSON lines, as described above.
+
+    Returns counts of the carts, line items and payments created and the
+    carts skipped, with the seconds taken and rows written per second.
+    """
+    db = using or router.db_for_write(cart_class)
+    counts = {"carts": 0, "lineitems": 0, "payments": 0, "skipped": 0}
+    started = time.time()
+    records = _records(lines)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        _import_chunk(cart_class, chunk, db, signals, counts)
+    counts["seconds"] = time.time() - started
+    rows = counts["carts"] + counts["lineitems"] + counts["payments"]
+    counts["rows_per_second"] = rows / counts["seconds"] if counts["seconds"] else 0.0
+    return counts
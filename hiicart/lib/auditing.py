@@ -1,52 +1,195 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-"""auditing for hiicart, relies on sentry (probably)"""
+"""auditing for hiicart, uses sentry when it's available
+
+Capturing a stack extracts each frame's file, line number, function and
+source line (cached by linecache after the first read) on the calling
+thread; no frames are kept.  Captured stacks are handed to a background
+AuditHandler which formats them and sends them to sentry or, without
+django-sentry installed, to the "hiicart.audit" logger.
+
+Messages can be sampled (AUDIT_SAMPLE_RATE) and rate limited per message
+(AUDIT_RATE_LIMIT), see hiicart.settings.
+"""
 
-import inspect
 import logging
+import Queue
+import random
+import sys
+import threading
+import time
+import traceback
 from django.views.debug import ExceptionReporter
+from hiicart.settings import SETTINGS as hiicart_settings
 
 try:
     from sentry.client.models import get_client
 except ImportError:
-    print "You must be using django-sentry to use hiicart auditing."
     get_client = lambda: None
 
+log = logging.getLogger("hiicart.audit")
+
+
 class AuditingStacktrace(Exception):
     def __init__(self, *args, **kwargs):
         if not args:
-            args[0] = "(Auditing Stacktrace)"
+            args = ("(Auditing Stacktrace)",)
         super(AuditingStacktrace, self).__init__(*args, **kwargs)
 
+
+def capture_stack(skip=0, limit=None):
+    """Capture the caller's stack as traceback.extract_stack() entries,
+    innermost first.
+
+    skip drops that many frames above the caller.  Only plain tuples are
+    kept, so nothing the frames reference is kept alive and later changes
+    to their locals don't show."""
+    return list(reversed(traceback.extract_stack(sys._getframe(skip + 1), limit)))
+
+
+class _Frame(object):
+    """Stands in for a frame captured by capture_stack."""
+
+    class _Code(object):
+        def __init__(self, filename, name):
+            self.co_filename, self.co_name = filename, name
+
+    def __init__(self, filename, lineno, name):
+        self.f_code = self._Code(filename, name)
+        self.f_lineno = lineno
+        self.f_globals = {}
+        self.f_locals = {}
+        self.f_back = None
+
+
 class FakeTraceback(object):
     """A fake traceback object that lets us log a stack trace whenever we want,
-    not just when an exception occurs and we get a traceback."""
-    def __init__(self, stack=None):
-        self._stack = stack or inspect.stack()[1:]
-        self._frames = [s[0] for s in self._stack]
-        self.tb_frame = self._frames[0]
-        self.tb_lineno = self._stack[0][2]
+    not just when an exception occurs and we get a traceback.
+
+    stack is either the output of capture_stack or of inspect.stack().
+    Every FakeTraceback in the chain shares the same list."""
+    def __init__(self, stack=None, _index=0):
+        if stack is None:
+            stack = capture_stack(1)
+        if not _index:
+            stack = [(s[0], s[2]) if not isinstance(s[0], basestring)
+                     else (_Frame(*s[:3]), s[1]) for s in stack]
+        self._stack = stack
+        self._index = _index
+        self.tb_frame, self.tb_lineno = stack[_index]
 
     def get_next(self):
-        if len(self._stack) == 1:
+        if self._index + 1 >= len(self._stack):
             return None
-        return FakeTraceback(self._stack[1:])
+        return FakeTraceback(self._stack, self._index + 1)
     tb_next = property(get_next)
 
     def get_traceback_html(self, request):
         er = ExceptionReporter(request, AuditingStacktrace, AuditingStacktrace(), self)
         return er.get_traceback_html()
 
-def log_with_stacktrace(message, level=logging.INFO, logger='hiicart.audit'):
-    client = get_client()
-    if client is None:
-        logger = logging.getLogger()
-        logger.warn("Could not save stack trace for message: %s" % message)
-        return
-    kwargs = dict(level=level, logger=logger)
-    stack = inspect.stack()[1:]
-    tb = FakeTraceback(stack)
-    exc_info = (AuditingStacktrace, AuditingStacktrace(message), tb)
-    get_client().create_from_exception(exc_info, **kwargs)
 
+def format_stack(stack):
+    """Format a stack from capture_stack like traceback.format_stack."""
+    return "".join(traceback.format_list(list(reversed(stack))))
+
+
+class AuditHandler(object):
+    """Formats and emits captured stacks on a background thread.
+
+    The queue is bounded; records are dropped (and counted in `dropped`)
+    rather than blocking the caller when the handler falls behind."""
+
+    def __init__(self, maxsize=1000):
+        self.queue = Queue.Queue(maxsize)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name="hiicart-audit")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def submit(self, record):
+        self._start()
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Block until every submitted record has been emitted."""
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            try:
+                self.emit(record)
+            except Exception:
+                log.exception("Unable to emit audit record: %s" % record["message"])
+            finally:
+                self.queue.task_done()
+
+    def emit(self, record):
+        client = get_client()
+        if client is not None:
+            tb = FakeTraceback(record["stack"])
+            exc_info = (AuditingStacktrace, AuditingStacktrace(record["message"]), tb)
+            client.create_from_exception(exc_info, level=record["level"],
+                                         logger=record["logger"])
+            return
+        logging.getLogger(record["logger"]).log(
+            record["level"], "%s\nStack (most recent call last):\n%s",
+            record["message"], format_stack(record["stack"]))
+
+handler = AuditHandler()
+
+
+class RateLimiter(object):
+    """Allow at most `count` calls per message in each `period` seconds."""
+
+    # forget all windows once this many messages are being tracked
+    max_messages = 1000
+
+    def __init__(self):
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def allow(self, message, count, period):
+        now = time.time()
+        with self._lock:
+            if len(self._windows) >= self.max_messages:
+                self._windows.clear()
+            start, seen = self._windows.get(message, (now, 0))
+            if now - start >= period:
+                start, seen = now, 0
+            if seen >= count:
+                return False
+            self._windows[message] = (start, seen + 1)
+            return True
+
+rate_limiter = RateLimiter()
+
+
+def log_with_stacktrace(message, level=logging.INFO, logger='hiicart.audit',
+                        sample_rate=None, rate_limit=None):
+    """Log message along with the stack of the caller.
+
+    sample_rate (0.0 - 1.0) and rate_limit ((count, seconds) per message)
+    default to the AUDIT_SAMPLE_RATE and AUDIT_RATE_LIMIT settings."""
+    if sample_rate is None:
+        sample_rate = hiicart_settings.get("AUDIT_SAMPLE_RATE", 1.0)
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    if rate_limit is None:
+        rate_limit = hiicart_settings.get("AUDIT_RATE_LIMIT")
+    if rate_limit and not rate_limiter.allow(message, *rate_limit):
+        return
+    handler.submit({"message": message, "level": level, "logger": logger,
+                    "stack": capture_stack(1)})
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Pooled HTTP client for gateway API calls.
+
+Gateways used to build a new httplib2.Http, and so a new TCP connection
+and TLS handshake, for every request to the provider.  `request` sends
+them through an httplib2.Http kept per thread instead, which keeps its
+connections to each host open and reuses them, so a thread waiting on a
+provider waits for its answer rather than for a handshake first.  A
+connection the provider has closed in the meantime is reopened by
+httplib2 and the request retried.
+
+Requests time out after HTTP_TIMEOUT seconds, if set.
+"""
+
+import threading
+
+import httplib2
+
+from hiicart.settings import SETTINGS as hiicart_settings
+
+_local = threading.local()
+
+
+def client():
+    """This thread's pooled httplib2.Http."""
+    timeout = hiicart_settings.get("HTTP_TIMEOUT")
+    http = getattr(_local, "http", None)
+    if http is None or http.timeout != timeout:
+        http = _local.http = httplib2.Http(timeout=timeout)
+    return http
+
+
+def request(url, method="GET", body=None, headers=None):
+    """Make a request over a pooled connection, returning (response, content)."""
+    return client().request(url, method, body=body, headers=headers)
+
+
+def post_form(url, body, headers=None):
+    """POST urlencoded `body`, returning (response, content)."""
+    all_headers = {"Content-type": "application/x-www-form-urlencoded"}
+    all_headers.update(headers or {})
+    return request(url, "POST", body=body, headers=all_headers)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Query and timing instrumentation for HiiCart operations.
+
+Wrap a logical operation with `measure` (a context manager) or `instrumented`
+(a decorator) to count the ORM queries it runs, the time spent in the
+database and the time spent waiting on gateway HTTP calls.  When the
+operation finishes, hiicart.signals.operation_measured is sent with an
+OperationStats so metrics can be shipped wherever they need to go.
+
+Measuring is off unless the INSTRUMENTATION setting is True or a query budget
+check (`query_budget`, `operation_budgets`) is active, so the decorators cost
+a settings lookup when disabled.
+
+    with operation_budgets({"cart.save": 4}):
+        cart.save()
+"""
+
+import functools
+import threading
+import time
+
+from django.conf import settings as django_settings
+from django.db import connections
+
+from hiicart.settings import SETTINGS as hiicart_settings
+from hiicart.signals import operation_measured
+
+_local = threading.local()
+
+
+def _active():
+    """Stack of OperationStats currently being measured on this thread."""
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+        _local.forced = 0
+    return _local.stack
+
+
+def is_enabled():
+    _active()
+    return bool(_local.forced or hiicart_settings.get("INSTRUMENTATION"))
+
+
+class OperationStats(object):
+    """Counters for a single measured operation."""
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.queries = 0
+        self.db_time = 0.0
+        self.http_calls = 0
+        self.http_time = 0.0
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return "<OperationStats %s: %i queries, db %.3fs, http %.3fs, total %.3fs>" % (
+            self.operation, self.queries, self.db_time, self.http_time, self.elapsed)
+
+
+class measure(object):
+    """Measure queries, db and http time for an operation.
+
+    Nested measurements are inclusive: queries made by an inner operation
+    also count against every operation wrapping it."""
+
+    def __init__(self, operation, force=False):
+        self.operation = operation
+        self.force = force
+        self.stats = None
+
+    def __enter__(self):
+        if not (self.force or is_enabled()):
+            return None
+        self.stats = OperationStats(self.operation)
+        self._connections = []
+        for conn in connections.all():
+            self._connections.append((conn, conn.use_debug_cursor, len(conn.queries)))
+            conn.use_debug_cursor = True
+        self._start = time.time()
+        _active().append(self.stats)
+        return self.stats
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.stats is None:
+            return False
+        self.stats.elapsed = time.time() - self._start
+        _active().remove(self.stats)
+        for conn, use_debug_cursor, start in self._connections:
+            executed = conn.queries[start:]
+            self.stats.queries += len(executed)
+            self.stats.db_time += sum([float(q["time"]) for q in executed])
+            conn.use_debug_cursor = use_debug_cursor
+            # Don't let connection.queries grow without bound outside DEBUG
+            if not (use_debug_cursor or django_settings.DEBUG):
+                del conn.queries[start:]
+        operation_measured.send(sender=self.operation, operation=self.operation,
+                                stats=self.stats)
+        return False
+
+
+def instrumented(operation):
+    """Decorator form of `measure`.
+
+    `operation` may be a callable, which is given the same arguments as the
+    decorated function and returns the operation name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return func(*args, **kwargs)
+            name = operation(*args, **kwargs) if callable(operation) else operation
+            with measure(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def http_call(func):
+    """Decorator for functions which make gateway HTTP requests.
+
+    The time spent is added to every operation currently being measured."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = _active()
+        if not stack:
+            return func(*args, **kwargs)
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            for stats in stack:
+                stats.http_calls += 1
+                stats.http_time += elapsed
+    return wrapper
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class operation_budgets(object):
+    """Assert that instrumented operations stay within query budgets.
+
+    `budgets` maps operation names to the maximum number of queries a single
+    run of that operation may make.  Every run inside the block is checked
+    and QueryBudgetExceeded is raised on exit listing each one over budget.
+    The measured OperationStats are available as `.measured`."""
+
+    def __init__(self, budgets):
+        self.budgets = budgets
+        self.measured = []
+
+    def _receiver(self, sender, stats, **kwargs):
+        self.measured.append(stats)
+
+    def __enter__(self):
+        _active()
+        _local.forced += 1
+        operation_measured.connect(self._receiver)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _local.forced -= 1
+        operation_measured.disconnect(self._receiver)
+        if exc_type is not None:
+            return False
+        over = ["%s ran %i queries (budget %i)" % (s.operation, s.queries,
+                                                   self.budgets[s.operation])
+                for s in self.measured
+                if s.operation in self.budgets and s.queries > self.budgets[s.operation]]
+        if over:
+            raise QueryBudgetExceeded("Query budget exceeded: %s" % "; ".join(over))
+        return False
+
+
+class query_budget(object):
+    """Assert that a block of code runs at most `max_queries` queries."""
+
+    def __init__(self, max_queries, operation="query_budget"):
+        self.max_queries = max_queries
+        self._measure = measure(operation, force=True)
+
+    def __enter__(self):
+        _active()
+        _local.forced += 1
+        return self._measure.__enter__()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _local.forced -= 1
+        self._measure.__exit__(exc_type, exc_value, tb)
+        stats = self._measure.stats
+        if exc_type is None and stats.queries > self.max_queries:
+            raise QueryBudgetExceeded("%s ran %i queries (budget %i)" % (
+                stats.operation, stats.queries, self.max_queries))
+        return False
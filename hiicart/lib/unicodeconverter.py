@@ -29,16 +29,30 @@ except ImportError:
     pass
 
 
-def convertToUnicode(s):
-    s = UnicodeConverter(s).unicode
+def convertToUnicode(s, fast=True):
+    s = UnicodeConverter(s, fast).unicode
     if isinstance(s, unicode):
         return s
     else:
         return None
 
 
-def convertToUTF8(s):
-    s = UnicodeConverter(s).unicode
+def convertToUTF8(s, fast=True):
+    """Convert s to a UTF-8 encoded str.
+
+    With fast, unicode is encoded directly and a str which is already valid
+    UTF-8 (which includes ASCII) without a BOM is returned as is, without
+    copying.  Anything else goes through UnicodeConverter."""
+    if fast:
+        if isinstance(s, unicode):
+            return s.encode("utf-8")
+        if not s.startswith(codecs.BOM_UTF8):
+            try:
+                s.decode("utf-8")
+                return s
+            except UnicodeDecodeError:
+                pass
+    s = UnicodeConverter(s, fast).unicode
     if isinstance(s, unicode):
         return s.encode("utf-8")
     else:
@@ -58,7 +72,12 @@ class UnicodeConverter:
     CHARSET_ALIASES = {"macintosh": "mac-roman",
                        "x-sjis": "shift-jis"}
 
-    def __init__(self, markup):
+    # Encodings chardet detected, keyed by hash of the markup.  A hit is
+    # only a guess to try first, so hash collisions are harmless.
+    DETECTION_CACHE_SIZE = 256
+    _detected = {}
+
+    def __init__(self, markup, fast=True):
         self.markup = markup
         documentEncoding = None
         sniffedEncoding = None
@@ -71,6 +90,14 @@ class UnicodeConverter:
 
         u = None
 
+        # Nearly everything is utf-8 (or ascii), which decodes or fails fast
+        if fast:
+            key = hash(markup)
+            cached = self._detected.get(key)
+            u = self._convertFrom("utf-8")
+            if not u and cached:
+                u = self._convertFrom(cached)
+
         # If no luck and we have auto-detection library, try that:
         if not u and chardet and not isinstance(self.markup, unicode):
             u = self._convertFrom(chardet.detect(self.markup)['encoding'])
@@ -82,6 +109,11 @@ class UnicodeConverter:
                 if u:
                     break
 
+        if fast and u and self.originalEncoding not in ("utf-8", cached):
+            if len(self._detected) >= self.DETECTION_CACHE_SIZE:
+                self._detected.clear()
+            self._detected[key] = self.originalEncoding
+
         self.unicode = u
         if not u:
             self.originalEncoding = None
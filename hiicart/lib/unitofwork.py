@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Unit of work for IPN and gateway handlers.
+
+Handling a single notification saves the same cart and payments several
+times.  Inside a unit of work everything runs in one transaction, saves of
+carts, line items and payments which are already in the database are
+deferred and written once when the unit of work ends, and the
+cart_state_changed and payment_state_changed signals are sent only after
+the transaction commits.  If an exception escapes, the transaction is rolled
+back and the pending writes and signals are discarded.  Callbacks
+registered with `on_commit`, ex. cache invalidations which a read made
+before the commit could otherwise undo, run after the commit as well.
+
+    @unit_of_work
+    def ipn(request):
+        ...
+
+    with unit_of_work():
+        handler.accept_payment(data)
+
+New rows are still inserted immediately so they get a primary key.  Code
+which reads rows back with a query after saving them should call `flush()`
+first; HiiCartBase.update_state does this for line items and payments.
+
+Writes routed to a shard (hiicart.sharding) run in a transaction the unit
+of work opens on that shard as well.
+
+Units of work don't nest: an inner one joins the outer one.  Signals are
+sent when the outermost unit of work exits, so one entered inside some
+other transaction sends them before that transaction commits.
+"""
+
+import functools
+import sys
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from hiicart.signals import dispatch
+
+_local = threading.local()
+
+
+def current():
+    """The unit of work active on this thread, or None."""
+    return getattr(_local, "unit", None)
+
+
+class UnitOfWork(object):
+    """Pending writes and signals for one unit of work."""
+
+    def __init__(self):
+        self.pending = {}
+        self.signals = []
+        self.callbacks = []
+        # [(alias, atomic)] in the order the transactions were opened
+        self.transactions = []
+        self._order = 0
+        self._flushing = False
+
+    def join(self, alias):
+        """Run writes to database `alias` in this unit of work's transaction.
+
+        The unit of work opens a transaction on the database it was entered
+        for; writes routed to a shard (see hiicart.sharding) join one there."""
+        alias = alias or DEFAULT_DB_ALIAS
+        if alias in [joined for joined, atomic in self.transactions]:
+            return
+        atomic = transaction.atomic(using=alias)
+        atomic.__enter__()
+        self.transactions.append((alias, atomic))
+
+    def close(self, exc_type=None, exc_value=None, tb=None):
+        """Commit, or with an exception roll back, every joined transaction.
+
+        They're committed one after the other, last joined first; if one
+        fails to commit the rest are rolled back and its error raised."""
+        error = None
+        while self.transactions:
+            alias, atomic = self.transactions.pop()
+            try:
+                atomic.__exit__(exc_type, exc_value, tb)
+            except:
+                if exc_type is None:
+                    exc_type, exc_value, tb = error = sys.exc_info()
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+    def defer(self, instance):
+        """Queue instance to be saved when the unit of work is flushed."""
+        key = (instance.__class__, instance.pk)
+        queued = self.pending.get(key)
+        if queued is not None and queued[1] is not instance:
+            # Another copy of the same row; write it now so neither is lost
+            self._write([queued])
+            queued = None
+        if queued is None:
+            self._order += 1
+            self.pending[key] = (self._order, instance)
+
+    def flush(self, exclude=None):
+        """Write pending saves, except of instances of `exclude`.
+
+        Writes are ordered by each class's `flush_order` and then by when
+        they were first deferred, so line items and payments are written
+        before the carts whose totals and state depend on them."""
+        queued = [(key, item) for key, item in self.pending.items()
+                  if exclude is None or not isinstance(item[1], exclude)]
+        for key, item in queued:
+            del self.pending[key]
+        self._write([item for key, item in queued])
+
+    def _write(self, queued):
+        queued.sort(key=lambda item: (getattr(item[1], "flush_order", 0), item[0]))
+        self._flushing = True
+        try:
+            for order, instance in queued:
+                instance.save()
+        finally:
+            self._flushing = False
+
+    def send(self, signal, **kwargs):
+        self.signals.append((signal, kwargs))
+
+    def on_commit(self, func, *args):
+        """Call func(*args) after the transaction commits."""
+        self.callbacks.append((func, args))
+
+    def run_callbacks(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for func, args in callbacks:
+            func(*args)
+
+    def send_signals(self):
+        signals, self.signals = self.signals, []
+        dispatch(signals)
+
+
+class UnitOfWorkContext(object):
+    """Context manager and decorator returned by `unit_of_work`."""
+
+    def __init__(self, using=None):
+        self.using = using
+        self.unit = None
+
+    def __enter__(self):
+        if current() is not None:
+            if self.using is not None:
+                current().join(self.using)
+            return current()
+        self.unit = UnitOfWork()
+        self.unit.join(self.using)
+        _local.unit = self.unit
+        return self.unit
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.unit is None:
+            return False
+        unit, self.unit = self.unit, None
+        try:
+            if exc_type is None:
+                try:
+                    unit.flush()
+                except:
+                    exc_type, exc_value, tb = sys.exc_info()
+                    unit.close(exc_type, exc_value, tb)
+                    raise
+                unit.close()
+            else:
+                unit.close(exc_type, exc_value, tb)
+        finally:
+            _local.unit = None
+        if exc_type is None:
+            unit.run_callbacks()
+            unit.send_signals()
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with UnitOfWorkContext(self.using):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def unit_of_work(using=None):
+    """Run a block of code, or a decorated function, as a unit of work.
+
+    Like transaction.atomic, usable as @unit_of_work, @unit_of_work(using)
+    or `with unit_of_work():`."""
+    if callable(using):
+        return UnitOfWorkContext()(using)
+    return UnitOfWorkContext(using)
+
+
+def defer_save(instance, args, kwargs):
+    """Defer a plain save() of a persisted instance to the active unit of work.
+
+    Returns True if the save was deferred and the caller shouldn't write."""
+    unit = current()
+    if (unit is None or unit._flushing or args or kwargs
+            or instance.pk is None or instance._state.adding):
+        return False
+    unit.defer(instance)
+    return True
+
+
+def join(alias):
+    """Join the active unit of work's transaction on `alias`, if there is one."""
+    unit = current()
+    if unit is not None:
+        unit.join(alias)
+
+
+def flush(exclude=None):
+    """Write the active unit of work's pending saves, if there is one."""
+    unit = current()
+    if unit is not None and not unit._flushing:
+        unit.flush(exclude)
+
+
+def on_commit(func, *args):
+    """Call func(*args) now, or after commit when a unit of work is active."""
+    unit = current()
+    if unit is None:
+        func(*args)
+    else:
+        unit.on_commit(func, *args)
+
+
+def send(signal, **kwargs):
+    """Send signal now, or after commit when a unit of work is active.
+
+    See hiicart.signals for how the signal is delivered."""
+    unit = current()
+    if unit is None:
+        dispatch([(signal, kwargs)])
+    else:
+        unit.send(signal, **kwargs)
@@ -0,0 +1,21 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from hiicart.archive import BACKENDS, archive_carts
+
+
+class Command(BaseCommand):
+    help = "Move carts older than ARCHIVE_AFTER to cold storage."
+    option_list = BaseCommand.option_list + (
+        make_option("--backend", choices=BACKENDS, default=None,
+                    help="Where to archive to (default: ARCHIVE_BACKEND)."),
+        make_option("--chunk-size", type="int", default=100,
+                    help="Carts archived per transaction."),
+    )
+
+    def handle(self, *args, **options):
+        counts = archive_carts(backend=options["backend"],
+                               chunk_size=options["chunk_size"])
+        for state, count in sorted(counts.items()):
+            self.stdout.write("%s: %i carts archived" % (state, count))
@@ -0,0 +1,48 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from hiicart.benchmarks import run_benchmarks
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+class Command(BaseCommand):
+    help = "Run HiiCart benchmarks and print the results as JSON."
+    args = "[benchmark ...]"
+    option_list = BaseCommand.option_list + (
+        make_option("--sizes", default="1,10,50",
+                    help="Comma separated cart sizes (line items per cart)."),
+        make_option("--payments", default="0,10,100",
+                    help="Comma separated payment history lengths."),
+        make_option("--runs", type="int", default=3,
+                    help="Runs per benchmark step."),
+        make_option("--output", default=None,
+                    help="Write results to this file instead of stdout."),
+        make_option("--no-testdb", action="store_false", dest="testdb", default=True,
+                    help="Run against the configured database instead of a "
+                         "throwaway test database."),
+    )
+
+    def handle(self, *names, **options):
+        if options["testdb"]:
+            old_name = connection.settings_dict["NAME"]
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = run_benchmarks(names,
+                                     sizes=_int_list(options["sizes"]),
+                                     payments=_int_list(options["payments"]),
+                                     runs=options["runs"])
+        finally:
+            if options["testdb"]:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        output = json.dumps({"results": results}, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,41 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hiicart.export import FORMATS, export_lines, parse_when
+
+
+class Command(BaseCommand):
+    help = "Stream carts with their line items and payments as CSV or JSON lines."
+    option_list = BaseCommand.option_list + (
+        make_option("--format", choices=FORMATS, default="csv",
+                    help="csv (default) or jsonl."),
+        make_option("--start", default=None,
+                    help="Only carts created on or after this date."),
+        make_option("--end", default=None,
+                    help="Only carts created before this date."),
+        make_option("--state", action="append", dest="states", default=[],
+                    help="Only carts in this state; may be repeated."),
+        make_option("--gateway", action="append", dest="gateways", default=[],
+                    help="Only carts through this gateway; may be repeated."),
+        make_option("--chunk-size", type="int", default=500,
+                    help="Carts read per query."),
+        make_option("--output", default=None,
+                    help="File to write to (default: stdout)."),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            start, end = parse_when(options["start"]), parse_when(options["end"])
+        except ValueError, e:
+            raise CommandError(str(e))
+        lines = export_lines(options["format"], start=start, end=end,
+                             states=options["states"], gateways=options["gateways"],
+                             chunk_size=options["chunk_size"])
+        out = open(options["output"], "wb") if options["output"] else self.stdout
+        try:
+            for line in lines:
+                out.write(line)
+        finally:
+            if out is not self.stdout:
+                out.close()
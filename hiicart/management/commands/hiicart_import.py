@@ -0,0 +1,35 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hiicart.importer import import_carts
+from hiicart.models import HiiCartError
+
+
+class Command(BaseCommand):
+    help = "Bulk import historical carts from JSON lines (see hiicart.importer)."
+    args = "[file]"
+    option_list = BaseCommand.option_list + (
+        make_option("--chunk-size", type="int", default=500,
+                    help="Carts written per transaction."),
+        make_option("--no-signals", action="store_false", dest="signals", default=True,
+                    help="Don't send post_save for the imported rows."),
+        make_option("--database", default=None,
+                    help="Database to import into (default: the router's choice)."),
+    )
+
+    def handle(self, *args, **options):
+        f = open(args[0]) if args else sys.stdin
+        try:
+            counts = import_carts(f, chunk_size=options["chunk_size"],
+                                  signals=options["signals"], using=options["database"])
+        except HiiCartError, e:
+            raise CommandError(str(e))
+        finally:
+            if args:
+                f.close()
+        self.stdout.write("%(carts)i carts, %(lineitems)i line items and %(payments)i "
+                          "payments imported, %(skipped)i carts skipped" % counts)
+        self.stdout.write("%.1f seconds, %.1f rows/second"
+                          % (counts["seconds"], counts["rows_per_second"]))
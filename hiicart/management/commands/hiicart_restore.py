@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from hiicart.archive import restore_cart
+
+
+class Command(BaseCommand):
+    help = "Restore archived carts by UUID."
+    args = "<cart uuid> [cart uuid ...]"
+
+    def handle(self, *uuids, **options):
+        if not uuids:
+            raise CommandError("Give at least one cart UUID.")
+        for uuid in uuids:
+            cart = restore_cart(uuid)
+            if cart is None:
+                raise CommandError("No archived cart with UUID %s" % uuid)
+            self.stdout.write("Restored %s as %s #%s" % (uuid, cart.__class__.__name__, cart.pk))
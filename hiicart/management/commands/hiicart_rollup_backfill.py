@@ -0,0 +1,18 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from hiicart.rollups import backfill
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily revenue and subscription rollups from history."
+    option_list = BaseCommand.option_list + (
+        make_option("--chunk-size", type="int", default=1000,
+                    help="Payments and line items read at a time."),
+    )
+
+    def handle(self, *args, **options):
+        counts = backfill(chunk_size=options["chunk_size"])
+        for table, count in sorted(counts.items()):
+            self.stdout.write("%s: %i days" % (table, count))
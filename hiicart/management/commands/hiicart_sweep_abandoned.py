@@ -0,0 +1,18 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from hiicart.sweeper import sweep_abandoned
+
+
+class Command(BaseCommand):
+    help = "Mark carts left OPEN or SUBMITTED past ABANDON_AFTER as ABANDONED."
+    option_list = BaseCommand.option_list + (
+        make_option("--chunk-size", type="int", default=500,
+                    help="Carts read and updated at a time."),
+    )
+
+    def handle(self, *args, **options):
+        counts = sweep_abandoned(chunk_size=options["chunk_size"])
+        for state, count in sorted(counts.items()):
+            self.stdout.write("%s: %i carts abandoned" % (state, count))
@@ -0,0 +1,24 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hiicart.models import HiiCartError
+from hiicart.tax import build_table, read_csv
+
+
+class Command(BaseCommand):
+    help = "Compile a tax rate CSV file into a table for TAX_TABLE (see hiicart.tax)."
+    args = "<csv file or -> <table file>"
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Usage: hiicart_tax_table %s" % self.args)
+        f = sys.stdin if args[0] == "-" else open(args[0], "rb")
+        try:
+            count = build_table(read_csv(f), args[1])
+        except HiiCartError, e:
+            raise CommandError(str(e))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        self.stdout.write("%i tax rates written to %s" % (count, args[1]))
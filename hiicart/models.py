@@ -10,12 +10,17 @@ import uuid
 from django.utils import timezone
 from dateutil.relativedelta import relativedelta
 from decimal import Decimal
+from multiprocessing.pool import ThreadPool
 from django.dispatch import Signal
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, connections, models, router, transaction
+from django.db.models.base import ModelState
 from django.conf import settings
 from django.utils.safestring import mark_safe
+from hiicart import cartcache, routers, sharding
+from hiicart.lib import unitofwork
+from hiicart.lib.instrumentation import instrumented
 from hiicart.settings import SETTINGS as hiicart_settings
 
 logger = logging.getLogger("hiicart.models")
@@ -44,7 +49,9 @@ HIICART_STATES = [
     # the user has actually submitted payment details, but the payment has
     # not yet completed, for echecks, credit delays, etc)
     ("PENDING", "Pending"),
-    # FIXME: document ABANDONED cart state
+    # the cart sat OPEN or SUBMITTED without activity for longer than the
+    # ABANDON_AFTER setting allows and was swept (see hiicart.sweeper).  a
+    # late payment notification can still complete it
     ("ABANDONED", "Abandoned"),
     # payment has been made and the gateway has notified us via the IPN
     # (or via polling for some gateways, ex. braintree).
@@ -76,8 +83,8 @@ VALID_TRANSITIONS = {
     # PENDING is here because it seems like the submission step is skippable somehow, but
     # generally we only expect to get to PENDING from SUBMITTED
     "OPEN": ["SUBMITTED", "ABANDONED", "COMPLETED", "RECURRING", "PENDING", "PENDCANCEL", "CANCELLED"],
-    "SUBMITTED": ["COMPLETED", "PENDING", "RECURRING", "PENDCANCEL", "CANCELLED"],
-    "ABANDONED": [],
+    "SUBMITTED": ["ABANDONED", "COMPLETED", "PENDING", "RECURRING", "PENDCANCEL", "CANCELLED"],
+    "ABANDONED": ["COMPLETED", "PENDING", "RECURRING"],
     "COMPLETED": ["RECURRING", "PENDCANCEL", "CANCELLED", "REFUND", "PARTREFUND"],
     "PARTREFUND": ["REFUND","CANCELLED"],
     "REFUND": ["CANCELLED"],
@@ -95,6 +102,145 @@ class HiiCartError(Exception):
     pass
 
 
+class DirtyFieldsMixin(object):
+    """
+    Track changed fields so save() only writes those.
+
+    Saving an instance which was loaded from, or already saved to, the
+    database issues an UPDATE of only the fields changed since then (plus
+    auto_now fields) and no query at all when nothing changed.  Inserts,
+    and saves given update_fields, force_insert, force_update or another
+    database, are passed through untouched.
+
+    Inside a unit of work (see hiicart.lib.unitofwork) the write is deferred
+    until the unit of work is flushed.
+    """
+
+    # Order deferred writes are flushed in, lowest first
+    flush_order = 0
+
+    def __init__(self, *args, **kwargs):
+        super(DirtyFieldsMixin, self).__init__(*args, **kwargs)
+        self._snapshot_fields()
+
+    def _snapshot_fields(self):
+        # Only look at __dict__ so deferred fields aren't loaded
+        self._saved_fields = dict([(f.attname, self.__dict__[f.attname])
+                                   for f in self._meta.concrete_fields
+                                   if f.attname in self.__dict__])
+
+    def get_dirty_fields(self):
+        """Names of the fields changed since the last load or save."""
+        saved = self._saved_fields
+        return [f.attname for f in self._meta.concrete_fields
+                if f.attname in self.__dict__
+                and (f.attname not in saved or saved[f.attname] != self.__dict__[f.attname])]
+
+    def is_dirty(self):
+        """True if saving this instance would write to the database."""
+        return self.pk is None or self._state.adding or bool(self.get_dirty_fields())
+
+    def save(self, *args, **kwargs):
+        if unitofwork.defer_save(self, args, kwargs):
+            return
+        pk_name = self._meta.pk.attname
+        if (not args and self.pk is not None and not self._state.adding
+                and self._saved_fields.get(pk_name) == self.pk
+                and kwargs.get("using") in (None, self._state.db)
+                and not [k for k in ("force_insert", "force_update", "update_fields")
+                         if kwargs.get(k)]):
+            dirty = [name for name in self.get_dirty_fields() if name != pk_name]
+            if not dirty:
+                return
+            kwargs["update_fields"] = dirty + [f.attname for f in self._meta.concrete_fields
+                                               if getattr(f, "auto_now", False)
+                                               and f.attname not in dirty]
+        super(DirtyFieldsMixin, self).save(*args, **kwargs)
+        self._snapshot_fields()
+
+
+def _to_decimal(value):
+    """Decimal from a raw database value (sqlite returns floats for sums)."""
+    if value is None or isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+class HiiCartQuerySet(models.query.QuerySet):
+    def create(self, **kwargs):
+        if self._db is not None or not sharding.shards():
+            return super(HiiCartQuerySet, self).create(**kwargs)
+        # Let the router place the new cart on its store's shard
+        cart = self.model(**kwargs)
+        cart.save(force_insert=True)
+        return cart
+
+    def for_read(self):
+        """
+        Read these carts from a replica when READ_REPLICAS are configured.
+
+        Only for read-only paths; see hiicart.routers.  Carts which changed
+        state within READ_YOUR_WRITES are still loaded from the primary.
+        """
+        return self.using(routers.replica_alias())
+
+    def iterator(self):
+        if not routers.is_replica(self.db):
+            return super(HiiCartQuerySet, self).iterator()
+        return self._read_your_writes()
+
+    def _read_your_writes(self):
+        carts = list(super(HiiCartQuerySet, self).iterator())
+        recent = routers.recently_written(carts)
+        if recent:
+            primary = self.using(DEFAULT_DB_ALIAS)
+            primary.query.clear_limits()
+            fresh = dict((c.pk, c) for c in primary.filter(pk__in=[c.pk for c in recent]))
+            recent = set(recent)
+            # Carts which no longer match on the primary are left out
+            carts = [fresh.get(c.pk) if c in recent else c for c in carts]
+            carts = [c for c in carts if c is not None]
+        return iter(carts)
+
+    def with_live_totals(self):
+        """
+        Annotate carts with live_sub_total and live_total.
+
+        These are summed from every registered line item type by database
+        subqueries, so no line items are loaded.  Line item totals are the
+        ones stored when each was last saved.  The sub_total and total
+        properties of annotated carts return these until the cart is saved.
+        """
+        qn = connections[self.db].ops.quote_name
+        cart_pk = "%s.%s" % (qn(self.model._meta.db_table), qn(self.model._meta.pk.column))
+        sub_totals, totals = [], []
+        for cls in self.model.lineitem_types:
+            subquery = "(SELECT COALESCE(SUM(%%s), 0) FROM %s WHERE %s.%s = %s)" % (
+                qn(cls._meta.db_table), qn(cls._meta.db_table),
+                qn(cls._meta.get_field("cart").column), cart_pk)
+            sub_totals.append(subquery % qn(cls._meta.get_field("_sub_total").column))
+            totals.append(subquery % qn(cls._meta.get_field("_total").column))
+        sub_total = " + ".join(sub_totals) or "0"
+        adjustments = " + ".join(["COALESCE(%s.%s, 0)" % (qn(self.model._meta.db_table),
+                                                          qn(self.model._meta.get_field(name).column))
+                                  for name in ("tax", "shipping")])
+        discount = "COALESCE(%s.%s, 0)" % (qn(self.model._meta.db_table),
+                                           qn(self.model._meta.get_field("discount").column))
+        total = "%s + %s - %s" % (" + ".join(totals) or "0", adjustments, discount)
+        return self.extra(select={"live_sub_total": sub_total, "live_total": total})
+
+
+class HiiCartManager(models.Manager):
+    def get_queryset(self):
+        return HiiCartQuerySet(self.model, using=self._db)
+
+    def with_live_totals(self):
+        return self.get_queryset().with_live_totals()
+
+    def for_read(self):
+        return self.get_queryset().for_read()
+
+
 class HiiCartMetaclass(models.base.ModelBase):
     def __new__(cls, name, bases, attrs):
         try:
@@ -116,7 +262,7 @@ class HiiCartMetaclass(models.base.ModelBase):
         return new_class
 
 
-class HiiCartBase(models.Model):
+class HiiCartBase(DirtyFieldsMixin, models.Model):
     """
     Collects information about an order and tracks its state.
 
@@ -125,6 +271,9 @@ class HiiCartBase(models.Model):
     """
     __metaclass__ = HiiCartMetaclass
 
+    # Write carts after the line items and payments their totals depend on
+    flush_order = 1
+
     _cart_state = models.CharField(choices=HIICART_STATES, max_length=16, default="OPEN", db_index=True)
     _cart_uuid = models.CharField(max_length=36, db_index=True)
     gateway = models.CharField(max_length=16, null=True, blank=True)
@@ -156,7 +305,7 @@ class HiiCartBase(models.Model):
     ship_country = models.CharField("Country", max_length=2, default="")
     bill_first_name = models.CharField("First name", max_length=255, default="")
     bill_last_name = models.CharField("Last name", max_length=255, default="")
-    bill_email = models.EmailField("Email", max_length=255, default="")
+    bill_email = models.EmailField("Email", max_length=255, default="", db_index=True)
     bill_phone = models.CharField("Phone Number", max_length=30, default="")
     bill_street1 = models.CharField("Street", max_length=80, default="")
     bill_street2 = models.CharField("Street", max_length=80, default="")
@@ -171,8 +320,12 @@ class HiiCartBase(models.Model):
     created = models.DateTimeField("Created", auto_now_add=True)
     last_updated = models.DateTimeField("Last Updated", auto_now=True)
 
+    objects = HiiCartManager()
+
     class Meta:
         abstract = True
+        # Used to find stale carts, see hiicart.sweeper
+        index_together = [("_cart_state", "last_updated")]
 
     def __init__(self, *args, **kwargs):
         """Override in order to keep track of changes to state."""
@@ -215,7 +368,8 @@ class HiiCartBase(models.Model):
         return self._get_lineitems(self.one_time_lineitem_types)
 
     def _get_lineitems(self, cls_list):
-        l = [cls.objects.filter(cart=self) for cls in cls_list]
+        l = [cls.objects.using(router.db_for_read(cls, instance=self)).filter(cart=self)
+             for cls in cls_list]
         return [item for sublist in l for item in sublist]
 
     def _is_valid_transition(self, old, new):
@@ -230,10 +384,18 @@ class HiiCartBase(models.Model):
         """
         return new in VALID_TRANSITIONS[old]
 
-    def _recalc(self):
+    def _recalc(self, lineitems=None):
         """Recalculate totals"""
-        self._sub_total = self.sub_total
-        self._total = self.total
+        if lineitems is None:
+            lineitems = self.lineitems
+        self._sub_total = self._calc_sub_total(lineitems)
+        self._total = self._calc_total(lineitems)
+
+    def _calc_sub_total(self, lineitems):
+        return sum([li.sub_total or 0 for li in lineitems])
+
+    def _calc_total(self, lineitems):
+        return sum([li.total or 0 for li in lineitems]) + (self.tax or 0) + (self.shipping or 0) - (self.discount or 0)
 
     @property
     def cart_uuid(self):
@@ -248,12 +410,16 @@ class HiiCartBase(models.Model):
     @property
     def sub_total(self):
         """Current sub_total, calculated from lineitems."""
-        return sum([li.sub_total or 0 for li in self.lineitems])
+        if "live_sub_total" in self.__dict__:
+            return _to_decimal(self.live_sub_total)
+        return self._calc_sub_total(self.lineitems)
 
     @property
     def total(self):
         """Current total, calculated from lineitems."""
-        return sum([li.total or 0 for li in self.lineitems]) + (self.tax or 0) + (self.shipping or 0) - (self.discount or 0)
+        if "live_total" in self.__dict__:
+            return _to_decimal(self.live_total)
+        return self._calc_total(self.lineitems)
 
     def adjust_expiration(self, newdate):
         """
@@ -292,6 +458,7 @@ class HiiCartBase(models.Model):
         self.update_state()
         return response
 
+    @instrumented("cart.charge_recurring")
     def charge_recurring(self, grace_period=None):
         """
         Charge recurring purchases if necessary.
@@ -305,23 +472,84 @@ class HiiCartBase(models.Model):
         gateway.charge_recurring(grace_period)
         self.update_state()
 
+    def calculate_tax(self, lineitems=None):
+        """
+        Set tax, tax_rate, tax_country and tax_region from TAX_TABLE's rate
+        for this cart's address, without saving.  See hiicart.tax.
+        """
+        from hiicart import tax
+        return tax.calculate(self, lineitems)
+
     def clone(self):
         """Clone this cart in the OPEN state."""
-        dupe = copy.copy(self)
-        # This method only works when id and pk have been cleared
-        dupe.pk = None
-        dupe.id = None
-        dupe.set_state("OPEN", validate=False)
-        dupe.gateway = None
-        # Clear out any gateway-specific actions that might've been taken
-        gateway = self.get_gateway()
-        if gateway is not None:
-            gateway.sanitize_clone(dupe)
-        # Need to save before we can attach lineitems
-        dupe.save()
-        for item in self.lineitems:
-            item.clone(dupe)
-        return dupe
+        return self.clone_many([self])[0]
+
+    @classmethod
+    def clone_many(cart_class, carts):
+        """
+        Clone carts in the OPEN state, returning the new carts in order.
+
+        Line items are read with one query and written with one bulk insert
+        per registered line item type and database, and totals are
+        calculated in memory.  Only the new carts themselves are inserted
+        one at a time, since their ids are needed for the line items.  Each
+        clone is created on its cart's database, so with SHARDS set carts
+        from several shards are cloned shard by shard.
+
+        The new carts are inserted without HiiCartBase.save: no
+        cart_state_changed is sent and nothing is deferred to a unit of
+        work.  Their locations are recorded for sharding, and as their ids
+        and uuids are new there is nothing cached to invalidate.
+        """
+        carts = list(carts)
+        groups = {}
+        for i, cart in enumerate(carts):
+            db = router.db_for_write(cart_class, instance=cart)
+            groups.setdefault(db, []).append((i, cart))
+        dupes = [None] * len(carts)
+        for db, group in groups.items():
+            with sharding.use_shard(db if db in sharding.shards() else None):
+                cloned = cart_class._clone_on(db, [cart for i, cart in group])
+            for (i, cart), dupe in zip(group, cloned):
+                dupes[i] = dupe
+        return dupes
+
+    @classmethod
+    def _clone_on(cart_class, db, carts):
+        """Clone carts which are all on database `db`; see clone_many."""
+        lineitems = dict([(cart.pk, []) for cart in carts])
+        for cls in cart_class.lineitem_types:
+            for item in cls.objects.using(db).filter(cart__in=carts):
+                lineitems[item.cart_id].append(item)
+        dupes = []
+        new_items = dict([(cls, []) for cls in cart_class.lineitem_types])
+        with transaction.atomic(using=db):
+            for cart in carts:
+                dupe = copy.copy(cart)
+                # This method only works when id and pk have been cleared
+                dupe._state = ModelState()
+                dupe.pk = None
+                dupe.id = None
+                dupe._cart_uuid = str(uuid.uuid4())
+                dupe._cart_state = dupe._old_state = "OPEN"
+                dupe.gateway = None
+                # Clear out any gateway-specific actions that might've been taken
+                gateway = cart.get_gateway()
+                if gateway is not None:
+                    gateway.sanitize_clone(dupe)
+                items = [item.clone(dupe, save=False) for item in lineitems[cart.pk]]
+                dupe._recalc(items)
+                # Need to save before we can attach lineitems
+                super(HiiCartBase, dupe).save(force_insert=True, using=db)
+                sharding.record_location(dupe)
+                for item in items:
+                    item.cart = dupe
+                    new_items[item.__class__].append(item)
+                dupes.append(dupe)
+            for cls, items in new_items.items():
+                if items:
+                    cls.objects.using(db).bulk_create(items)
+        return dupes
 
     def get_expiration(self):
         """Get expiration of recurring item or None if there are no recurring items."""
@@ -374,19 +602,48 @@ class HiiCartBase(models.Model):
         except KeyError:
             raise HiiCartError("Unknown gateway: %s" % name)
 
+    @instrumented("cart.save")
     def save(self, *args, **kwargs):
         """Override to recalculate total and signal on state change."""
-        self._recalc()
-        if not self._cart_uuid:
-            self._cart_uuid = str(uuid.uuid4())
-        super(HiiCartBase, self).save(*args, **kwargs)
+        # Totals annotated by with_live_totals may be stale from here on
+        self.__dict__.pop("live_sub_total", None)
+        self.__dict__.pop("live_total", None)
+        if not unitofwork.defer_save(self, args, kwargs):
+            self._recalc()
+            if not self._cart_uuid:
+                self._cart_uuid = str(uuid.uuid4())
+            adding = self._state.adding
+            super(HiiCartBase, self).save(*args, **kwargs)
+            cartcache.invalidate(self)
+            if adding:
+                sharding.record_location(self)
         # Signal sent after save in case someone queries database
         if self.state != self._old_state:
-            self.cart_state_changed.send(sender=self.__class__.__name__, cart=self,
-                                         old_state=self._old_state,
-                                         new_state=self.state)
+            routers.record_write(self)
+            unitofwork.send(self.cart_state_changed,
+                            sender=self.__class__.__name__, cart=self,
+                            old_state=self._old_state, new_state=self.state)
             self._old_state = self.state
 
+    def lock(self):
+        """
+        Lock this cart's row until the current transaction ends and reload it.
+
+        Fields changed since the cart was loaded or saved keep their new
+        values; the rest, including the state, are brought up to date with
+        the database.  Only useful inside a transaction.
+        """
+        db = router.db_for_write(self.__class__, instance=self)
+        fresh = self.__class__._default_manager.using(db).select_for_update().get(pk=self.pk)
+        dirty = set(self.get_dirty_fields())
+        for name, value in fresh._saved_fields.items():
+            if name not in dirty:
+                self.__dict__[name] = value
+        self._saved_fields = fresh._saved_fields
+        # A state change still to be saved has already been signalled
+        if "_cart_state" not in dirty:
+            self._old_state = fresh._old_state
+
     def set_state(self, newstate, validate=True):
         """Set state of the cart, optionally not validating the transition."""
         if newstate == self.state:
@@ -397,9 +654,15 @@ class HiiCartBase(models.Model):
         self._cart_state = newstate
         self.save()
 
+    @instrumented("cart.submit")
     def submit(self, gateway_name, collect_address=False, cart_settings_kwargs=None):
         """Submit this cart to a payment gateway."""
+        return self._submit(gateway_name, collect_address, cart_settings_kwargs)
+
+    def _submit(self, gateway_name, collect_address, cart_settings_kwargs,
+                resolved_cart_settings=None):
         gateway = self._get_gateway(gateway_name)
+        gateway.resolved_cart_settings = resolved_cart_settings
         self.gateway = gateway_name
         self.save()
         result = gateway.submit(collect_address, cart_settings_kwargs)
@@ -407,6 +670,89 @@ class HiiCartBase(models.Model):
             self.set_state("SUBMITTED")
         return result
 
+    @classmethod
+    @instrumented("cart.submit_many")
+    def submit_many(cart_class, carts, gateway_name, collect_address=False,
+                    cart_settings_kwargs=None, workers=None):
+        """
+        Submit carts to a payment gateway at once, returning for each cart,
+        in order, its SubmitResult or the exception submitting it raised.
+
+        Cart-specific settings are resolved for all the carts first, with one
+        call to CART_SETTINGS_MANY_FN if it's set, else CART_SETTINGS_FN per
+        cart.  If CART_SETTINGS_MANY_FN fails, or doesn't return settings for
+        every cart, CART_SETTINGS_FN is called per cart instead, or without it
+        the error is every cart's result.  The carts are then submitted on up to `workers` threads
+        (SUBMIT_WORKERS by default), each with its own database connections,
+        so a slow gateway call for one cart doesn't hold up the rest and a
+        cart that fails doesn't stop the others.  Inside a transaction or
+        unit of work, whose writes other threads can't see, the carts are
+        submitted one after the other instead.
+        """
+        from hiicart.utils import call_func
+        carts = list(carts)
+        if not carts:
+            return []
+        cart_settings_kwargs = cart_settings_kwargs or {}
+        for cart in carts:
+            # As submit() does before CART_SETTINGS_FN is called
+            cart.gateway = gateway_name
+        resolved = None
+        errors = {}
+        if hiicart_settings.get("CART_SETTINGS_MANY_FN"):
+            try:
+                found = [s or {} for s in call_func(hiicart_settings["CART_SETTINGS_MANY_FN"],
+                                                    carts, **cart_settings_kwargs)]
+                if len(found) != len(carts):
+                    raise HiiCartError("CART_SETTINGS_MANY_FN returned settings for %i of %i "
+                                       "carts" % (len(found), len(carts)))
+                resolved = found
+            except Exception, e:
+                logger.exception("Getting settings for %i carts failed", len(carts))
+                if not hiicart_settings.get("CART_SETTINGS_FN"):
+                    errors = dict((i, e) for i in range(len(carts)))
+        if resolved is None and not errors and hiicart_settings.get("CART_SETTINGS_FN"):
+            resolved = [None] * len(carts)
+            for i, cart in enumerate(carts):
+                try:
+                    resolved[i] = call_func(hiicart_settings["CART_SETTINGS_FN"], cart,
+                                            **cart_settings_kwargs) or {}
+                except Exception, e:
+                    logger.exception("Getting settings for cart %s failed", cart.pk)
+                    errors[i] = e
+        resolved = resolved or [None] * len(carts)
+        workers = min(workers or hiicart_settings["SUBMIT_WORKERS"], len(carts))
+        pooled = workers > 1 and unitofwork.current() is None and not any(
+            conn.in_atomic_block for conn in connections.all())
+
+        def run(i):
+            if i in errors:
+                return errors[i]
+            try:
+                if pooled:
+                    # Pool threads are reused; don't inherit the last cart's shard
+                    sharding.activate(None)
+                return carts[i]._submit(gateway_name, collect_address,
+                                        cart_settings_kwargs, resolved[i])
+            except Exception, e:
+                logger.exception("Submitting cart %s to %s failed", carts[i].pk, gateway_name)
+                return e
+            finally:
+                if pooled:
+                    sharding.activate(None)
+                    for conn in connections.all():
+                        conn.close()
+
+        if not pooled:
+            return [run(i) for i in range(len(carts))]
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(run, range(len(carts)))
+        finally:
+            pool.close()
+            pool.join()
+
+    @instrumented("cart.update_state")
     def update_state(self):
         """
         Update cart state based on payments and lineitem expirations.
@@ -414,6 +760,8 @@ class HiiCartBase(models.Model):
         Valid state transitions are listed in VALID_TRANSITIONS. This
         function contains the logic for when those various states are used.
         """
+        # Make sure deferred line item and payment saves are read back
+        unitofwork.flush(exclude=HiiCartBase)
         newstate = None
         payments = self.payments.all()
         total_paid = sum([p.amount for p in payments if p.state == "PAID"])
@@ -461,7 +809,7 @@ class HiiCart(HiiCartBase):
         user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True)
 
 
-class LineItemBase(models.Model):
+class LineItemBase(DirtyFieldsMixin, models.Model):
     """
     Abstract Base Class for a single line item in a purchase.
 
@@ -496,20 +844,25 @@ class LineItemBase(models.Model):
         self._sub_total = self.sub_total
         self._total = self.total
 
-    def clone(self, newcart):
-        """Clone this cart in the OPEN state."""
+    def clone(self, newcart, save=True):
+        """Clone this line item into newcart."""
         dupe = copy.copy(self)
         # This method only works when id and pk have been cleared
+        dupe._state = ModelState()
         dupe.pk = None
         dupe.id = None
         dupe.cart = newcart
-        dupe.save()
+        if save:
+            dupe.save()
+        else:
+            dupe._recalc()
         return dupe
 
     def save(self, *args, **kwargs):
         """Override save to recalc before saving."""
         self._recalc()
         super(LineItemBase, self).save(*args, **kwargs)
+        cartcache.invalidate(self)
 
     @property
     def sub_total(self):
@@ -637,7 +990,7 @@ class PaymentMetaclass(models.base.ModelBase):
         return new_class
 
 
-class PaymentBase(models.Model):
+class PaymentBase(DirtyFieldsMixin, models.Model):
     __metaclass__ = PaymentMetaclass
 
     amount = models.DecimalField("amount", max_digits=18, decimal_places=2)
@@ -652,6 +1005,8 @@ class PaymentBase(models.Model):
         abstract = True
         verbose_name = "Payment"
         verbose_name_plural = "Payments"
+        # Transaction ids are only unique within a gateway
+        index_together = [("gateway", "transaction_id")]
 
     def __init__(self, *args, **kwargs):
         """Override in order to keep track of changes to state."""
@@ -666,13 +1021,19 @@ class PaymentBase(models.Model):
             return u"(unsaved) $%s %s" % (self.amount, self.state)
 
     def save(self, *args, **kwargs):
+        if not (args or kwargs) and not self.is_dirty():
+            return
+        adding = self._state.adding
         super(PaymentBase, self).save(*args, **kwargs)
+        cartcache.invalidate(self)
         logger.warn('Payment saved %s => %s for payment_id: %s' % (self._old_state, self.state, self.id))
+        if adding or self.state != self._old_state:
+            routers.record_write(self)
         # Signal sent after save in case someone queries database
         if self.state != self._old_state:
-            self.payment_state_changed.send(sender=self.__class__.__name__, payment=self,
-                                            old_state=self._old_state,
-                                            new_state=self.state)
+            unitofwork.send(self.payment_state_changed,
+                            sender=self.__class__.__name__, payment=self,
+                            old_state=self._old_state, new_state=self.state)
             self._old_state = self.state
 
 
@@ -680,6 +1041,10 @@ class PaymentBase(models.Model):
 class Payment(PaymentBase):
     cart = models.ForeignKey(HiiCart, related_name="payments")
 
+    class Meta(PaymentBase.Meta):
+        # cart.payments filtered by state and ordered by date, ex. get_expiration
+        index_together = PaymentBase.Meta.index_together + [("cart", "state", "created")]
+
 
 class Note(models.Model):
     """General note that can be attached to a cart, lineitem, or payment."""
@@ -697,3 +1062,86 @@ class PaymentResponse(models.Model):
     cart = models.ForeignKey(HiiCart, related_name="payment_results")
     response_code = models.PositiveIntegerField()
     response_text = models.TextField()
+
+
+class CartTombstone(models.Model):
+    """
+    Marker left behind for a cart moved to cold storage by hiicart.archive.
+
+    Kept small so UUID lookups of archived carts stay cheap, but keeps the
+    cart's state and totals for reports.  For the "db" archive backend the
+    cart itself is in an ArchivedCart; for "file" it is a line in the
+    gzipped JSON-lines file at `location`.
+    """
+    cart_uuid = models.CharField(max_length=36, unique=True)
+    cart_model = models.CharField(max_length=100)
+    cart_id = models.PositiveIntegerField()
+    state = models.CharField(max_length=16, choices=HIICART_STATES)
+    sub_total = models.DecimalField("Subtotal", max_digits=18, decimal_places=2, blank=True, null=True)
+    total = models.DecimalField("Total", max_digits=18, decimal_places=2, blank=True, null=True)
+    location = models.CharField(max_length=255, blank=True, default="")
+    archived = models.DateTimeField("Archived", auto_now_add=True)
+
+    def __unicode__(self):
+        return u"%s #%s (archived)" % (self.cart_model, self.cart_id)
+
+
+class ArchivedCart(models.Model):
+    """A cart and its related rows, serialized by hiicart.archive."""
+    tombstone = models.OneToOneField(CartTombstone, related_name="archive")
+    payload = models.TextField()
+
+
+class CartLocation(models.Model):
+    """The shard a cart is stored on, see hiicart.sharding."""
+    cart_uuid = models.CharField(max_length=36, unique=True)
+    shard = models.CharField(max_length=64)
+
+    def __unicode__(self):
+        return u"%s on %s" % (self.cart_uuid, self.shard)
+
+
+class DailyRevenue(models.Model):
+    """Payments for one day, gateway and currency, kept by hiicart.rollups."""
+    day = models.DateField("Day")
+    gateway = models.CharField("Payment Gateway", max_length=25, blank=True)
+    currency = models.CharField("Currency", max_length=3)
+    gross = models.DecimalField("Gross", max_digits=18, decimal_places=2, default=Decimal("0.00"))
+    refunds = models.DecimalField("Refunds", max_digits=18, decimal_places=2, default=Decimal("0.00"))
+    net = models.DecimalField("Net", max_digits=18, decimal_places=2, default=Decimal("0.00"))
+    payments = models.IntegerField("Payments", default=0)
+    refund_payments = models.IntegerField("Refund Payments", default=0)
+
+    class Meta:
+        unique_together = [("day", "gateway", "currency")]
+        verbose_name_plural = "Daily revenue"
+
+    def __unicode__(self):
+        return u"%s %s %s: %s" % (self.day, self.gateway, self.currency, self.net)
+
+
+class DailySubscriptions(models.Model):
+    """Recurring line items started and ended on a day, kept by hiicart.rollups.
+
+    `active` and `mrr` are the totals at the end of the day."""
+    day = models.DateField("Day", unique=True)
+    new = models.IntegerField("New", default=0)
+    cancelled = models.IntegerField("Cancelled", default=0)
+    active = models.IntegerField("Active", default=0)
+    mrr = models.DecimalField("Monthly Recurring Revenue", max_digits=18, decimal_places=2,
+                              default=Decimal("0.00"))
+
+    class Meta:
+        verbose_name_plural = "Daily subscriptions"
+
+    def __unicode__(self):
+        return u"%s: %i active, MRR %s" % (self.day, self.active, self.mrr)
+
+
+# Rollups are kept up to date by signal receivers, see hiicart.rollups
+if hiicart_settings.get("ROLLUPS"):
+    from hiicart import rollups
+    rollups.connect()
+
+# Cached carts and snapshots are dropped as carts change, see hiicart.cartcache
+cartcache.connect()
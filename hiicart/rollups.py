@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Daily revenue and subscription rollups.
+
+Two tables are kept up to date so reports don't scan every payment and
+cart:
+
+ * DailyRevenue -- gross, refunds and net by day, gateway and currency,
+   with the number of payments behind each.  A payment counts on the day
+   it was created: PAID payments towards gross and negative REFUND
+   payments towards refunds.  Gateways refund a payment by marking it
+   REFUND and recording the refund as a negative REFUND payment, so a
+   payment changed to REFUND in place stays in gross and only the refund
+   payment counts towards refunds.  The currency is the gateway's
+   CURRENCY_CODE setting, or DEFAULT_CURRENCY.
+ * DailySubscriptions -- recurring line items which started (their cart
+   became RECURRING) and were cancelled (it stopped being RECURRING) each
+   day, and the active count and monthly recurring revenue at the end of
+   the day.  MRR is each item's recurring total spread over a month; see
+   `monthly_amount`.
+
+With the ROLLUPS setting on, payment and cart signal receivers update the
+tables as payments are saved and carts change state.  Use the
+hiicart_rollup_backfill management command to rebuild them from history,
+across every shard.  Which carts subscribed isn't recorded anywhere, so the
+backfill counts RECURRING carts and cancelled ones with a PAID payment,
+starting on the first payment.  Nor is a cart's cancellation day, so the
+backfill uses its last update.
+"""
+
+from decimal import Decimal
+
+from django.db import router, transaction
+from django.db.models import F, Min
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from hiicart import sharding
+from hiicart.models import CART_TYPES, DailyRevenue, DailySubscriptions
+from hiicart.settings import SETTINGS as hiicart_settings
+from hiicart.utils import keyset_chunks
+
+ZERO = Decimal("0.00")
+CENT = Decimal("0.01")
+# Cart states reached by way of RECURRING
+SUBSCRIBED_STATES = ("RECURRING", "PENDCANCEL", "CANCELLED")
+
+
+def _day(value):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+
+def payment_currency(payment):
+    gateway = hiicart_settings.get((payment.gateway or "").upper()) or {}
+    return gateway.get("CURRENCY_CODE") or hiicart_settings.get("DEFAULT_CURRENCY") or "USD"
+
+
+def monthly_amount(item):
+    """A recurring line item's total per month."""
+    if not item.duration:
+        return ZERO
+    if item.duration_unit == "MONTH":
+        months = Decimal(item.duration)
+    else:
+        months = Decimal(item.duration) * 12 / 365
+    return (item.total / months).quantize(CENT)
+
+
+def _revenue(state, amount):
+    """(gross, refunds, payments, refund payments) a payment adds in `state`."""
+    if state == "REFUND" and amount < 0:
+        return (ZERO, -amount, 0, 1)
+    # A refunded payment was still received; its refund is counted separately
+    if state in ("PAID", "REFUND"):
+        return (amount, ZERO, 1, 0)
+    return (ZERO, ZERO, 0, 0)
+
+
+def add_revenue(day, gateway, currency, gross=ZERO, refunds=ZERO, payments=0,
+                refund_payments=0):
+    with transaction.atomic(using=router.db_for_write(DailyRevenue)):
+        row, created = DailyRevenue.objects.get_or_create(
+            day=day, gateway=gateway or "", currency=currency)
+        DailyRevenue.objects.filter(pk=row.pk).update(
+            gross=F("gross") + gross, refunds=F("refunds") + refunds,
+            net=F("net") + (gross - refunds), payments=F("payments") + payments,
+            refund_payments=F("refund_payments") + refund_payments)
+
+
+def add_subscriptions(day, new=0, cancelled=0, mrr=ZERO):
+    """Count subscriptions started and cancelled on `day`.
+
+    The active count and MRR of `day` and every later day change with them."""
+    with transaction.atomic(using=router.db_for_write(DailySubscriptions)):
+        if not DailySubscriptions.objects.filter(day=day).exists():
+            previous = list(DailySubscriptions.objects.filter(day__lt=day).order_by("-day")[:1])
+            defaults = {}
+            if previous:
+                defaults = {"active": previous[0].active, "mrr": previous[0].mrr}
+            DailySubscriptions.objects.get_or_create(day=day, defaults=defaults)
+        DailySubscriptions.objects.filter(day=day).update(
+            new=F("new") + new, cancelled=F("cancelled") + cancelled)
+        DailySubscriptions.objects.filter(day__gte=day).update(
+            active=F("active") + (new - cancelled), mrr=F("mrr") + mrr)
+
+
+def _payment_saved(sender, instance, created, raw=False, **kwargs):
+    # Later state changes are counted by payment_state_changed
+    if created and not raw:
+        payment_state_changed(sender, instance, None, instance.state)
+
+
+def payment_state_changed(sender, payment, old_state, new_state, **kwargs):
+    old = _revenue(old_state, payment.amount)
+    new = _revenue(new_state, payment.amount)
+    if old == new:
+        return
+    add_revenue(_day(payment.created), payment.gateway, payment_currency(payment),
+                *[n - o for n, o in zip(new, old)])
+
+
+def cart_state_changed(sender, cart, old_state, new_state, **kwargs):
+    if (old_state == "RECURRING") == (new_state == "RECURRING"):
+        return
+    items = cart.recurring_lineitems
+    if not items:
+        return
+    mrr = sum([monthly_amount(item) for item in items], ZERO)
+    if new_state == "RECURRING":
+        add_subscriptions(_day(timezone.now()), new=len(items), mrr=mrr)
+    else:
+        add_subscriptions(_day(timezone.now()), cancelled=len(items), mrr=-mrr)
+
+
+def _payment_classes():
+    return set([cart_class.payment_class for cart_class in CART_TYPES])
+
+
+def connect():
+    """Connect the receivers keeping the rollups up to date."""
+    for payment_class in _payment_classes():
+        post_save.connect(_payment_saved, sender=payment_class)
+        payment_class.payment_state_changed.connect(payment_state_changed)
+    for cart_class in CART_TYPES:
+        cart_class.cart_state_changed.connect(cart_state_changed)
+
+
+def disconnect():
+    for payment_class in _payment_classes():
+        post_save.disconnect(_payment_saved, sender=payment_class)
+        payment_class.payment_state_changed.disconnect(payment_state_changed)
+    for cart_class in CART_TYPES:
+        cart_class.cart_state_changed.disconnect(cart_state_changed)
+
+
+def _add_revenue_totals(totals, chunk_size):
+    for payment_class in _payment_classes():
+        payments = payment_class.objects.filter(state__in=("PAID", "REFUND")).only(
+            "amount", "state", "gateway", "created")
+        for chunk in keyset_chunks(payments, chunk_size):
+            for payment in chunk:
+                key = (_day(payment.created), payment.gateway or "", payment_currency(payment))
+                total = totals.get(key, (ZERO, ZERO, 0, 0))
+                totals[key] = tuple([t + r for t, r in
+                                     zip(total, _revenue(payment.state, payment.amount))])
+
+
+def _add_subscription_events(events, chunk_size):
+    def add(day, new, cancelled, mrr):
+        event = events.get(day, (0, 0, ZERO))
+        events[day] = (event[0] + new, event[1] + cancelled, event[2] + mrr)
+
+    for cart_class in CART_TYPES:
+        for cls in cart_class.recurring_lineitem_types:
+            items = cls.objects.filter(cart___cart_state__in=SUBSCRIBED_STATES).select_related("cart")
+            for chunk in keyset_chunks(items, chunk_size):
+                first_paid = dict(cart_class.payment_class.objects.filter(
+                    cart__in=set([item.cart_id for item in chunk]), state="PAID"
+                ).values_list("cart").annotate(Min("created")))
+                for item in chunk:
+                    cart = item.cart
+                    start = first_paid.get(cart.pk)
+                    # Carts can be cancelled without ever subscribing
+                    if start is None:
+                        if cart.state != "RECURRING":
+                            continue
+                        start = item.recurring_start or cart.created
+                    mrr = monthly_amount(item)
+                    add(_day(start), 1, 0, mrr)
+                    if cart.state != "RECURRING":
+                        add(_day(cart.last_updated), 0, 1, -mrr)
+
+
+def _write_revenue(totals):
+    DailyRevenue.objects.all().delete()
+    DailyRevenue.objects.bulk_create([
+        DailyRevenue(day=day, gateway=gateway, currency=currency, gross=gross,
+                     refunds=refunds, net=gross - refunds, payments=payments,
+                     refund_payments=refund_payments)
+        for (day, gateway, currency), (gross, refunds, payments, refund_payments)
+        in totals.items()])
+    return len(totals)
+
+
+def _write_subscriptions(events):
+    rows = []
+    active, mrr = 0, ZERO
+    for day in sorted(events):
+        new, cancelled, change = events[day]
+        active += new - cancelled
+        mrr += change
+        rows.append(DailySubscriptions(day=day, new=new, cancelled=cancelled,
+                                       active=active, mrr=mrr))
+    DailySubscriptions.objects.all().delete()
+    DailySubscriptions.objects.bulk_create(rows)
+    return len(rows)
+
+
+def backfill(chunk_size=1000):
+    """Rebuild the rollup tables from every shard's payments and subscriptions.
+
+    Returns {"revenue": rows, "subscriptions": rows} written."""
+    totals, events = {}, {}
+    for alias in sharding.shard_aliases():
+        with sharding.use_shard(alias):
+            _add_revenue_totals(totals, chunk_size)
+            _add_subscription_events(events, chunk_size)
+    with transaction.atomic(using=router.db_for_write(DailyRevenue)):
+        return {"revenue": _write_revenue(totals),
+                "subscriptions": _write_subscriptions(events)}
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Read replica routing for HiiCart.
+
+Reads only go to a replica when the caller says they may.  Read-only paths
+use `HiiCart.objects.for_read()` or wrap a block in `using_replica()`:
+
+    cart = HiiCart.objects.for_read().get(pk=cartid)
+
+    with using_replica():
+        expiration = cart.get_expiration()
+
+Everything else, including every IPN and gateway path, reads from the
+primary.  Reads are also kept on the primary inside `pin_to_primary()`, a
+unit of work (see hiicart.lib.unitofwork) or any transaction.
+
+Replicas lag, so for READ_YOUR_WRITES after a cart changes state or one of
+its payments is added or changes state, that cart is read from the primary.  The changes are recorded
+in the django cache so the window holds across processes.  Carts read with
+for_read() are checked after loading and the recently changed ones are
+loaded again from the primary; reads through related managers such as
+cart.payments are routed by their cart.
+
+Add the router to the django settings and list the replica aliases:
+
+    DATABASE_ROUTERS = ["hiicart.routers.ReplicaRouter"]
+    HIICART_SETTINGS = {"READ_REPLICAS": ["replica1", "replica2"]}
+"""
+
+import functools
+import math
+import random
+import threading
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from hiicart.lib import unitofwork
+from hiicart.settings import SETTINGS as hiicart_settings
+
+_local = threading.local()
+
+
+def replicas():
+    return hiicart_settings.get("READ_REPLICAS") or []
+
+
+def is_replica(alias):
+    return alias in replicas()
+
+
+def is_pinned():
+    """True if reads on this thread must go to the primary."""
+    return bool(getattr(_local, "primary", 0) or unitofwork.current() is not None
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block)
+
+
+def replica_alias():
+    """A replica to read from now, or None to read from the primary."""
+    aliases = replicas()
+    if not aliases or is_pinned():
+        return None
+    return random.choice(aliases)
+
+
+def _cart_key(instance):
+    """Cache key for the cart an instance is or belongs to, or None."""
+    if hasattr(instance, "cart_state_changed"):
+        model, pk = instance.__class__, instance.pk
+    elif getattr(instance, "cart_id", None) is not None:
+        model, pk = instance._meta.get_field("cart").rel.to, instance.cart_id
+    else:
+        return None
+    if pk is None:
+        return None
+    return "hiicart.written.%s.%s.%s" % (model._meta.app_label, model._meta.object_name, pk)
+
+
+def record_write(instance):
+    """Read the cart instance is or belongs to from the primary for a while."""
+    window = hiicart_settings.get("READ_YOUR_WRITES")
+    key = _cart_key(instance)
+    if not replicas() or not window or key is None:
+        return
+    cache.set(key, True, max(int(math.ceil(window.total_seconds())), 1))
+
+
+def recently_written(instances):
+    """The instances whose carts are within the read-your-writes window."""
+    keys = dict((obj, _cart_key(obj)) for obj in instances)
+    found = cache.get_many([key for key in keys.values() if key is not None])
+    return [obj for obj, key in keys.items() if key in found]
+
+
+class ThreadFlag(object):
+    """Context manager and decorator setting a flag for the current thread."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        setattr(_local, self.name, getattr(_local, self.name, 0) + 1)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        setattr(_local, self.name, getattr(_local, self.name) - 1)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with ThreadFlag(self.name):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def using_replica(func=None):
+    """Let reads in a block of code, or a decorated function, use a replica."""
+    flag = ThreadFlag("replica")
+    return flag(func) if callable(func) else flag
+
+
+def pin_to_primary(func=None):
+    """Read from the primary in a block of code or a decorated function."""
+    flag = ThreadFlag("primary")
+    return flag(func) if callable(func) else flag
+
+
+class ReplicaRouter(object):
+    """Routes reads to READ_REPLICAS where allowed, and all writes to the primary."""
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get("instance")
+        from_replica = instance is not None and is_replica(instance._state.db)
+        if not (getattr(_local, "replica", 0) or from_replica):
+            return None
+        if is_pinned():
+            return DEFAULT_DB_ALIAS
+        if instance is not None and recently_written([instance]):
+            return DEFAULT_DB_ALIAS
+        if from_replica:
+            return instance._state.db
+        return replica_alias()
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get("instance")
+        if instance is not None and is_replica(instance._state.db):
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = [DEFAULT_DB_ALIAS] + replicas()
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
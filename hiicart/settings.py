@@ -6,21 +6,76 @@ General settings for HiiCart. Gateway settings are in each gateway's module.
  None.
 
 **Optional Settings:**
+ * *ABANDON_AFTER* -- Dict of cart states to timedeltas.  Carts which stay in
+            one of these states for longer than its timedelta are marked
+            ABANDONED by hiicart.sweeper. [default: OPEN and SUBMITTED after
+            30 days]
+ * *ARCHIVE_AFTER* -- Dict of cart states to timedeltas.  Carts which stay in
+            one of these states for longer than its timedelta are moved to
+            cold storage by hiicart.archive. [default: ABANDONED after 90
+            days, CANCELLED and REFUND after 365, COMPLETED after 730]
+ * *ARCHIVE_BACKEND* -- "db" to archive carts to the ArchivedCart table or
+            "file" for gzipped JSON-lines files in ARCHIVE_DIR.
+            [default: "db"]
+ * *ARCHIVE_DIR* -- Directory for the "file" archive backend. [default: None]
+ * *AUDIT_RATE_LIMIT* -- (count, seconds) limiting how often the same message
+            may be logged by hiicart.lib.auditing.log_with_stacktrace.
+            [default: None (no limit)]
+ * *AUDIT_SAMPLE_RATE* -- Fraction (0.0 - 1.0) of log_with_stacktrace calls
+            which capture and log a stack. [default: 1.0]
+ * *CART_CACHE_MISS_TIMEOUT* -- Seconds hiicart.cartcache remembers that no
+            cart has a uuid. [default: 60]
+ * *CART_CACHE_TIMEOUT* -- Seconds hiicart.cartcache caches carts looked up
+            by id or uuid for, or None not to cache them. [default: None]
  * *CART_COMPLETE* -- Where to send users after the gateway. [default: None]
  * *CART_SETTINGS_FN* -- Function to call to get cart-specific settings. See
             note below about how these work. [default: None]
+ * *CART_SETTINGS_MANY_FN* -- Function to call with a list of carts to get
+            the cart-specific settings of each, in order, at once.  Used by
+            HiiCartBase.submit_many instead of CART_SETTINGS_FN. [default: None]
  * *CHARGE_RECURRING_GRACE_PERIOD* -- Timedela for grace period before charging
             recurring items. Useful to inject a slight delay so that the billing
             attempt isn't made before the gateway allows it. [default: None]
+ * *DEFAULT_CURRENCY* -- Currency of payments through gateways without a
+            CURRENCY_CODE setting, for hiicart.rollups. [default: "USD"]
  * *EXPIRATION_GRACE_PERIOD* -- Timedelta for grace period before a recurring
             item is marked as expired.  Useful because sometimes a eCheck needs
             to clear or the gateway is a day late with the recurring payment.
             [default: None]
+ * *HTTP_TIMEOUT* -- Seconds after which gateway API requests made through
+            hiicart.lib.http time out, or None to wait. [default: None]
+ * *INSTRUMENTATION* -- If True, count queries, database and gateway HTTP time
+            for cart and IPN operations and send
+            hiicart.signals.operation_measured for each. See
+            hiicart.lib.instrumentation. [default: False]
  * *KEEP_ON_USER_DELETE* -- If True, stop CASCADE ON DELETE when associted User
             is deleted. (django > 1.3 ONLY)
  * *LIVE* -- If True, go against live gateway servers. [default: False]
+ * *LONG_POLL_MAX* -- Longest wait, in seconds, the cart status view's
+            long-poll mode allows. [default: 30]
  * *LOG* -- Logfile for HiiCart. [default: None]
  * *LOG_LEVEL* -- Logging level for the HiiCart log. [default: logging.DEBUG]
+ * *READ_REPLICAS* -- Database aliases of read replicas used by read-only
+            paths through hiicart.routers.ReplicaRouter. [default: []]
+ * *READ_YOUR_WRITES* -- Timedelta for which a cart is read from the primary
+            after it changes state or gets a payment. [default: 5
+            seconds]
+ * *ROLLUPS* -- If True, keep the daily revenue and subscription tables up
+            to date as payments and carts change.  See hiicart.rollups.
+            [default: False]
+ * *SHARD_FN* -- Name of a function returning the database alias a new cart
+            should be stored on.  See hiicart.sharding. [default: None]
+ * *SHARDS* -- Database aliases carts are sharded across by store, through
+            hiicart.sharding.ShardRouter. [default: []]
+ * *SIGNAL_DISPATCH* -- How cart_state_changed and payment_state_changed are
+            delivered: "sync", "on_commit" or "celery". See hiicart.signals.
+            [default: "sync"]
+ * *SNAPSHOT_TIMEOUT* -- Seconds hiicart.snapshot.get_snapshot caches cart
+            snapshots for, or None not to cache them. [default: None]
+ * *SUBMIT_WORKERS* -- Most carts HiiCartBase.submit_many submits at once.
+            [default: 8]
+ * *TAX_TABLE* -- Path of the compiled tax rate table hiicart.tax looks
+            rates up in. [default: None]
 
 
 ** About Global Settings**
@@ -53,14 +108,38 @@ obviate the need for each gateway to have a setting for the return url.
 """
 
 import logging
+from datetime import timedelta
 
 SETTINGS = {
+    'ABANDON_AFTER': {'OPEN': timedelta(days=30), 'SUBMITTED': timedelta(days=30)},
+    'ARCHIVE_AFTER': {'ABANDONED': timedelta(days=90), 'CANCELLED': timedelta(days=365),
+                      'COMPLETED': timedelta(days=730), 'REFUND': timedelta(days=365)},
+    'ARCHIVE_BACKEND': 'db',
+    'ARCHIVE_DIR': None,
+    'AUDIT_RATE_LIMIT': None,
+    'AUDIT_SAMPLE_RATE': 1.0,
+    'CART_CACHE_MISS_TIMEOUT': 60,
+    'CART_CACHE_TIMEOUT': None,
     'CART_COMPLETE': None,
     'CART_SETTINGS_FN': None,
+    'CART_SETTINGS_MANY_FN': None,
     'CHARGE_RECURRING_GRACE_PERIOD': None,
+    'DEFAULT_CURRENCY': 'USD',
     'EXPIRATION_GRACE_PERIOD': None,
+    'HTTP_TIMEOUT': None,
+    'INSTRUMENTATION': False,
     'KEEP_ON_USER_DELETE': None,
     'LIVE': False,
+    'LONG_POLL_MAX': 30,
+    'READ_REPLICAS': [],
+    'READ_YOUR_WRITES': timedelta(seconds=5),
+    'ROLLUPS': False,
+    'SHARD_FN': None,
+    'SHARDS': [],
+    'SIGNAL_DISPATCH': 'sync',
+    'SNAPSHOT_TIMEOUT': None,
+    'SUBMIT_WORKERS': 8,
+    'TAX_TABLE': None,
     }
 
 # Integrate django settings
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Shard cart data by store.
+
+Multi-seller deployments can keep each store's carts, line items, payments
+and notes on their own database.  List the shard aliases in the SHARDS
+setting and add the router:
+
+    DATABASE_ROUTERS = ["hiicart.sharding.ShardRouter"]
+    HIICART_SETTINGS = {"SHARDS": ["shard1", "shard2"],
+                        "STORE_SETTINGS_FN": "store.utils.cart_settings"}
+
+A new cart is placed on the shard named by:
+
+ 1. the innermost `use_shard` block, see below;
+ 2. SHARD_FN, the name of a function returning a shard alias for a cart;
+ 3. the "SHARD" key of the settings returned by STORE_SETTINGS_FN;
+ 4. the shard activated for the current thread;
+ 5. otherwise, the first of SHARDS.
+
+The choice made by 2 or 3 is remembered on the cart, so the functions are
+called once per cart.
+
+Saved carts stay where they are.  Line items, payments and notes follow
+their cart when they are created through it (cart.payments.create()) or
+saved with save(); other queries, including Model.objects.create(), go to
+the current thread's shard.  When a gateway or IPN handler loads a cart's store settings
+it activates that cart's shard, so the handler's queries find its payments.
+The activation lasts until the request or celery task finishes, or
+`activate(None)`.  Writes routed to a shard inside a unit of work
+(hiicart.lib.unitofwork) run in its transaction on that shard.
+
+Each cart's shard is also written to a CartLocation row on the default
+database, so hiicart.utils.cart_by_uuid finds a cart with one lookup
+instead of trying every shard.  hiicart's other tables which aren't cart
+data -- archive tombstones and the rollups -- are kept on the default
+database as well.
+
+Reports spanning every shard can run a function on each shard in parallel
+with `fan_out`:
+
+    counts = fan_out(lambda alias: HiiCart.objects.filter(_cart_state="OPEN").count())
+
+Other apps' tables, such as the carts' users, stay on the default database;
+foreign keys to them from a shard can't be enforced by the database.
+
+Run syncdb/migrate against each shard; the sweeper and archiver process
+every shard.  Sharding and read replicas (hiicart.routers) can't be combined.
+"""
+
+import functools
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.core.signals import request_finished
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from hiicart.settings import SETTINGS as hiicart_settings
+try:
+    from celery.signals import task_postrun
+except ImportError:
+    task_postrun = None
+
+_local = threading.local()
+
+
+def shards():
+    return hiicart_settings.get("SHARDS") or []
+
+
+def shard_aliases():
+    """Aliases to run a job on: each shard, or [None] if not sharded."""
+    return list(shards()) or [None]
+
+
+def current_shard():
+    """The shard queries on this thread go to, or None for the default."""
+    stack = getattr(_local, "stack", None)
+    if stack:
+        return stack[-1]
+    return getattr(_local, "active", None)
+
+
+def activate(alias):
+    """Send this thread's queries to `alias` until the request finishes."""
+    _local.active = alias
+
+
+def _deactivate(**kwargs):
+    _local.active = None
+
+request_finished.connect(_deactivate)
+if task_postrun is not None:
+    task_postrun.connect(_deactivate)
+
+
+class use_shard(object):
+    """Context manager and decorator running code against one shard."""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __enter__(self):
+        # use_shard(None) leaves the current shard in place
+        alias = self.alias if self.alias is not None else current_shard()
+        if not hasattr(_local, "stack"):
+            _local.stack = []
+        _local.stack.append(alias)
+        return alias
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _local.stack.pop()
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with use_shard(self.alias):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def resolve_shard(cart, store_settings=None):
+    """The shard `cart` lives on, or is to be created on.
+
+    `store_settings` saves calling STORE_SETTINGS_FN again when the caller
+    already has the cart's store settings."""
+    from hiicart.utils import call_func
+    if cart._state.db in shards() and not cart._state.adding:
+        return cart._state.db
+    stack = getattr(_local, "stack", None)
+    if stack and stack[-1] is not None:
+        return stack[-1]
+    if "_store_shard" not in cart.__dict__:
+        alias = None
+        if hiicart_settings.get("SHARD_FN"):
+            alias = call_func(hiicart_settings["SHARD_FN"], cart)
+        if not alias:
+            if store_settings is None and hiicart_settings.get("STORE_SETTINGS_FN"):
+                store_settings = call_func(hiicart_settings["STORE_SETTINGS_FN"], cart)
+            alias = (store_settings or {}).get("SHARD")
+        cart._store_shard = alias or None
+    return cart._store_shard or current_shard() or shards()[0]
+
+
+def activate_cart(cart, store_settings=None):
+    """Activate the shard of `cart` for this thread, if sharding is on.
+
+    Called by gateways and IPN handlers when they load store settings."""
+    if shards():
+        activate(resolve_shard(cart, store_settings))
+
+
+def record_location(cart):
+    """Remember which shard a newly created cart went to."""
+    from hiicart.models import CartLocation
+    if not shards() or cart._state.db is None:
+        return
+    CartLocation.objects.using(DEFAULT_DB_ALIAS).create(cart_uuid=cart.cart_uuid,
+                                                        shard=cart._state.db)
+
+
+def locate(uuid):
+    """The shard holding the cart with this uuid, or None if unknown."""
+    from hiicart.models import CartLocation
+    if not shards():
+        return None
+    found = CartLocation.objects.using(DEFAULT_DB_ALIAS).filter(
+        cart_uuid=uuid).values_list("shard", flat=True)[:1]
+    return found[0] if found else None
+
+
+def fan_out(func, aliases=None, parallel=True):
+    """Call func(alias) against each shard, returning {alias: result}.
+
+    With `parallel` each shard is queried on its own thread, whose database
+    connections are closed when it finishes."""
+    aliases = aliases or shard_aliases()
+
+    def run(alias):
+        try:
+            with use_shard(alias):
+                return func(alias)
+        finally:
+            if parallel:
+                for conn in connections.all():
+                    conn.close()
+
+    if not parallel or len(aliases) < 2:
+        parallel = False
+        results = [run(alias) for alias in aliases]
+    else:
+        pool = ThreadPool(len(aliases))
+        try:
+            results = pool.map(run, aliases)
+        finally:
+            pool.close()
+            pool.join()
+    return dict(zip(aliases, results))
+
+
+def _is_sharded(model):
+    from hiicart.models import HiiCartBase, LineItemBase, Note, PaymentBase, PaymentResponse
+    return issubclass(model, (HiiCartBase, LineItemBase, PaymentBase, Note, PaymentResponse))
+
+
+def _is_global(model):
+    """Whether model is one of hiicart's tables kept only on the default database."""
+    return model._meta.app_label == "hiicart" and not _is_sharded(model)
+
+
+class ShardRouter(object):
+    """Places each store's cart data on its shard; see the module docs."""
+
+    def _db_for(self, model, instance):
+        if not shards():
+            return None
+        from_shard = instance is not None and _is_sharded(instance.__class__)
+        if _is_global(model):
+            return DEFAULT_DB_ALIAS
+        if not _is_sharded(model):
+            # Shared tables, ex. a cart's user, stay on the default database
+            return DEFAULT_DB_ALIAS if from_shard else None
+        if from_shard:
+            if instance._state.db is not None and not instance._state.adding:
+                return instance._state.db
+            if hasattr(instance, "cart_state_changed"):
+                return resolve_shard(instance)
+            cart = getattr(instance, "_cart_cache", None)
+            if cart is not None and not cart._state.adding:
+                return cart._state.db
+            if instance._state.db is not None:
+                return instance._state.db
+        return current_shard()
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, hints.get("instance"))
+
+    def db_for_write(self, model, **hints):
+        from hiicart.lib import unitofwork
+        alias = self._db_for(model, hints.get("instance"))
+        if alias is not None:
+            unitofwork.join(alias)
+        return alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not shards():
+            return None
+        sharded = [_is_sharded(obj.__class__) for obj in (obj1, obj2)]
+        if all(sharded):
+            return obj1._state.db == obj2._state.db
+        # Sharded rows may point at shared ones, ex. a cart's user
+        return True if any(sharded) else None
+
+    def allow_syncdb(self, db, model):
+        if not shards():
+            return None
+        if _is_global(model):
+            return db == DEFAULT_DB_ALIAS
+        if _is_sharded(model):
+            return db in shards()
+        return None
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Signals sent by HiiCart.
+
+The cart_state_changed and payment_state_changed signals are still created
+per class by HiiCartMetaclass and PaymentMetaclass in hiicart.models.  How
+they are delivered depends on the SIGNAL_DISPATCH setting:
+
+ * "sync" (the default) -- receivers are called as soon as the change is
+   saved, or when the unit of work it was saved in commits (see
+   hiicart.lib.unitofwork).  Receiver exceptions propagate.
+ * "on_commit" -- like "sync", but every receiver is called even if another
+   fails; failures are logged.  Signals queued by a unit of work are
+   delivered together after it commits, grouped by cart.
+ * "celery" -- signals are delivered by the hiicart.tasks.deliver_signals
+   celery task, one task per cart, with receivers isolated as for
+   "on_commit".  The task reloads the cart or payment from the database,
+   or shard, it was saved to, so receivers see it as it is when the task
+   runs.
+
+In every mode the signals for a single cart are delivered in the order they
+were sent.  Outside a unit of work saves commit immediately, so "after
+commit" only differs from "sync" for code using units of work.
+"""
+
+import logging
+
+from django.dispatch import Signal
+
+from hiicart.settings import SETTINGS as hiicart_settings
+
+log = logging.getLogger("hiicart.signals")
+
+# Sent when an instrumented operation (see hiicart.lib.instrumentation)
+# finishes.  `sender` is the operation name, ex. "cart.save" or
+# "ipn.PaypalIPN.accept_payment", and `stats` is an OperationStats.
+operation_measured = Signal(providing_args=["operation", "stats"])
+
+DISPATCH_MODES = ("sync", "on_commit", "celery")
+
+
+def _cart_id(kwargs):
+    if "cart" in kwargs:
+        return kwargs["cart"].pk
+    return kwargs["payment"].cart_id
+
+
+def group_by_cart(signals):
+    """Group (signal, kwargs) pairs by cart, keeping the order within each."""
+    groups = {}
+    order = []
+    for signal, kwargs in signals:
+        key = _cart_id(kwargs)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append((signal, kwargs))
+    return [groups[key] for key in order]
+
+
+def deliver(signals):
+    """Send each (signal, kwargs) pair to every receiver, logging failures."""
+    for signal, kwargs in signals:
+        for receiver, response in signal.send_robust(**kwargs):
+            if isinstance(response, Exception):
+                log.error("Signal receiver %r failed for %s: %r" % (
+                          receiver, kwargs.get("sender"), response))
+
+
+def serialize(signal, kwargs):
+    """Reduce a state change signal to something celery can pickle."""
+    if "cart" in kwargs:
+        name, instance = "cart_state_changed", kwargs["cart"]
+    else:
+        name, instance = "payment_state_changed", kwargs["payment"]
+    return {"signal": name,
+            "model": "%s.%s" % (instance._meta.app_label, instance._meta.object_name),
+            "pk": instance.pk,
+            "db": instance._state.db,
+            "sender": kwargs["sender"],
+            "old_state": kwargs["old_state"],
+            "new_state": kwargs["new_state"]}
+
+
+def dispatch(signals):
+    """Deliver (signal, kwargs) pairs according to SIGNAL_DISPATCH."""
+    mode = hiicart_settings.get("SIGNAL_DISPATCH", "sync")
+    if mode not in DISPATCH_MODES:
+        raise ValueError("Unknown SIGNAL_DISPATCH: %s" % mode)
+    if mode == "sync":
+        for signal, kwargs in signals:
+            signal.send(**kwargs)
+        return
+    for group in group_by_cart(signals):
+        if mode == "celery":
+            # importing now keeps celery optional
+            from hiicart.tasks import deliver_signals
+            deliver_signals.delay([serialize(signal, kwargs) for signal, kwargs in group])
+        else:
+            deliver(group)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compact read-only snapshots of carts for display paths.
+
+Receipt pages and status APIs only need a few values from a cart, its
+line items and its payments.  A CartSnapshot holds them in immutable
+namedtuple records built from one values() query per table, without
+instantiating any models:
+
+    snapshot = get_snapshot(cart_id)
+    snapshot.cart.total, snapshot.cart.state
+    [(item.name, item.quantity) for item in snapshot.lineitems]
+
+get_snapshot caches snapshots in Django's cache for SNAPSHOT_TIMEOUT
+seconds, unless they were read from a replica, which may lag.  Saving or
+deleting a cart, line item or payment drops its cart's snapshot (see
+hiicart.cartcache); changes made with QuerySet.update() don't, so they
+show once the snapshot expires.  Snapshots convert to plain dicts, JSON
+and, if the msgpack package is installed, msgpack.
+"""
+
+import json
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.dateparse import parse_datetime
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from hiicart import cartcache, routers
+from hiicart.models import HiiCart, HiiCartError
+from hiicart.settings import SETTINGS as hiicart_settings
+
+# (record field, model attname) pairs
+CART_FIELDS = (
+    ("id", "id"), ("cart_uuid", "_cart_uuid"), ("state", "_cart_state"),
+    ("gateway", "gateway"), ("sub_total", "_sub_total"), ("total", "_total"),
+    ("discount", "discount"), ("tax", "tax"), ("shipping", "shipping"),
+    ("shipping_option_name", "shipping_option_name"), ("success_url", "success_url"),
+    ("failure_url", "failure_url"), ("thankyou", "thankyou"),
+    ("bill_first_name", "bill_first_name"), ("bill_last_name", "bill_last_name"),
+    ("bill_email", "bill_email"), ("ship_first_name", "ship_first_name"),
+    ("ship_last_name", "ship_last_name"), ("ship_city", "ship_city"),
+    ("ship_state", "ship_state"), ("ship_country", "ship_country"),
+    ("fulfilled", "fulfilled"), ("created", "created"), ("last_updated", "last_updated"))
+LINEITEM_FIELDS = (
+    ("id", "id"), ("name", "name"), ("description", "description"), ("sku", "sku"),
+    ("quantity", "quantity"), ("unit_price", "unit_price"), ("discount", "discount"),
+    ("sub_total", "_sub_total"), ("total", "_total"), ("recurring_price", "recurring_price"),
+    ("duration", "duration"), ("duration_unit", "duration_unit"),
+    ("is_active", "is_active"))
+PAYMENT_FIELDS = (
+    ("id", "id"), ("amount", "amount"), ("state", "state"), ("gateway", "gateway"),
+    ("transaction_id", "transaction_id"), ("created", "created"))
+DECIMAL_FIELDS = set(["sub_total", "total", "discount", "tax", "shipping", "unit_price",
+                      "recurring_price", "amount"])
+DATETIME_FIELDS = set(["created", "last_updated"])
+
+CartRecord = namedtuple("CartRecord", [name for name, attname in CART_FIELDS])
+# `type` is the line item's class name
+LineItemRecord = namedtuple("LineItemRecord",
+                            ["type"] + [name for name, attname in LINEITEM_FIELDS])
+PaymentRecord = namedtuple("PaymentRecord", [name for name, attname in PAYMENT_FIELDS])
+
+
+def _encode(value):
+    # Unlike DjangoJSONEncoder, keeps microseconds
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError("%r is not JSON serializable" % value)
+
+
+def _decode(record_class, data):
+    values = dict(data)
+    for name, value in values.items():
+        if value is None:
+            continue
+        if name in DECIMAL_FIELDS:
+            values[name] = Decimal(value)
+        elif name in DATETIME_FIELDS:
+            values[name] = parse_datetime(value)
+    return record_class(**values)
+
+
+class CartSnapshot(namedtuple("CartSnapshot", ["cart", "lineitems", "payments"])):
+    """A cart's record with tuples of its line item and payment records."""
+    __slots__ = ()
+
+    def to_dict(self):
+        return {"cart": self.cart._asdict(),
+                "lineitems": [item._asdict() for item in self.lineitems],
+                "payments": [payment._asdict() for payment in self.payments]}
+
+    @classmethod
+    def from_dict(cls, data):
+        """A snapshot from to_dict() output, or the same decoded from JSON."""
+        return cls(_decode(CartRecord, data["cart"]),
+                   tuple([_decode(LineItemRecord, item) for item in data["lineitems"]]),
+                   tuple([_decode(PaymentRecord, payment) for payment in data["payments"]]))
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), default=_encode, sort_keys=True)
+
+    @classmethod
+    def from_json(cls, value):
+        return cls.from_dict(json.loads(value))
+
+    def to_msgpack(self):
+        if msgpack is None:
+            raise HiiCartError("Install msgpack to serialize snapshots with it.")
+        # Round trip through JSON for the Decimal and datetime encoding
+        return msgpack.packb(json.loads(self.to_json()))
+
+    @classmethod
+    def from_msgpack(cls, value):
+        if msgpack is None:
+            raise HiiCartError("Install msgpack to serialize snapshots with it.")
+        return cls.from_dict(msgpack.unpackb(value))
+
+
+def _values(queryset, fields):
+    attnames = [f.attname for f in queryset.model._meta.concrete_fields]
+    present = [(name, attname) for name, attname in fields if attname in attnames]
+    for row in queryset.values(*[attname for name, attname in present]):
+        values = dict((name, None) for name, attname in fields)
+        values.update((name, row[attname]) for name, attname in present)
+        yield values
+
+
+def _read_db(pk, cart_class, for_read):
+    """The database to build a cart's snapshot from."""
+    db = routers.replica_alias() if for_read else None
+    if db is not None and routers.recently_written([cart_class(pk=pk)]):
+        db = DEFAULT_DB_ALIAS
+    return db or cart_class.objects.all().db
+
+
+def _build(pk, cart_class, db):
+    rows = list(_values(cart_class.objects.using(db).filter(pk=pk), CART_FIELDS))
+    if not rows:
+        raise cart_class.DoesNotExist("No %s with pk %s" % (cart_class.__name__, pk))
+    lineitems = []
+    for cls in sorted(cart_class.lineitem_types, key=lambda cls: cls.__name__):
+        for values in _values(cls.objects.using(db).filter(cart=pk), LINEITEM_FIELDS):
+            lineitems.append(LineItemRecord(type=cls.__name__, **values))
+    lineitems.sort(key=lambda item: (item.type, item.id))
+    payments = [PaymentRecord(**values) for values in _values(
+        cart_class.payment_class.objects.using(db).filter(cart=pk).order_by("created", "pk"),
+        PAYMENT_FIELDS)]
+    return CartSnapshot(CartRecord(**rows[0]), tuple(lineitems), tuple(payments))
+
+
+def build_snapshot(pk, cart_class=HiiCart, for_read=False):
+    """
+    Build the snapshot of a cart from the database.
+
+    With `for_read` it's read from a replica, as with for_read(), unless
+    the cart was written within READ_YOUR_WRITES.  Raises
+    cart_class.DoesNotExist if there's no such cart.
+    """
+    return _build(pk, cart_class, _read_db(pk, cart_class, for_read))
+
+
+def get_snapshot(pk, cart_class=HiiCart, for_read=False):
+    """The snapshot of a cart, from the cache if possible.
+
+    Replicas lag, so only snapshots read from the primary are cached."""
+    timeout = hiicart_settings.get("SNAPSHOT_TIMEOUT")
+    if not timeout:
+        return build_snapshot(pk, cart_class, for_read)
+    # Keyed on the database the cart is saved to, as cartcache.invalidate is
+    key = cartcache.snapshot_key(cart_class, pk, cart_class.objects.all().db)
+    snapshot = cache.get(key)
+    if snapshot is not None:
+        cartcache.count("snapshot_hits")
+        return snapshot
+    cartcache.count("snapshot_misses")
+    db = _read_db(pk, cart_class, for_read)
+    snapshot = _build(pk, cart_class, db)
+    if not routers.is_replica(db):
+        cache.set(key, snapshot, timeout)
+    return snapshot
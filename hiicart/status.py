@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Cart status for checkout pages polling a direct gateway's result.
+
+`cart_version` reads a cart's state, total and last_updated with a count
+and the latest change of its payments in one query, touching neither line
+items nor totals calculation.  Its ETag lets the status view answer an
+unchanged cart with 304 Not Modified; only a changed cart costs a second
+query, for the payment summary.
+
+In long-poll mode the view holds the request until the cart changes or
+the wait runs out.  Saves of a cart or its payments wake waiters in the
+same process straight away; changes made by other processes are noticed
+by re-reading the version every POLL_INTERVAL seconds.  Each waiting
+request ties up a worker, so keep LONG_POLL_MAX short.
+"""
+
+import hashlib
+import threading
+import time
+from decimal import Decimal
+
+from django.db.models import Count, Max
+from django.db.models.signals import post_save
+
+from hiicart import sharding
+from hiicart.models import CART_TYPES, HiiCartBase, PaymentBase
+
+# Seconds between checks for changes made by other processes
+POLL_INTERVAL = 1.0
+
+_lock = threading.Lock()
+# {cart key: [Event, waiters]}
+_waiters = {}
+
+
+class CartVersion(object):
+    """What's needed to tell whether a cart changed, and its ETag."""
+
+    def __init__(self, cart_class, db, pk, uuid, state, total, last_updated,
+                 payment_count, payments_updated):
+        self.cart_class, self.db, self.pk, self.uuid = cart_class, db, pk, uuid
+        self.state, self.total, self.last_updated = state, total, last_updated
+        self.payment_count, self.payments_updated = payment_count, payments_updated
+
+    @property
+    def etag(self):
+        # Payments don't touch the cart's last_updated, so they count too
+        value = "%s|%s|%s|%s|%s" % (self.pk, self.state, self.last_updated,
+                                    self.payment_count, self.payments_updated)
+        return '"%s"' % hashlib.md5(value.encode("utf-8")).hexdigest()
+
+
+def _version(cart_class, db, **filters):
+    rows = cart_class.objects.using(db).filter(**filters).annotate(
+        payment_count=Count("payments"), payments_updated=Max("payments__last_updated")
+    ).values_list("pk", "_cart_uuid", "_cart_state", "_total", "last_updated",
+                  "payment_count", "payments_updated")[:1]
+    if not rows:
+        return None
+    return CartVersion(cart_class, db, *rows[0])
+
+
+def cart_version(uuid):
+    """The CartVersion of the cart with `uuid`, or None."""
+    db = sharding.locate(uuid)
+    for cart_class in CART_TYPES:
+        version = _version(cart_class, db, _cart_uuid=uuid)
+        if version is not None:
+            return version
+    return None
+
+
+def reread(version):
+    """A fresh CartVersion of the same cart, or None if it's gone."""
+    return _version(version.cart_class, version.db, pk=version.pk)
+
+
+def status(version):
+    """The status of a cart as a dict for JSON."""
+    payments = version.cart_class.payment_class.objects.using(version.db).filter(
+        cart=version.pk).order_by("created", "pk").values_list("state", "amount")
+    paid = refunded = Decimal("0.00")
+    last_state = None
+    for state, amount in payments:
+        if state == "PAID":
+            paid += amount
+        # Refunded payments are marked REFUND too; only the refund is counted
+        elif state == "REFUND" and amount < 0:
+            refunded -= amount
+        last_state = state
+    return {"cart_uuid": version.uuid, "state": version.state,
+            "total": version.total, "last_updated": version.last_updated,
+            "payments": {"count": version.payment_count, "paid": paid,
+                         "refunded": refunded, "last_state": last_state}}
+
+
+def _key(cart_class, pk):
+    return (cart_class._meta.app_label, cart_class._meta.object_name, pk)
+
+
+def _register(key):
+    with _lock:
+        waiter = _waiters.setdefault(key, [threading.Event(), 0])
+        waiter[1] += 1
+    return waiter
+
+
+def _unregister(key, waiter):
+    with _lock:
+        waiter[1] -= 1
+        if waiter[1] <= 0 and _waiters.get(key) is waiter:
+            del _waiters[key]
+
+
+def wait_for_change(version, timeout):
+    """Wait up to `timeout` seconds for the cart to change.
+
+    Returns its new CartVersion, or None if it didn't change (or is gone)."""
+    key = _key(version.cart_class, version.pk)
+    waiter = _register(key)
+    deadline = time.time() + timeout
+    try:
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            waiter[0].wait(min(remaining, POLL_INTERVAL))
+            fresh = reread(version)
+            if fresh is None:
+                return None
+            if fresh.etag != version.etag:
+                return fresh
+            if waiter[0].is_set():
+                # Woken by a save that didn't change what the ETag covers
+                _unregister(key, waiter)
+                waiter = _register(key)
+    finally:
+        _unregister(key, waiter)
+
+
+def _notify(sender, instance, **kwargs):
+    if isinstance(instance, HiiCartBase):
+        key = _key(instance.__class__, instance.pk)
+    elif isinstance(instance, PaymentBase):
+        key = _key(instance._meta.get_field("cart").rel.to, instance.cart_id)
+    else:
+        return
+    with _lock:
+        waiter = _waiters.pop(key, None)
+    if waiter is not None:
+        waiter[0].set()
+
+post_save.connect(_notify, dispatch_uid="hiicart.status.post_save")
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Move stale carts to the ABANDONED state.
+
+Carts which have stayed in a state listed in the ABANDON_AFTER setting for
+longer than the age given for it are marked ABANDONED.  Stale carts are
+found through the (_cart_state, last_updated) index in keyset-paginated
+chunks, and each chunk is moved with a single UPDATE.  Swept carts are
+dropped from the cart cache (hiicart.cartcache) and read from the primary
+for READ_YOUR_WRITES like saved ones, and cart_state_changed is sent for
+every swept cart once its chunk commits, delivered according to
+SIGNAL_DISPATCH (see hiicart.signals).
+
+Run it periodically with the hiicart_sweep_abandoned management command.
+"""
+
+import logging
+
+from django.utils import timezone
+
+from hiicart import cartcache, routers, sharding
+from hiicart.lib.unitofwork import unit_of_work, send
+from hiicart.models import CART_TYPES, VALID_TRANSITIONS
+from hiicart.settings import SETTINGS as hiicart_settings
+from hiicart.utils import keyset_chunks
+
+log = logging.getLogger("hiicart.sweeper")
+
+
+def sweep_cart_type(cart_class, state, age, chunk_size=500, now=None):
+    """Mark carts of cart_class in `state` last updated over `age` ago ABANDONED.
+
+    Returns the number of carts swept."""
+    if "ABANDONED" not in VALID_TRANSITIONS[state]:
+        raise ValueError("Carts can't be abandoned from %s" % state)
+    now = now or timezone.now()
+    cutoff = now - age
+    stale = cart_class.objects.filter(_cart_state=state, last_updated__lt=cutoff)
+    swept = 0
+    for chunk in keyset_chunks(stale, chunk_size, "last_updated"):
+        with unit_of_work(sharding.current_shard()):
+            # Lock and recheck; carts may have moved on since being read
+            pks = set(cart_class.objects.select_for_update().filter(
+                pk__in=[cart.pk for cart in chunk], _cart_state=state,
+                last_updated__lt=cutoff).values_list("pk", flat=True))
+            if not pks:
+                continue
+            cart_class.objects.filter(pk__in=pks).update(_cart_state="ABANDONED",
+                                                         last_updated=now)
+            for cart in chunk:
+                if cart.pk not in pks:
+                    continue
+                cart._cart_state = cart._old_state = "ABANDONED"
+                cart.last_updated = now
+                cart._snapshot_fields()
+                # The UPDATE skipped save(), which does these for other changes
+                cartcache.invalidate(cart)
+                routers.record_write(cart)
+                send(cart.cart_state_changed, sender=cart_class.__name__, cart=cart,
+                     old_state=state, new_state="ABANDONED")
+        swept += len(pks)
+    if swept:
+        log.info("Marked %i %s %s carts ABANDONED" % (swept, state, cart_class.__name__))
+    return swept
+
+
+def sweep_abandoned(ages=None, chunk_size=500, now=None):
+    """Sweep every cart type on every shard, returning {state: carts swept}.
+
+    `ages` maps states to timedeltas and defaults to ABANDON_AFTER."""
+    if ages is None:
+        ages = hiicart_settings.get("ABANDON_AFTER") or {}
+    now = now or timezone.now()
+    counts = dict((state, 0) for state in ages)
+    for alias in sharding.shard_aliases():
+        with sharding.use_shard(alias):
+            for state, age in ages.items():
+                counts[state] += sum([sweep_cart_type(cart_class, state, age, chunk_size, now)
+                                      for cart_class in CART_TYPES])
+    return counts
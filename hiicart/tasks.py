@@ -0,0 +1,33 @@
+import logging
+
+from celery.decorators import task
+from django.db.models import get_model
+
+from hiicart.signals import deliver
+
+log = logging.getLogger('hiicart.tasks')
+
+
+@task
+def deliver_signals(payloads):
+    """Deliver state change signals for a single cart, in order.
+
+    `payloads` are made by hiicart.signals.serialize."""
+    signals = []
+    for payload in payloads:
+        model = get_model(*payload["model"].split("."))
+        try:
+            instance = model.objects.using(payload.get("db")).get(pk=payload["pk"])
+        except model.DoesNotExist:
+            log.warn("%s #%s deleted before %s could be delivered" % (
+                     payload["model"], payload["pk"], payload["signal"]))
+            continue
+        kwargs = {"sender": payload["sender"],
+                  "old_state": payload["old_state"],
+                  "new_state": payload["new_state"]}
+        if payload["signal"] == "cart_state_changed":
+            kwargs["cart"] = instance
+        else:
+            kwargs["payment"] = instance
+        signals.append((getattr(model, payload["signal"]), kwargs))
+    deliver(signals)
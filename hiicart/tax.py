@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tax rates looked up from a precomputed, memory-mapped table.
+
+Rates come from a CSV file with country, region, postal_code and rate
+columns, where country is a two letter code, region and postal_code may be
+blank and rate is a fraction below 10 with up to five decimal places:
+
+    country,region,postal_code,rate
+    US,CA,,0.0725
+    US,CA,941,0.08625
+    GB,,,0.20
+
+Compile it into a table and point the TAX_TABLE setting at the result:
+
+    python manage.py hiicart_tax_table rates.csv /var/lib/hiicart/tax.table
+
+The table is a sorted array of fixed-width records which is mapped into
+memory and binary searched, so lookups neither query the database nor
+read the whole table into each process.  The most specific row wins:
+country, region and the longest matching postal code prefix, then the
+country and region alone, then the country and postal code prefix, then
+the country alone.
+
+Writing a new table replaces the old file atomically.  Each process notices
+the new file within RELOAD_CHECK_INTERVAL seconds and maps it in place of
+the old one, without a restart.
+"""
+
+import csv
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+from hiicart.models import HiiCartError
+from hiicart.settings import SETTINGS as hiicart_settings
+
+# Seconds between checks for a new TAX_TABLE file
+RELOAD_CHECK_INTERVAL = 1.0
+
+MAGIC = "HCTX"
+# Magic, key width and record count
+HEADER = struct.Struct("<4sHI")
+# Rates are stored in units of 0.00001, as tax_rate keeps five places
+RATE = struct.Struct("<I")
+RATE_PLACES = 5
+# tax_rate holds six digits, so rates must be below 10
+MAX_RATE_UNITS = 10 ** 6 - 1
+CENT = Decimal("0.01")
+# Separates the parts of a key; sorts before any character they may hold
+SEPARATOR = "\x01"
+
+TaxRate = namedtuple("TaxRate", ["country", "region", "postal_code", "rate"])
+
+_lock = threading.Lock()
+_table = None
+_checked = 0
+
+
+def _text(value):
+    value = value or u""
+    return value.decode("utf-8") if isinstance(value, str) else value
+
+
+def _normalize(country, region, postal_code):
+    country = _text(country).strip().upper()
+    region = _text(region).strip().upper()
+    postal_code = "".join(_text(postal_code).upper().replace("-", " ").split())
+    return country, region, postal_code
+
+
+def _key(country, region, postal_code):
+    return SEPARATOR.join([country, region, postal_code]).encode("utf-8")
+
+
+def _stamp(stat):
+    return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+
+class TaxTable(object):
+    """A compiled rate table mapped into memory."""
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, "rb")
+        try:
+            self.stamp = _stamp(os.fstat(f.fileno()))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        if len(self._map) < HEADER.size:
+            raise HiiCartError("Not a tax rate table: %s" % path)
+        magic, self.key_width, self.count = HEADER.unpack_from(self._map, 0)
+        self.record_size = self.key_width + RATE.size
+        if magic != MAGIC or len(self._map) != HEADER.size + self.count * self.record_size:
+            raise HiiCartError("Not a tax rate table: %s" % path)
+
+    def __len__(self):
+        return self.count
+
+    def _record_key(self, i):
+        offset = HEADER.size + i * self.record_size
+        return self._map[offset:offset + self.key_width]
+
+    def _find(self, key):
+        """The rate stored under `key`, or None."""
+        if len(key) > self.key_width:
+            return None
+        key = key.ljust(self.key_width, "\0")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._record_key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count or self._record_key(low) != key:
+            return None
+        units = RATE.unpack_from(self._map, HEADER.size + low * self.record_size + self.key_width)[0]
+        return Decimal(units).scaleb(-RATE_PLACES)
+
+    def lookup(self, country, region="", postal_code=""):
+        """The most specific TaxRate for an address, or None."""
+        country, region, postal_code = _normalize(country, region, postal_code)
+        if not country:
+            return None
+        prefixes = [postal_code[:n] for n in range(len(postal_code), 0, -1)]
+        candidates = []
+        if region:
+            candidates += [(region, prefix) for prefix in prefixes] + [(region, "")]
+        candidates += [("", prefix) for prefix in prefixes] + [("", "")]
+        for candidate_region, prefix in candidates:
+            rate = self._find(_key(country, candidate_region, prefix))
+            if rate is not None:
+                return TaxRate(country, candidate_region, prefix, rate)
+        return None
+
+
+def read_csv(f):
+    """(country, region, postal_code, rate) rows from a rate CSV file."""
+    for number, row in enumerate(csv.DictReader(f), 2):
+        try:
+            yield (row["country"], row.get("region"), row.get("postal_code"),
+                   Decimal(row["rate"].strip()))
+        except (KeyError, AttributeError, InvalidOperation):
+            raise HiiCartError("Line %i: country and rate are required, "
+                               "rate as a decimal fraction" % number)
+
+
+def build_table(rows, path):
+    """
+    Compile (country, region, postal_code, rate) rows into a table at `path`.
+
+    The file is written beside `path` and renamed over it, so processes
+    using the old table switch to the new one whole.  Returns the number
+    of rates written.
+    """
+    records = {}
+    for country, region, postal_code, rate in rows:
+        country, region, postal_code = _normalize(country, region, postal_code)
+        if not country:
+            raise HiiCartError("Rate without a country: %s" % rate)
+        # Countries are ISO 3166 codes, as tax_country holds two letters
+        if len(country) != 2 or not country.isalpha():
+            raise HiiCartError("Invalid country for %s/%s/%s" % (country, region, postal_code))
+        parts = "".join([country, region, postal_code])
+        if "\0" in parts or SEPARATOR in parts:
+            raise HiiCartError("Invalid characters in %s/%s/%s" % (country, region, postal_code))
+        units = Decimal(str(rate)).scaleb(RATE_PLACES)
+        if units != units.to_integral_value() or not 0 <= units <= MAX_RATE_UNITS:
+            raise HiiCartError("Invalid rate for %s/%s/%s: %s" % (country, region,
+                                                                  postal_code, rate))
+        key = _key(country, region, postal_code)
+        if key in records:
+            raise HiiCartError("Duplicate rate for %s/%s/%s" % (country, region, postal_code))
+        records[key] = int(units)
+    key_width = max([len(key) for key in records] or [0])
+    if key_width > 0xffff:
+        raise HiiCartError("Tax rate keys are too long")
+    temp = "%s.%i.tmp" % (path, os.getpid())
+    with open(temp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, key_width, len(records)))
+        for key in sorted(records):
+            f.write(key.ljust(key_width, "\0"))
+            f.write(RATE.pack(records[key]))
+    os.rename(temp, path)
+    return len(records)
+
+
+def get_table():
+    """The TAX_TABLE table, mapped again if the file has been replaced."""
+    global _table, _checked
+    path = hiicart_settings.get("TAX_TABLE")
+    if not path:
+        raise HiiCartError("Set TAX_TABLE to look up tax rates.")
+    table = _table
+    if (table is not None and table.path == path
+            and time.time() - _checked < RELOAD_CHECK_INTERVAL):
+        return table
+    with _lock:
+        try:
+            stamp = _stamp(os.stat(path))
+        except OSError, e:
+            raise HiiCartError("Can't read tax rate table %s: %s" % (path, e))
+        # The old map is left for threads still searching it to drop
+        if _table is None or _table.path != path or _table.stamp != stamp:
+            _table = TaxTable(path)
+        _checked = time.time()
+        return _table
+
+
+def reload():
+    """Map TAX_TABLE again on the next lookup, whether it changed or not."""
+    global _table
+    with _lock:
+        _table = None
+
+
+def lookup(country, region="", postal_code=""):
+    """The most specific TaxRate for an address from TAX_TABLE, or None."""
+    return get_table().lookup(country, region, postal_code)
+
+
+def apply_rate(rate, lineitems):
+    """
+    Tax on line items at `rate`.
+
+    The rate applies to the line item totals _recalc adds up, and the tax
+    is rounded to cents as DecimalField rounds stored totals, following the
+    decimal context's rounding (ROUND_HALF_EVEN by default).
+    """
+    taxable = sum([li.total or 0 for li in lineitems])
+    return (Decimal(taxable) * rate).quantize(CENT)
+
+
+def calculate(cart, lineitems=None):
+    """
+    Set a cart's tax, tax_rate, tax_country and tax_region from the rate for
+    its shipping address, or billing address if it has no shipping country.
+
+    Totals are recalculated but the cart isn't saved.  Returns the TaxRate
+    used, or None if no rate matched, in which case the tax fields are
+    cleared.
+    """
+    if lineitems is None:
+        lineitems = cart.lineitems
+    prefix = "ship" if cart.ship_country else "bill"
+    found = lookup(getattr(cart, prefix + "_country"), getattr(cart, prefix + "_state"),
+                   getattr(cart, prefix + "_postal_code"))
+    if found is None:
+        cart.tax = cart.tax_rate = cart.tax_country = cart.tax_region = None
+    else:
+        cart.tax = apply_rate(found.rate, lineitems)
+        cart.tax_rate = found.rate
+        cart.tax_country = found.country
+        cart.tax_region = found.region or None
+    cart._recalc(lineitems)
+    return found
@@ -1,8 +1,14 @@
 import unittest
 
-import comp, google, core, auditing, paypal_express
+import amazon, comp, google, core, auditing, paypal, paypal_express, \
+    benchmarks, instrumentation, unicodeconverter, unitofwork, signals, sweeper, \
+    archive, indexes, routers, sharding, rollups, export, importer, snapshot, \
+    cartcache, status, httpclient, submit, tax
 
-__tests__ = [comp, google, core, auditing, paypal_express]
+__tests__ = [amazon, comp, google, core, auditing, paypal, paypal_express,
+             benchmarks, instrumentation, unicodeconverter, unitofwork, signals,
+             sweeper, archive, indexes, routers, sharding, rollups, export,
+             importer, snapshot, cartcache, status, httpclient, submit, tax]
 
 def suite():
     suite = unittest.TestSuite()
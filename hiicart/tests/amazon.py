@@ -4,8 +4,30 @@ from datetime import datetime, date, timedelta
 from decimal import Decimal
 from django.conf import settings
 
+from hiicart.gateway.amazon import fps
+from hiicart.gateway.amazon.ipn import AmazonIPN
 from hiicart.models import HiiCart, LineItem, RecurringLineItem
 
+PAY_RESPONSE = """<PayResponse xmlns="http://fps.amazonaws.com/doc/2008-09-17/">
+<PayResult><TransactionId>amzn-1</TransactionId>
+<TransactionStatus>Success</TransactionStatus></PayResult></PayResponse>"""
+
+
 class AmazonPaymentsTestCase(base.HiiCartTestCase):
     """Amazon Payments related tests"""
-    pass
+
+    def test_pay_request_unlocked(self):
+        """The cart isn't locked while the Pay request is out."""
+        handler = AmazonIPN(self.cart)
+        locked = []
+        def do_fps(*args, **kwargs):
+            locked.append(handler._cart_locked)
+            return PAY_RESPONSE
+        old_do_fps, fps.do_fps = fps.do_fps, do_fps
+        try:
+            self.assertEqual(handler.make_pay_request("token"), "Success")
+        finally:
+            fps.do_fps = old_do_fps
+        self.assertEqual(locked, [False])
+        self.assertEqual(self.cart.payments.get().transaction_id, "amzn-1")
+        self.assertEqual(HiiCart.objects.get(pk=self.cart.pk).state, "COMPLETED")
@@ -0,0 +1,71 @@
+import base
+import shutil
+import tempfile
+
+from datetime import timedelta
+from decimal import Decimal
+from django.utils import timezone
+
+from hiicart.archive import archive_carts, restore_cart
+from hiicart.models import CartTombstone, HiiCart, LineItem, Payment, PaymentResponse
+from hiicart.settings import SETTINGS as hiicart_settings
+from hiicart.utils import cart_by_uuid
+
+
+class ArchiveTestCase(base.HiiCartTestCase):
+    """Tests for archiving carts to cold storage and restoring them."""
+
+    def setUp(self):
+        super(ArchiveTestCase, self).setUp()
+        self.now = timezone.now()
+        self.payment = Payment.objects.create(cart=self.cart, amount=Decimal("1.99"),
+                                              state="PAID", transaction_id="archive-1")
+        self.payment.notes.create(text="Payment note")
+        self.cart.notes.create(text="Cart note")
+        PaymentResponse.objects.create(cart=self.cart, response_code=1, response_text="OK")
+        self.cart.set_state("COMPLETED")
+        HiiCart.objects.filter(pk=self.cart.pk).update(
+            last_updated=self.now - timedelta(days=800))
+        self.recent = HiiCart.objects.create(user=self.test_user)
+        self.recent.set_state("COMPLETED")
+        self.ages = {"COMPLETED": timedelta(days=730)}
+        self.old_dir = hiicart_settings["ARCHIVE_DIR"]
+        hiicart_settings["ARCHIVE_DIR"] = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(hiicart_settings["ARCHIVE_DIR"])
+        hiicart_settings["ARCHIVE_DIR"] = self.old_dir
+        CartTombstone.objects.all().delete()
+        super(ArchiveTestCase, self).tearDown()
+
+    def _archive_and_restore(self, backend):
+        uuid = self.cart.cart_uuid
+        counts = archive_carts(self.ages, backend=backend, now=self.now)
+        self.assertEqual(counts, {"COMPLETED": 1})
+        self.assertFalse(HiiCart.objects.filter(pk=self.cart.pk).exists())
+        self.assertFalse(LineItem.objects.filter(pk=self.lineitem.pk).exists())
+        self.assertFalse(Payment.objects.filter(pk=self.payment.pk).exists())
+        self.assertTrue(HiiCart.objects.filter(pk=self.recent.pk).exists())
+        tombstone = CartTombstone.objects.get(cart_uuid=uuid)
+        self.assertEqual(tombstone.cart_id, self.cart.pk)
+        self.assertEqual((tombstone.state, tombstone.sub_total, tombstone.total),
+                         ("COMPLETED", Decimal("1.99"), Decimal("1.99")))
+        # Read-only lookups don't write the cart back
+        self.assertEqual(cart_by_uuid(uuid, for_read=True), None)
+        self.assertTrue(CartTombstone.objects.filter(cart_uuid=uuid).exists())
+        cart = cart_by_uuid(uuid)
+        self.assertEqual(cart.pk, self.cart.pk)
+        self.assertEqual(cart.state, "COMPLETED")
+        self.assertEqual(cart.lineitems[0].pk, self.lineitem.pk)
+        self.assertEqual(cart.payments.get().transaction_id, "archive-1")
+        self.assertEqual(cart.payments.get().notes.get().text, "Payment note")
+        self.assertEqual(cart.notes.get().text, "Cart note")
+        self.assertEqual(cart.payment_results.get().response_text, "OK")
+        self.assertFalse(CartTombstone.objects.filter(cart_uuid=uuid).exists())
+        self.assertEqual(restore_cart(uuid), None)
+
+    def test_db_backend(self):
+        self._archive_and_restore("db")
+
+    def test_file_backend(self):
+        self._archive_and_restore("file")
@@ -3,11 +3,35 @@
 
 """test auditing facilities"""
 
+import logging
 from unittest import TestCase, main
 from hiicart.lib import auditing
 from django.views.debug import ExceptionReporter
 
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
 class AuditingTestCase(TestCase):
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger("hiicart.audit.test")
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def _log(self, message, **kwargs):
+        auditing.log_with_stacktrace(message, logger="hiicart.audit.test", **kwargs)
+        auditing.handler.flush()
+
     def test_auditing(self):
         def foo():
             return bar()
@@ -20,6 +44,46 @@ class AuditingTestCase(TestCase):
         # if this fails we've messed up the fake traceback
         html = er.get_traceback_html()
 
+    def test_fake_traceback_chain(self):
+        """tb_next walks the captured stack from the innermost frame out."""
+        def inner():
+            return auditing.FakeTraceback()
+        tb = inner()
+        self.assertEqual(tb.tb_frame.f_code.co_name, "inner")
+        self.assertEqual(tb.tb_next.tb_frame.f_code.co_name, "test_fake_traceback_chain")
+
+    def test_fallback_sink(self):
+        """Without sentry, stacks are logged to the named logger."""
+        self._log("audit message")
+        self.assertEqual(len(self.handler.records), 1)
+        message = self.handler.records[0].getMessage()
+        self.assertTrue(message.startswith("audit message"))
+        self.assertTrue("test_fallback_sink" in message)
+
+    def test_stack_is_plain_tuples(self):
+        """Only extracted entries are queued, never the frames themselves."""
+        submitted = []
+        submit, auditing.handler.submit = auditing.handler.submit, submitted.append
+        try:
+            auditing.log_with_stacktrace("tuples only", logger="hiicart.audit.test")
+        finally:
+            auditing.handler.submit = submit
+        stack = submitted[0]["stack"]
+        self.assertEqual(stack[0][2], "test_stack_is_plain_tuples")
+        for entry in stack:
+            self.assertTrue(all(isinstance(value, (basestring, int, type(None)))
+                                for value in entry))
+
+    def test_sampling(self):
+        self._log("never sampled", sample_rate=0.0)
+        self.assertEqual(len(self.handler.records), 0)
+
+    def test_rate_limit(self):
+        for i in range(5):
+            self._log("rate limited", rate_limit=(2, 60))
+        self._log("not rate limited", rate_limit=(2, 60))
+        self.assertEqual(len(self.handler.records), 3)
+
 
 if __name__ == '__main__':
     main()
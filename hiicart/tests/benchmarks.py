@@ -0,0 +1,18 @@
+from unittest import TestCase
+
+from hiicart.benchmarks import run_benchmarks
+
+
+class BenchmarkTestCase(TestCase):
+    """Make sure the bundled benchmarks keep running."""
+
+    def test_lifecycle(self):
+        results = run_benchmarks(["lifecycle"], sizes=[2], payments=[3], runs=1)
+        steps = [r["step"] for r in results]
+        self.assertEqual(steps[0], "create")
+        self.assertTrue("ipn.paypal.accept_payment" in steps)
+        self.assertTrue("cancel_if_expired" in steps)
+        for result in results:
+            self.assertEqual(result["runs"], 1)
+            self.assertEqual(result["params"]["lineitems"], 2)
+            self.assertEqual(result["params"]["payments"], 3)
@@ -0,0 +1,84 @@
+import base
+
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from hiicart import cartcache
+from hiicart.lib.unitofwork import unit_of_work
+from hiicart.models import HiiCart, Payment
+from hiicart.settings import SETTINGS as hiicart_settings
+from hiicart.snapshot import get_snapshot
+from hiicart.utils import cart_by_id, cart_by_uuid
+
+
+class CartCacheTestCase(base.HiiCartTestCase):
+    """Tests for the cart lookup cache."""
+
+    def setUp(self):
+        super(CartCacheTestCase, self).setUp()
+        self.old_settings = (hiicart_settings["CART_CACHE_TIMEOUT"],
+                             hiicart_settings["SNAPSHOT_TIMEOUT"])
+        hiicart_settings["CART_CACHE_TIMEOUT"] = 60
+        hiicart_settings["SNAPSHOT_TIMEOUT"] = 60
+        cartcache.reset_stats()
+
+    def tearDown(self):
+        (hiicart_settings["CART_CACHE_TIMEOUT"],
+         hiicart_settings["SNAPSHOT_TIMEOUT"]) = self.old_settings
+        cache.clear()
+        super(CartCacheTestCase, self).tearDown()
+
+    def _queries(self, func, *args):
+        with CaptureQueriesContext(connection) as ctx:
+            result = func(*args)
+        return result, len(ctx.captured_queries)
+
+    def test_by_uuid(self):
+        """Repeat lookups by uuid and id come from the cache."""
+        cart_by_uuid(self.cart.cart_uuid)
+        cart, queries = self._queries(cart_by_uuid, self.cart.cart_uuid)
+        self.assertEqual((cart, queries), (self.cart, 0))
+        self.assertFalse(cart is self.cart)
+        self.assertEqual((cart._state.db, cart._state.adding), ("default", False))
+        self.assertEqual(self._queries(cart_by_id, self.cart.pk), (self.cart, 0))
+        self.assertEqual(cartcache.stats(), {"uuid_misses": 1, "uuid_hits": 1,
+                                             "cart_hits": 2})
+
+    def test_unknown_uuid(self):
+        """Unknown uuids are remembered until a cart gets one."""
+        self.assertEqual(cart_by_uuid("no-such-cart"), None)
+        self.assertEqual(self._queries(cart_by_uuid, "no-such-cart"), (None, 0))
+        self.assertEqual(cartcache.stats()["uuid_negative_hits"], 1)
+        cart = HiiCart(user=self.test_user)
+        cart._cart_uuid = "no-such-cart"
+        cart.save()
+        self.assertEqual(cart_by_uuid("no-such-cart"), cart)
+
+    def test_invalidation_after_commit(self):
+        """A cart cached by another process before a unit of work commits
+        is dropped when it does."""
+        cart_by_id(self.cart.pk)
+        stale = cache.get(cartcache.cart_key(HiiCart, self.cart.pk, "default"))
+        with unit_of_work() as unit:
+            self.cart.set_state("SUBMITTED")
+            unit.flush()
+            cache.set(cartcache.cart_key(HiiCart, self.cart.pk, "default"), stale)
+        self.assertEqual(cart_by_id(self.cart.pk).state, "SUBMITTED")
+
+    def test_invalidation(self):
+        """Saving a cart, line item or payment drops the cart's entries."""
+        get_snapshot(self.cart.pk)
+        cart_by_id(self.cart.pk)
+        self.cart.set_state("SUBMITTED")
+        self.assertEqual(cart_by_id(self.cart.pk).state, "SUBMITTED")
+        self.assertEqual(get_snapshot(self.cart.pk).cart.state, "SUBMITTED")
+        self.lineitem.quantity = 3
+        self.lineitem.save()
+        self.assertEqual(get_snapshot(self.cart.pk).lineitems[0].quantity, 3)
+        Payment.objects.create(cart=self.cart, amount=Decimal("1.00"), state="PAID")
+        self.assertEqual(len(get_snapshot(self.cart.pk).payments), 1)
+        self.cart.delete()
+        self.assertEqual(cart_by_id(self.cart.pk), None)
+        self.assertEqual(cartcache.stats()["snapshot_misses"], 4)
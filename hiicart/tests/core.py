@@ -3,6 +3,8 @@ import base
 from datetime import datetime, date, timedelta
 from decimal import Decimal
 from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from hiicart.models import HiiCart, LineItem, RecurringLineItem
 from hiicart import settings as hsettings
@@ -41,6 +43,49 @@ class HiiCartTestCase(base.HiiCartTestCase):
         self.assertNotEqual(self.cart.id, newcart.id)
         newcart.delete()
 
+    def test_cart_clone_many(self):
+        """Clones get their own uuid, OPEN state, line items and totals."""
+        self.cart._cart_state = "COMPLETED"
+        self.cart.save()
+        self._add_recurring_item()
+        other = HiiCart.objects.create(user=self.test_user)
+        for i in range(3):
+            LineItem.objects.create(cart=other, name="Item %i" % i, quantity=2,
+                                    sku=str(i), unit_price=Decimal("1.00"))
+        with CaptureQueriesContext(connection) as ctx:
+            clones = HiiCart.clone_many([self.cart, other])
+        inserts = [q for q in ctx.captured_queries if "INSERT " in q["sql"]]
+        # One per cart plus one per line item type
+        self.assertEqual(len(inserts), 4)
+        for original, clone in zip([self.cart, other], clones):
+            clone = HiiCart.objects.get(pk=clone.pk)
+            self.assertNotEqual(clone.pk, original.pk)
+            self.assertNotEqual(clone.cart_uuid, original.cart_uuid)
+            self.assertEqual(clone.state, "OPEN")
+            self.assertEqual(len(clone.lineitems), len(original.lineitems))
+            self.assertEqual(clone._total, original.total)
+            self.assertEqual(clone._sub_total, original.sub_total)
+        self.assertEqual(clones[1]._total, Decimal("6.00"))
+
+    def test_with_live_totals(self):
+        """Live totals are summed in the database across line item types."""
+        self._add_recurring_item()
+        self.cart.tax = Decimal("0.50")
+        self.cart.shipping = Decimal("2.00")
+        self.cart.discount = Decimal("1.00")
+        self.cart.save()
+        other = HiiCart.objects.create(user=self.test_user)
+        with CaptureQueriesContext(connection) as ctx:
+            carts = list(HiiCart.objects.with_live_totals().filter(
+                pk__in=[self.cart.pk, other.pk]).order_by("pk"))
+            self.assertEqual(carts[0].sub_total, Decimal("21.99"))
+            self.assertEqual(carts[0].total, Decimal("23.49"))
+            self.assertEqual(carts[1].total, Decimal("0"))
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(carts[0].total, self.cart.total)
+        carts[0].save()
+        self.assertFalse("live_total" in carts[0].__dict__)
+
     def test_lineitem_clone(self):
         """Test line item cloning."""
         newitem = self.lineitem.clone(self.cart)
@@ -166,6 +211,53 @@ class HiiCartTestCase(base.HiiCartTestCase):
         self.assertEqual(p.notes.count(), 1)
         self.assertEqual(p.notes.all()[0].text, note)
 
+    def _updates(self, func):
+        """Run func, returning the UPDATE statements it ran."""
+        with CaptureQueriesContext(connection) as ctx:
+            func()
+        return [q["sql"] for q in ctx.captured_queries if "UPDATE " in q["sql"]]
+
+    def test_save_changed_fields(self):
+        """Only changed fields (and last_updated) are written."""
+        cart = HiiCart.objects.get(pk=self.cart.pk)
+        cart.bill_city = "Portland"
+        updates = self._updates(cart.save)
+        self.assertEqual(len(updates), 1)
+        self.assertTrue("bill_city" in updates[0])
+        self.assertTrue("last_updated" in updates[0])
+        self.assertFalse("bill_street1" in updates[0])
+        self.assertEqual(HiiCart.objects.get(pk=cart.pk).bill_city, "Portland")
+        self.assertEqual(cart.get_dirty_fields(), [])
+
+    def test_save_unchanged(self):
+        """Saves with nothing changed are skipped."""
+        self.cart.save()  # store totals for the line item added in setUp
+        cart = HiiCart.objects.get(pk=self.cart.pk)
+        self.assertEqual(self._updates(cart.save), [])
+        lineitem = LineItem.objects.get(pk=self.lineitem.pk)
+        self.assertEqual(self._updates(lineitem.save), [])
+        lineitem.quantity = 2
+        updates = self._updates(lineitem.save)
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(LineItem.objects.get(pk=lineitem.pk).total, Decimal("3.98"))
+
+    def test_save_state_signal(self):
+        """cart_state_changed is still sent once per state change."""
+        seen = []
+        def receiver(sender, cart, old_state, new_state, **kwargs):
+            seen.append((old_state, new_state))
+        HiiCart.cart_state_changed.connect(receiver)
+        try:
+            self.cart.set_state("SUBMITTED")
+            self.cart.save()
+            payment = self.cart.payments.create(amount=Decimal("1.99"), state="PAID")
+            self.cart.update_state()
+            self.cart.save()
+        finally:
+            HiiCart.cart_state_changed.disconnect(receiver)
+        self.assertEqual(seen, [("OPEN", "SUBMITTED"), ("SUBMITTED", "COMPLETED")])
+        self.assertEqual(HiiCart.objects.get(pk=self.cart.pk).state, "COMPLETED")
+
     def test_state_transitions(self):
         """Test all possible and impossible state transitions."""
         pass
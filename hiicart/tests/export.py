@@ -0,0 +1,72 @@
+import base
+import csv
+import json
+
+from decimal import Decimal
+from StringIO import StringIO
+from django.core.management import call_command
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from hiicart import export, views
+from hiicart.models import HiiCart, Payment
+
+
+class ExportTestCase(base.HiiCartTestCase):
+    """Tests for the streaming cart export."""
+
+    def setUp(self):
+        super(ExportTestCase, self).setUp()
+        self.cart.gateway = "EXPORT"
+        self.cart.save()
+        self.recurring = self._add_recurring_item()
+        self.payment = Payment.objects.create(cart=self.cart, amount=Decimal("1.99"),
+                                              state="PAID", transaction_id="T1")
+        self.empty = HiiCart.objects.create(user=self.test_user, gateway="EXPORT")
+
+    def _rows(self, **filters):
+        return list(export.export_rows(gateways=["EXPORT"], chunk_size=1, **filters))
+
+    def test_rows(self):
+        """A row per line item and payment, and one for a cart with neither."""
+        rows = self._rows()
+        self.assertEqual([(row["record"], row["cart_id"], row.get("item_type"))
+                          for row in rows],
+                         [("lineitem", self.cart.pk, "LineItem"),
+                          ("lineitem", self.cart.pk, "RecurringLineItem"),
+                          ("payment", self.cart.pk, None),
+                          ("cart", self.empty.pk, None)])
+        self.assertEqual(rows[1]["recurring_price"], Decimal("20.00"))
+        self.assertEqual(rows[2]["transaction_id"], "T1")
+        self.assertEqual(rows[2]["cart_uuid"], self.cart.cart_uuid)
+
+    def test_filters(self):
+        self.assertEqual(set(row["cart_id"] for row in self._rows(states=["OPEN"])),
+                         set([self.cart.pk, self.empty.pk]))
+        self.assertEqual(self._rows(states=["COMPLETED"]), [])
+        self.assertEqual(self._rows(start=export.parse_when("2999-01-01")), [])
+        self.assertEqual(len(self._rows(end=export.parse_when("2999-01-01"))), 4)
+        self.assertRaises(ValueError, export.parse_when, "yesterday")
+
+    def test_command(self):
+        out = StringIO()
+        call_command("hiicart_export", gateways=["EXPORT"], stdout=out)
+        lines = list(csv.reader(StringIO(out.getvalue())))
+        self.assertEqual(tuple(lines[0]), export.COLUMNS)
+        self.assertEqual(len(lines), 5)
+        out = StringIO()
+        call_command("hiicart_export", format="jsonl", gateways=["EXPORT"], stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(rows[2]["amount"], "1.99")
+
+    @override_settings(ROOT_URLCONF="hiicart.urls")
+    def test_view(self):
+        """Staff get a streamed export; others are sent to log in."""
+        request = RequestFactory().get("/export", {"format": "jsonl", "gateway": "EXPORT"})
+        request.user = self.test_user
+        self.assertEqual(views.export(request).status_code, 302)
+        self.test_user.is_staff = True
+        response = views.export(request)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(len("".join(response.streaming_content).splitlines()), 4)
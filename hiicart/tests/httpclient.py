@@ -0,0 +1,50 @@
+import base
+import threading
+
+from hiicart.gateway.paypal2.ipn import Paypal2IPN
+from hiicart.lib import http
+from hiicart.settings import SETTINGS as hiicart_settings
+
+
+class FakeResponse(dict):
+    status = 200
+    reason = "OK"
+
+
+class HttpClientTestCase(base.HiiCartTestCase):
+    """Tests for the pooled gateway HTTP client."""
+
+    def setUp(self):
+        super(HttpClientTestCase, self).setUp()
+        self.old_timeout = hiicart_settings["HTTP_TIMEOUT"]
+        self.requests = []
+
+    def tearDown(self):
+        hiicart_settings["HTTP_TIMEOUT"] = self.old_timeout
+        super(HttpClientTestCase, self).tearDown()
+
+    def test_client_per_thread(self):
+        """Each thread reuses its own client, and so its connections."""
+        client = http.client()
+        self.assertTrue(http.client() is client)
+        other = []
+        thread = threading.Thread(target=lambda: other.append(http.client()))
+        thread.start()
+        thread.join()
+        self.assertFalse(other[0] is client)
+        hiicart_settings["HTTP_TIMEOUT"] = 5
+        self.assertEqual(http.client().timeout, 5)
+
+    def test_ipn_verified_once(self):
+        """IPN confirmation posts the data to PayPal once."""
+        def request(url, method="GET", body=None, headers=None):
+            self.requests.append((method, body, headers["Content-type"]))
+            return FakeResponse(), "VERIFIED"
+        client = http.client()
+        client.request = request
+        try:
+            self.assertTrue(Paypal2IPN(self.cart).confirm_ipn_data("txn_id=1"))
+        finally:
+            del client.request
+        self.assertEqual(self.requests, [("POST", "txn_id=1&cmd=_notify-validate",
+                                          "application/x-www-form-urlencoded")])
@@ -0,0 +1,121 @@
+import base
+import json
+
+from datetime import datetime
+from decimal import Decimal
+from django.core.cache import cache
+from django.db.models.signals import post_save
+
+from hiicart import importer
+from hiicart.models import HiiCart, HiiCartError, Payment
+from hiicart.settings import SETTINGS as hiicart_settings
+from hiicart.utils import cart_by_uuid
+
+
+class ImporterTestCase(base.HiiCartTestCase):
+    """Tests for the bulk historical cart importer."""
+
+    def setUp(self):
+        super(ImporterTestCase, self).setUp()
+        self.record = {
+            "cart_uuid": "import-1", "state": "COMPLETED", "user": self.test_user.pk,
+            "created": "2013-05-01 12:00:00", "tax": "1.00", "gateway": "PAYPAL",
+            "history": ["SUBMITTED", "PENDING"],
+            "lineitems": [{"name": "Shirt", "sku": "S1", "quantity": 2, "unit_price": "9.99"},
+                          {"type": "RecurringLineItem", "name": "Club", "quantity": 1,
+                           "recurring_price": "5.00", "duration": 1, "duration_unit": "MONTH"}],
+            "payments": [{"amount": "25.98", "state": "PAID", "transaction_id": "X1",
+                          "created": "2013-05-01 12:05:00"}]}
+        self.saved = []
+
+    def tearDown(self):
+        HiiCart.objects.filter(_cart_uuid__startswith="import-").delete()
+        super(ImporterTestCase, self).tearDown()
+
+    def _saved(self, sender, instance, created, **kwargs):
+        self.saved.append((sender.__name__, created))
+
+    def _lines(self, *records):
+        return [json.dumps(record) + "\n" for record in records]
+
+    def test_import(self):
+        """Carts are written with their totals, timestamps and rows."""
+        other = dict(self.record, cart_uuid="import-2", lineitems=[], payments=[])
+        counts = importer.import_carts(self._lines(self.record, other), chunk_size=1)
+        self.assertEqual([counts[key] for key in ("carts", "lineitems", "payments", "skipped")],
+                         [2, 2, 1, 0])
+        self.assertTrue(counts["rows_per_second"] > 0)
+        cart = HiiCart.objects.get(_cart_uuid="import-1")
+        self.assertEqual((cart.state, cart._total, cart._sub_total),
+                         ("COMPLETED", Decimal("25.98"), Decimal("24.98")))
+        self.assertEqual(cart.created, datetime(2013, 5, 1, 12))
+        self.assertEqual(cart.last_updated, datetime(2013, 5, 1, 12))
+        self.assertEqual(sorted([(li.name, li._total) for li in cart.lineitems]),
+                         [("Club", Decimal("5.00")), ("Shirt", Decimal("19.98"))])
+        self.assertEqual(cart.recurring_lineitems[0].duration_unit, "MONTH")
+        payment = cart.payments.get()
+        self.assertEqual((payment.amount, payment.created),
+                         (Decimal("25.98"), datetime(2013, 5, 1, 12, 5)))
+        # Running it again skips what's there
+        counts = importer.import_carts(self._lines(self.record))
+        self.assertEqual((counts["carts"], counts["skipped"]), (0, 1))
+
+    def test_cached_miss(self):
+        """A uuid cached as missing is found once its cart is imported."""
+        old_timeout = hiicart_settings["CART_CACHE_TIMEOUT"]
+        hiicart_settings["CART_CACHE_TIMEOUT"] = 60
+        try:
+            self.assertEqual(cart_by_uuid("import-1"), None)
+            importer.import_carts(self._lines(self.record))
+            self.assertEqual(cart_by_uuid("import-1"),
+                             HiiCart.objects.get(_cart_uuid="import-1"))
+        finally:
+            hiicart_settings["CART_CACHE_TIMEOUT"] = old_timeout
+            cache.clear()
+
+    def test_signals(self):
+        """post_save is sent for the new rows unless signals are off."""
+        post_save.connect(self._saved)
+        try:
+            importer.import_carts(self._lines(self.record), signals=False)
+            self.assertEqual(self.saved, [])
+            importer.import_carts(self._lines(dict(self.record, cart_uuid="import-2")))
+        finally:
+            post_save.disconnect(self._saved)
+        self.assertEqual(sorted(self.saved), [("HiiCart", True), ("LineItem", True),
+                                              ("Payment", True), ("RecurringLineItem", True)])
+
+    def test_other_saves(self):
+        """Rows saved elsewhere during an import still get the current time."""
+        payments = []
+
+        def pay(sender, instance, **kwargs):
+            if sender is HiiCart and not payments:
+                payments.append(Payment.objects.create(cart=self.cart, amount=Decimal("1.00"),
+                                                       state="PAID"))
+
+        post_save.connect(pay)
+        try:
+            importer.import_carts(self._lines(self.record, dict(self.record, cart_uuid="import-2")),
+                                  chunk_size=1)
+        finally:
+            post_save.disconnect(pay)
+        payment = Payment.objects.get(pk=payments[0].pk)
+        self.assertTrue(payment.created.year > 2013)
+        self.assertEqual(payment.created, payments[0].created)
+
+    def test_validation(self):
+        """Bad states and fields are rejected with their line number."""
+        bad = [dict(self.record, state="SHIPPED"),
+               dict(self.record, history=["COMPLETED", "SUBMITTED"]),
+               dict(self.record, colour="red"),
+               dict(self.record, payments=[{"amount": "1.00", "state": "SPENT"}]),
+               dict(self.record, lineitems=[{"type": "GiftCard"}])]
+        for record in bad:
+            self.assertRaises(HiiCartError, importer.import_carts,
+                              ["\n"] + self._lines(record))
+        try:
+            importer.import_carts(["\n"] + self._lines(bad[0]))
+        except HiiCartError, e:
+            self.assertTrue(str(e).startswith("Line 2:"))
+        self.assertFalse(HiiCart.objects.filter(_cart_uuid="import-1").exists())
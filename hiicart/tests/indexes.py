@@ -0,0 +1,61 @@
+import base
+
+from datetime import timedelta
+from django.db import connection
+from django.utils import timezone
+
+from hiicart.models import HiiCart, Payment
+
+
+class IndexTestCase(base.HiiCartTestCase):
+    """Check that hot cart and payment queries are served by an index."""
+
+    def setUp(self):
+        super(IndexTestCase, self).setUp()
+        if connection.vendor != "sqlite":
+            self.skipTest("EXPLAIN QUERY PLAN is specific to sqlite")
+
+    def _index(self, model, columns):
+        """Name of the index on exactly `columns` of model's table."""
+        cursor = connection.cursor()
+        table = model._meta.db_table
+        cursor.execute("PRAGMA index_list(%s)" % connection.ops.quote_name(table))
+        for row in cursor.fetchall():
+            name = row[1]
+            cursor.execute("PRAGMA index_info(%s)" % connection.ops.quote_name(name))
+            if [info[2] for info in cursor.fetchall()] == list(columns):
+                return name
+        self.fail("No index on %s%r" % (table, tuple(columns)))
+
+    def _plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return " ".join([row[-1] for row in cursor.fetchall()])
+
+    def assertUsesIndex(self, queryset, model, columns):
+        name = self._index(model, columns)
+        plan = self._plan(queryset)
+        self.assertTrue("INDEX %s" % name in plan, "%s not used: %s" % (name, plan))
+
+    def test_payments_by_state(self):
+        """cart.payments by state, newest first (RecurringLineItem.get_expiration)."""
+        qs = self.cart.payments.filter(state="PAID", amount__gt=0).order_by("-created")
+        self.assertUsesIndex(qs, Payment, ["cart_id", "state", "created"])
+        self.assertFalse("TEMP B-TREE" in self._plan(qs))
+
+    def test_payment_by_transaction(self):
+        """Payments by gateway and transaction id."""
+        qs = Payment.objects.filter(gateway="paypal", transaction_id="12345")
+        self.assertUsesIndex(qs, Payment, ["gateway", "transaction_id"])
+
+    def test_stale_carts(self):
+        """Carts by state and age (hiicart.sweeper)."""
+        qs = HiiCart.objects.filter(_cart_state="OPEN",
+                                    last_updated__lt=timezone.now() - timedelta(days=30))
+        self.assertUsesIndex(qs, HiiCart, ["_cart_state", "last_updated"])
+
+    def test_carts_by_email(self):
+        """Carts by billing email (hiicart.utils.cart_by_email)."""
+        qs = HiiCart.objects.filter(bill_email="foo@bar.com")
+        self.assertUsesIndex(qs, HiiCart, ["bill_email"])
@@ -0,0 +1,59 @@
+import base
+
+from hiicart.gateway.paypal.ipn import PaypalIPN
+from hiicart.lib.instrumentation import measure, operation_budgets, query_budget, QueryBudgetExceeded
+from hiicart.signals import operation_measured
+
+
+class InstrumentationTestCase(base.HiiCartTestCase):
+    """Tests for query counting and query budgets."""
+
+    def test_measure(self):
+        """Queries made inside measure() are counted."""
+        with measure("test", force=True) as stats:
+            self.cart.save()
+        self.assertTrue(stats.queries > 0)
+        self.assertTrue(stats.elapsed >= stats.db_time)
+
+    def test_disabled(self):
+        """Nothing is measured unless enabled."""
+        with measure("test") as stats:
+            self.cart.save()
+        self.assertEqual(stats, None)
+
+    def test_signal(self):
+        """operation_measured is sent for instrumented methods."""
+        seen = []
+        def receiver(sender, stats, **kwargs):
+            seen.append(sender)
+        operation_measured.connect(receiver)
+        try:
+            with operation_budgets({}):
+                self.cart.update_state()
+        finally:
+            operation_measured.disconnect(receiver)
+        self.assertTrue("cart.update_state" in seen)
+
+    def test_ipn_operations(self):
+        """IPN handler methods are measured per handler class."""
+        with operation_budgets({}) as budgets:
+            PaypalIPN(self.cart).payment_refunded({"txn_id": "1234", "mc_gross": "-1.99"})
+        operations = [s.operation for s in budgets.measured]
+        self.assertTrue("ipn.PaypalIPN.payment_refunded" in operations)
+        self.assertTrue("cart.update_state" in operations)
+
+    def test_query_budget(self):
+        """query_budget raises when a block makes too many queries."""
+        with query_budget(100):
+            self.cart.save()
+        def over_budget():
+            with query_budget(0):
+                self.cart.save()
+        self.assertRaises(QueryBudgetExceeded, over_budget)
+
+    def test_operation_budgets(self):
+        """operation_budgets checks each run of an operation."""
+        def over_budget():
+            with operation_budgets({"cart.save": 0}):
+                self.cart.save()
+        self.assertRaises(QueryBudgetExceeded, over_budget)
@@ -1,9 +1,14 @@
+# -*- coding: utf-8 -*-
 import base
 
 from datetime import datetime, date, timedelta
 from decimal import Decimal
 from django.conf import settings
 
+from hiicart.benchmarks.paypal_ipn import ipn_body
+from hiicart.gateway.paypal.ipn import PaypalIPN
+from hiicart.gateway.paypal.views import decode_ipn_data
+from hiicart.lib.unitofwork import unit_of_work
 from hiicart.models import HiiCart, LineItem, RecurringLineItem
 
 class PaypalTestCase(base.HiiCartTestCase):
@@ -12,4 +17,102 @@ class PaypalTestCase(base.HiiCartTestCase):
 
 class PaypalIpnTestCase(base.HiiCartTestCase):
     """Tests of the PaypalIPN."""
-    pass
+
+    def test_decode_ascii(self):
+        data = decode_ipn_data(ipn_body("windows-1252"))
+        self.assertEqual(data["first_name"], u"Test")
+        self.assertEqual(data["payment_date"], u"20:12:59 Jan 13, 2009 PST")
+        self.assertTrue(isinstance(data["txn_id"], unicode))
+
+    def test_decode_utf8(self):
+        data = decode_ipn_data(ipn_body("UTF-8", {"first_name": u"José",
+                                                  "address_city": u"東京都"}))
+        self.assertEqual(data["first_name"], u"José")
+        self.assertEqual(data["address_city"], u"東京都")
+
+    def test_decode_declared_charset(self):
+        data = decode_ipn_data(ipn_body("shift_jis", {"last_name": u"山田"}))
+        self.assertEqual(data["last_name"], u"山田")
+
+    def test_decode_cp1252_fallback(self):
+        # No usable declared charset, so cp1252 is tried
+        body = ipn_body("windows-1252", {"last_name": u"Müller"})
+        body = body.replace("charset=windows-1252", "charset=bogus")
+        data = decode_ipn_data(body)
+        self.assertEqual(data["last_name"], u"Müller")
+
+    def test_decode_per_field(self):
+        # Mixed encodings only fall back for the fields that need it
+        body = "first_name=%s&last_name=%s&charset=UTF-8" % (
+            u"José".encode("utf-8").replace(" ", "+"), "M%FCller")
+        data = decode_ipn_data(body)
+        self.assertEqual(data["first_name"], u"José")
+        self.assertEqual(data["last_name"], u"Müller")
+
+    def test_decode_immutable(self):
+        data = decode_ipn_data("a=1&a=2&b=")
+        self.assertEqual(data.getlist("a"), [u"1", u"2"])
+        self.assertEqual(data["b"], u"")
+        self.assertRaises(AttributeError, data.__setitem__, "a", u"3")
+
+    def test_concurrent_ipns(self):
+        """An IPN handler holding a stale cart sees an earlier IPN's changes."""
+        self._add_recurring_item()
+        self.cart.set_state("SUBMITTED")
+        seen = []
+        def receiver(sender, cart, old_state, new_state, **kwargs):
+            seen.append((old_state, new_state))
+        HiiCart.cart_state_changed.connect(receiver)
+        try:
+            signup = PaypalIPN(HiiCart.objects.get(pk=self.cart.pk))
+            payment = PaypalIPN(HiiCart.objects.get(pk=self.cart.pk))
+            signup.activate_subscription({"item_number": "42"})
+            payment.cart.bill_city = "Portland"
+            payment.accept_payment({"txn_id": "1", "mc_gross": "20.00",
+                                    "payer_email": "foo@bar.com"})
+        finally:
+            HiiCart.cart_state_changed.disconnect(receiver)
+        self.assertEqual(seen, [("SUBMITTED", "RECURRING")])
+        cart = HiiCart.objects.get(pk=self.cart.pk)
+        self.assertEqual(cart.state, "RECURRING")
+        self.assertEqual(cart.bill_city, "Portland")
+        self.assertEqual(cart.bill_email, "foo@bar.com")
+
+    def test_nested_ipns_in_unit_of_work(self):
+        """Relocking a cart with a pending state change doesn't signal it again."""
+        self._add_recurring_item()
+        self.cart.set_state("SUBMITTED")
+        seen = []
+        def receiver(sender, cart, old_state, new_state, **kwargs):
+            seen.append((old_state, new_state))
+        HiiCart.cart_state_changed.connect(receiver)
+        try:
+            with unit_of_work():
+                handler = PaypalIPN(HiiCart.objects.get(pk=self.cart.pk))
+                handler.activate_subscription({"item_number": "42"})
+                handler.accept_payment({"txn_id": "1", "mc_gross": "20.00",
+                                        "payer_email": "foo@bar.com"})
+        finally:
+            HiiCart.cart_state_changed.disconnect(receiver)
+        self.assertEqual(seen, [("SUBMITTED", "RECURRING")])
+        self.assertEqual(HiiCart.objects.get(pk=self.cart.pk).state, "RECURRING")
+
+    def test_signals_after_commit(self):
+        """Locked handler methods send their signals once they've committed."""
+        self._add_recurring_item()
+        self.cart.set_state("SUBMITTED")
+        seen = []
+        def receiver(sender, cart, old_state, new_state, **kwargs):
+            seen.append(HiiCart.objects.get(pk=cart.pk).state)
+            raise ValueError("Receiver failed")
+        HiiCart.cart_state_changed.connect(receiver)
+        try:
+            handler = PaypalIPN(HiiCart.objects.get(pk=self.cart.pk))
+            self.assertRaises(ValueError, handler.activate_subscription,
+                              {"item_number": "42"})
+        finally:
+            HiiCart.cart_state_changed.disconnect(receiver)
+        self.assertEqual(seen, ["RECURRING"])
+        # A failing receiver doesn't roll back the IPN's writes
+        self.assertEqual(HiiCart.objects.get(pk=self.cart.pk).state, "RECURRING")
+
@@ -0,0 +1,98 @@
+import base
+
+from datetime import date
+from decimal import Decimal
+
+from hiicart import rollups
+from hiicart.models import DailyRevenue, DailySubscriptions, Payment
+
+
+class RollupTestCase(base.HiiCartTestCase):
+    """Tests for the daily revenue and subscription rollups."""
+
+    def setUp(self):
+        super(RollupTestCase, self).setUp()
+        rollups.connect()
+        self.today = date.today()
+
+    def tearDown(self):
+        rollups.disconnect()
+        DailyRevenue.objects.all().delete()
+        DailySubscriptions.objects.all().delete()
+        super(RollupTestCase, self).tearDown()
+
+    def _revenue(self):
+        return sorted([(r.day, r.gateway, r.currency, r.gross, r.refunds, r.net,
+                        r.payments, r.refund_payments)
+                       for r in DailyRevenue.objects.all()])
+
+    def _subscriptions(self):
+        return [(s.day, s.new, s.cancelled, s.active, s.mrr)
+                for s in DailySubscriptions.objects.order_by("day")]
+
+    def test_monthly_amount(self):
+        item = self._add_recurring_item()
+        self.assertEqual(rollups.monthly_amount(item), Decimal("1.67"))
+        item.duration, item.duration_unit = 365, "DAY"
+        self.assertEqual(rollups.monthly_amount(item), Decimal("1.67"))
+        item.duration_unit = "MONTH"
+        item.duration = 1
+        self.assertEqual(rollups.monthly_amount(item), Decimal("20.00"))
+
+    def test_revenue(self):
+        """Payments update the revenue rollup as they're created and change state."""
+        payment = Payment.objects.create(cart=self.cart, amount=Decimal("20.00"),
+                                         state="PENDING", gateway="COMP")
+        self.assertEqual(self._revenue(), [])
+        payment.state = "PAID"
+        payment.save()
+        Payment.objects.create(cart=self.cart, amount=Decimal("5.00"), state="PAID",
+                               gateway="COMP")
+        Payment.objects.create(cart=self.cart, amount=Decimal("-3.00"), state="REFUND",
+                               gateway="COMP")
+        self.assertEqual(self._revenue(), [
+            (self.today, "COMP", "USD", Decimal("25.00"), Decimal("3.00"), Decimal("22.00"), 2, 1)])
+        # Refunded as the gateways do, flipping the payment and adding a refund
+        payment.state = "REFUND"
+        payment.save()
+        self.assertEqual(self._revenue(), [
+            (self.today, "COMP", "USD", Decimal("25.00"), Decimal("3.00"), Decimal("22.00"), 2, 1)])
+        Payment.objects.create(cart=self.cart, amount=Decimal("-20.00"), state="REFUND",
+                               gateway="COMP")
+        self.assertEqual(self._revenue(), [
+            (self.today, "COMP", "USD", Decimal("25.00"), Decimal("23.00"), Decimal("2.00"), 2, 2)])
+
+    def test_subscriptions(self):
+        """Carts entering and leaving RECURRING update the subscription rollup."""
+        self._add_recurring_item()
+        self.cart.set_state("SUBMITTED")
+        self.cart.set_state("RECURRING")
+        self.assertEqual(self._subscriptions(), [(self.today, 1, 0, 1, Decimal("1.67"))])
+        self.cart.set_state("PENDCANCEL")
+        self.cart.set_state("CANCELLED")
+        self.assertEqual(self._subscriptions(), [(self.today, 1, 1, 0, Decimal("0.00"))])
+
+    def test_backfill(self):
+        """A backfill rebuilds what the receivers kept up to date."""
+        self._add_recurring_item()
+        Payment.objects.create(cart=self.cart, amount=Decimal("20.00"), state="PAID",
+                               gateway="COMP")
+        Payment.objects.create(cart=self.cart, amount=Decimal("-1.00"), state="REFUND")
+        self.cart.set_state("RECURRING")
+        self.cart.set_state("CANCELLED")
+        revenue, subscriptions = self._revenue(), self._subscriptions()
+        DailyRevenue.objects.update(gross=0)
+        DailySubscriptions.objects.all().delete()
+        self.assertEqual(rollups.backfill(chunk_size=1), {"revenue": 2, "subscriptions": 1})
+        self.assertEqual(self._revenue(), revenue)
+        self.assertEqual(self._subscriptions(), subscriptions)
+
+    def test_backfill_never_subscribed(self):
+        """A cart cancelled without subscribing isn't counted by either."""
+        self._add_recurring_item()
+        self.cart.set_state("SUBMITTED")
+        self.cart.set_state("CANCELLED")
+        subscriptions = self._subscriptions()
+        self.assertEqual(subscriptions, [])
+        rollups.backfill()
+        self.assertEqual(self._subscriptions(), subscriptions)
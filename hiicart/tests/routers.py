@@ -0,0 +1,104 @@
+import base
+
+from datetime import timedelta
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import connections, router
+
+from hiicart import cartcache, routers
+from hiicart.lib.unitofwork import unit_of_work
+from hiicart.models import HiiCart, Payment
+from hiicart.settings import SETTINGS as hiicart_settings
+from hiicart.snapshot import get_snapshot
+
+
+class ReplicaRouterTestCase(base.HiiCartTestCase):
+    """Tests for routing read-only paths to a replica."""
+
+    def setUp(self):
+        super(ReplicaRouterTestCase, self).setUp()
+        # "replica" shares the default connection, so reads see the same
+        # data and the alias they were routed to shows in _state.db
+        connections.databases["replica"] = connections.databases["default"]
+        setattr(connections._connections, "replica", connections["default"])
+        self.router = routers.ReplicaRouter()
+        router.routers.insert(0, self.router)
+        self.old_settings = (hiicart_settings["READ_REPLICAS"],
+                             hiicart_settings["READ_YOUR_WRITES"])
+        hiicart_settings["READ_REPLICAS"] = ["replica"]
+        hiicart_settings["READ_YOUR_WRITES"] = timedelta(seconds=5)
+
+    def tearDown(self):
+        (hiicart_settings["READ_REPLICAS"],
+         hiicart_settings["READ_YOUR_WRITES"]) = self.old_settings
+        router.routers.remove(self.router)
+        delattr(connections._connections, "replica")
+        del connections.databases["replica"]
+        cache.clear()
+        super(ReplicaRouterTestCase, self).tearDown()
+
+    def test_snapshot_cache(self):
+        """Snapshots read from a replica aren't cached."""
+        old_timeout = hiicart_settings["SNAPSHOT_TIMEOUT"]
+        hiicart_settings["SNAPSHOT_TIMEOUT"] = 60
+        key = cartcache.snapshot_key(HiiCart, self.cart.pk, self.cart._state.db)
+        try:
+            self.assertEqual(get_snapshot(self.cart.pk, for_read=True).cart.id, self.cart.pk)
+            self.assertEqual(cache.get(key), None)
+            snapshot = get_snapshot(self.cart.pk)
+            self.assertEqual(cache.get(key), snapshot)
+            self.cart.set_state("SUBMITTED")
+            self.assertEqual(cache.get(key), None)
+        finally:
+            hiicart_settings["SNAPSHOT_TIMEOUT"] = old_timeout
+
+    def test_primary_by_default(self):
+        """Reads without read intent stay on the primary."""
+        self.assertEqual(HiiCart.objects.get(pk=self.cart.pk)._state.db, "default")
+        hiicart_settings["READ_REPLICAS"] = []
+        self.assertEqual(HiiCart.objects.for_read().get(pk=self.cart.pk)._state.db, "default")
+
+    def test_for_read(self):
+        """for_read() reads from a replica; saves still go to the primary."""
+        cart = HiiCart.objects.for_read().get(pk=self.cart.pk)
+        self.assertEqual(cart._state.db, "replica")
+        self.assertEqual([li._state.db for li in cart.lineitems], ["replica"])
+        self.assertEqual(cart.payments.all().db, "replica")
+        cart.bill_city = "Portland"
+        cart.save()
+        self.assertEqual(cart._state.db, "default")
+
+    def test_using_replica(self):
+        with routers.using_replica():
+            self.assertEqual(HiiCart.objects.get(pk=self.cart.pk)._state.db, "replica")
+            with routers.pin_to_primary():
+                self.assertEqual(HiiCart.objects.get(pk=self.cart.pk)._state.db, "default")
+        self.assertEqual(HiiCart.objects.get(pk=self.cart.pk)._state.db, "default")
+
+    def test_unit_of_work_pins(self):
+        """IPN handlers run in a unit of work and read from the primary."""
+        with unit_of_work():
+            self.assertEqual(HiiCart.objects.for_read().get(pk=self.cart.pk)._state.db, "default")
+            with routers.using_replica():
+                self.assertEqual(HiiCart.objects.get(pk=self.cart.pk)._state.db, "default")
+
+    def test_read_your_writes(self):
+        """Carts are read from the primary for a while after a state change."""
+        other = HiiCart.objects.create(user=self.test_user)
+        self.cart.set_state("SUBMITTED")
+        carts = dict((c.pk, c) for c in HiiCart.objects.for_read().filter(
+            pk__in=[self.cart.pk, other.pk]))
+        self.assertEqual(carts[self.cart.pk]._state.db, "default")
+        self.assertEqual(carts[self.cart.pk].state, "SUBMITTED")
+        self.assertEqual(carts[other.pk]._state.db, "replica")
+        cache.clear()  # the window has passed
+        self.assertEqual(HiiCart.objects.for_read().get(pk=self.cart.pk)._state.db, "replica")
+
+    def test_read_your_payment_writes(self):
+        """New payments keep their cart's reads on the primary."""
+        cart = HiiCart.objects.for_read().get(pk=self.cart.pk)
+        Payment.objects.create(cart=self.cart, amount=Decimal("1.99"), state="PAID")
+        self.assertEqual(cart.payments.all().db, "default")
+        with routers.using_replica():
+            self.assertEqual(self.cart.payments.all().db, "default")
+            self.assertEqual([li._state.db for li in self.cart.lineitems], ["default"])
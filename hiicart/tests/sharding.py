@@ -0,0 +1,163 @@
+import base
+
+from decimal import Decimal
+from django.db import connection, connections, router
+from django.test.utils import CaptureQueriesContext
+
+from hiicart import sharding
+from hiicart.gateway.comp.gateway import CompGateway
+from hiicart.lib.unitofwork import unit_of_work
+from hiicart.models import (CartLocation, CartTombstone, DailyRevenue, HiiCart, LineItem,
+                            Note, Payment)
+from hiicart.settings import SETTINGS as hiicart_settings
+from hiicart.utils import cart_by_uuid
+
+
+shard_fn_calls = []
+
+
+def shard_two(cart):
+    shard_fn_calls.append(cart)
+    return "shard2"
+
+
+def store_settings(cart):
+    return {"SHARD": "shard2"}
+
+
+class ShardRouterTestCase(base.HiiCartTestCase):
+    """Tests for sharding carts by store."""
+
+    def setUp(self):
+        super(ShardRouterTestCase, self).setUp()
+        # "shard2" shares the default connection, so the shard rows were
+        # routed to shows in _state.db
+        connections.databases["shard2"] = connections.databases["default"]
+        setattr(connections._connections, "shard2", connections["default"])
+        self.router = sharding.ShardRouter()
+        router.routers.insert(0, self.router)
+        self.old_settings = dict((key, hiicart_settings.get(key)) for key in
+                                 ("SHARDS", "SHARD_FN", "STORE_SETTINGS_FN"))
+        hiicart_settings["SHARDS"] = ["default", "shard2"]
+
+    def tearDown(self):
+        hiicart_settings.update(self.old_settings)
+        sharding.activate(None)
+        router.routers.remove(self.router)
+        delattr(connections._connections, "shard2")
+        del connections.databases["shard2"]
+        CartLocation.objects.all().delete()
+        super(ShardRouterTestCase, self).tearDown()
+
+    def test_shard_fn(self):
+        """New carts go to SHARD_FN's shard and their rows follow them."""
+        hiicart_settings["SHARD_FN"] = "hiicart.tests.sharding.shard_two"
+        cart = HiiCart.objects.create(user=self.test_user)
+        self.assertEqual(cart._state.db, "shard2")
+        self.assertEqual(CartLocation.objects.get(cart_uuid=cart.cart_uuid).shard, "shard2")
+        item = LineItem(cart=cart, name="Item", quantity=1, sku="1",
+                        unit_price=Decimal("1.00"))
+        item.save()
+        self.assertEqual(item._state.db, "shard2")
+        payment = cart.payments.create(amount=Decimal("1.00"), state="PAID")
+        self.assertEqual(payment._state.db, "shard2")
+        self.assertEqual([li._state.db for li in cart.lineitems], ["shard2"])
+        self.assertEqual(cart.clone()._state.db, "shard2")
+
+    def test_store_settings(self):
+        """A store's settings can name its shard; gateways activate it."""
+        self.assertEqual(self.cart._state.db, "default")
+        hiicart_settings["STORE_SETTINGS_FN"] = "hiicart.tests.sharding.store_settings"
+        cart = HiiCart.objects.create(user=self.test_user)
+        self.assertEqual(cart._state.db, "shard2")
+        CompGateway(self.cart)
+        self.assertEqual(sharding.current_shard(), "default")
+        self.assertEqual(HiiCart.objects.all().db, "default")
+        CompGateway(cart)
+        self.assertEqual(sharding.current_shard(), "shard2")
+        self.assertEqual(HiiCart.objects.all().db, "shard2")
+
+    def test_cart_by_uuid(self):
+        """The locator finds a cart's shard with a single lookup."""
+        hiicart_settings["SHARD_FN"] = "hiicart.tests.sharding.shard_two"
+        cart = HiiCart.objects.create(user=self.test_user)
+        with CaptureQueriesContext(connection) as ctx:
+            found = cart_by_uuid(cart.cart_uuid)
+        self.assertEqual(found, cart)
+        self.assertEqual(found._state.db, "shard2")
+        self.assertEqual(len(ctx.captured_queries), 2)
+
+    def test_fan_out(self):
+        """fan_out runs a function against every shard."""
+        self.assertEqual(sharding.fan_out(lambda alias: sharding.current_shard()),
+                         {"default": "default", "shard2": "shard2"})
+        counts = sharding.fan_out(lambda alias: HiiCart.objects.filter(pk=self.cart.pk).count(),
+                                  parallel=False)
+        self.assertEqual(counts, {"default": 1, "shard2": 1})
+
+    def test_activation_doesnt_override_store(self):
+        """A shard left active on the thread doesn't place another store's carts."""
+        hiicart_settings["SHARD_FN"] = "hiicart.tests.sharding.shard_two"
+        del shard_fn_calls[:]
+        sharding.activate("default")
+        cart = HiiCart(user=self.test_user)
+        self.assertEqual(sharding.resolve_shard(cart), "shard2")
+        cart.save()
+        self.assertEqual(cart._state.db, "shard2")
+        self.assertEqual(shard_fn_calls, [cart])
+        with sharding.use_shard("default"):
+            self.assertEqual(sharding.resolve_shard(HiiCart()), "default")
+
+    def test_unit_of_work_joins_shard(self):
+        """Writes to a shard inside a unit of work run in a transaction there."""
+        hiicart_settings["SHARD_FN"] = "hiicart.tests.sharding.shard_two"
+        with unit_of_work() as unit:
+            cart = HiiCart.objects.create(user=self.test_user)
+            self.assertEqual([alias for alias, atomic in unit.transactions],
+                             ["default", "shard2"])
+        self.assertEqual(unit.transactions, [])
+        self.assertEqual(cart._state.db, "shard2")
+
+    def test_clone_many_across_shards(self):
+        """Carts on different shards are each cloned on their own shard."""
+        hiicart_settings["SHARD_FN"] = "hiicart.tests.sharding.shard_two"
+        other = HiiCart.objects.create(user=self.test_user)
+        LineItem.objects.create(cart=other, name="Other", quantity=2, sku="2",
+                                unit_price=Decimal("3.00"))
+        clones = HiiCart.clone_many([other, self.cart])
+        self.assertEqual([clone._state.db for clone in clones], ["shard2", "default"])
+        self.assertEqual([CartLocation.objects.get(cart_uuid=clone.cart_uuid).shard
+                          for clone in clones], ["shard2", "default"])
+        self.assertEqual([[li.name for li in clone.lineitems] for clone in clones],
+                         [["Other"], ["Test Item"]])
+
+    def test_global_tables(self):
+        """Tombstones and rollups stay on the default database."""
+        with sharding.use_shard("shard2"):
+            for model in (CartLocation, CartTombstone, DailyRevenue):
+                self.assertEqual(router.db_for_write(model), "default")
+                self.assertTrue(self.router.allow_syncdb("default", model))
+                self.assertFalse(self.router.allow_syncdb("shard2", model))
+            for model in (HiiCart, Payment, Note):
+                self.assertEqual(router.db_for_write(model), "shard2")
+                self.assertTrue(self.router.allow_syncdb("shard2", model))
+
+    def test_celery_signals(self):
+        """deliver_signals reloads a cart from its shard."""
+        from hiicart.signals import serialize
+        from hiicart.tasks import deliver_signals
+        hiicart_settings["SHARD_FN"] = "hiicart.tests.sharding.shard_two"
+        cart = HiiCart.objects.create(user=self.test_user)
+        seen = []
+
+        def receiver(sender, cart, **kwargs):
+            seen.append((cart.pk, cart._state.db))
+
+        HiiCart.cart_state_changed.connect(receiver)
+        try:
+            deliver_signals([serialize(HiiCart.cart_state_changed,
+                                       {"sender": "HiiCart", "cart": cart,
+                                        "old_state": "OPEN", "new_state": "SUBMITTED"})])
+        finally:
+            HiiCart.cart_state_changed.disconnect(receiver)
+        self.assertEqual(seen, [(cart.pk, "shard2")])
@@ -0,0 +1,75 @@
+import base
+
+from decimal import Decimal
+
+from hiicart.lib.unitofwork import unit_of_work
+from hiicart.models import HiiCart, Payment
+from hiicart.settings import SETTINGS as hiicart_settings
+from hiicart.signals import serialize
+
+
+class SignalDispatchTestCase(base.HiiCartTestCase):
+    """Tests for the on_commit and celery signal dispatch modes."""
+
+    def setUp(self):
+        super(SignalDispatchTestCase, self).setUp()
+        self.old_mode = hiicart_settings["SIGNAL_DISPATCH"]
+        hiicart_settings["SIGNAL_DISPATCH"] = "on_commit"
+        self.seen = []
+        HiiCart.cart_state_changed.connect(self._failing)
+        HiiCart.cart_state_changed.connect(self._cart_state_changed)
+        Payment.payment_state_changed.connect(self._payment_state_changed)
+
+    def tearDown(self):
+        hiicart_settings["SIGNAL_DISPATCH"] = self.old_mode
+        HiiCart.cart_state_changed.disconnect(self._failing)
+        HiiCart.cart_state_changed.disconnect(self._cart_state_changed)
+        Payment.payment_state_changed.disconnect(self._payment_state_changed)
+        super(SignalDispatchTestCase, self).tearDown()
+
+    def _failing(self, sender, **kwargs):
+        raise ValueError("receiver failed")
+
+    def _cart_state_changed(self, sender, cart, old_state, new_state, **kwargs):
+        self.seen.append((cart.pk, old_state, new_state))
+
+    def _payment_state_changed(self, sender, payment, old_state, new_state, **kwargs):
+        self.seen.append((payment.cart_id, old_state, new_state))
+
+    def test_isolation(self):
+        """A failing receiver doesn't stop the others or the save."""
+        self.cart.set_state("SUBMITTED")
+        self.assertEqual(self.seen, [(self.cart.pk, "OPEN", "SUBMITTED")])
+        self.assertEqual(HiiCart.objects.get(pk=self.cart.pk).state, "SUBMITTED")
+
+    def test_grouped_by_cart(self):
+        """Signals are delivered after commit, in order for each cart."""
+        other = HiiCart.objects.create(user=self.test_user)
+        with unit_of_work():
+            self.cart.set_state("SUBMITTED")
+            other.set_state("SUBMITTED")
+            payment = self.cart.payments.create(amount=Decimal("1.99"), state="PENDING")
+            payment.state = "PAID"
+            payment.save()
+            self.cart.update_state()
+            self.assertEqual(self.seen, [])
+        self.assertEqual(self.seen, [(self.cart.pk, "OPEN", "SUBMITTED"),
+                                     (self.cart.pk, "PENDING", "PAID"),
+                                     (self.cart.pk, "SUBMITTED", "COMPLETED"),
+                                     (other.pk, "OPEN", "SUBMITTED")])
+
+    def test_celery_task(self):
+        """deliver_signals reloads instances and delivers in order."""
+        from hiicart.tasks import deliver_signals
+        self.cart.set_state("SUBMITTED")
+        payment = self.cart.payments.create(amount=Decimal("1.99"), state="PAID")
+        self.seen = []
+        deliver_signals([
+            serialize(HiiCart.cart_state_changed,
+                      {"sender": "HiiCart", "cart": self.cart,
+                       "old_state": "OPEN", "new_state": "SUBMITTED"}),
+            serialize(Payment.payment_state_changed,
+                      {"sender": "Payment", "payment": payment,
+                       "old_state": "PENDING", "new_state": "PAID"})])
+        self.assertEqual(self.seen, [(self.cart.pk, "OPEN", "SUBMITTED"),
+                                     (self.cart.pk, "PENDING", "PAID")])
@@ -0,0 +1,62 @@
+import base
+
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from hiicart import snapshot
+from hiicart.models import HiiCart, Payment
+from hiicart.settings import SETTINGS as hiicart_settings
+
+
+class SnapshotTestCase(base.HiiCartTestCase):
+    """Tests for compact cart snapshots."""
+
+    def setUp(self):
+        super(SnapshotTestCase, self).setUp()
+        self.recurring = self._add_recurring_item()
+        self.payment = Payment.objects.create(cart=self.cart, amount=Decimal("1.99"),
+                                              state="PAID", transaction_id="T1")
+        self.cart.save()
+        self.old_timeout = hiicart_settings["SNAPSHOT_TIMEOUT"]
+        hiicart_settings["SNAPSHOT_TIMEOUT"] = 60
+
+    def tearDown(self):
+        hiicart_settings["SNAPSHOT_TIMEOUT"] = self.old_timeout
+        cache.clear()
+        super(SnapshotTestCase, self).tearDown()
+
+    def test_build(self):
+        """One query per table, and records matching the models."""
+        with CaptureQueriesContext(connection) as ctx:
+            snap = snapshot.build_snapshot(self.cart.pk)
+        self.assertEqual(len(ctx.captured_queries), 2 + len(HiiCart.lineitem_types))
+        self.assertEqual((snap.cart.id, snap.cart.cart_uuid, snap.cart.state, snap.cart.total),
+                         (self.cart.pk, self.cart.cart_uuid, "OPEN", self.cart.total))
+        self.assertEqual([(item.type, item.name, item.unit_price, item.recurring_price)
+                          for item in snap.lineitems],
+                         [("LineItem", "Test Item", Decimal("1.99"), None),
+                          ("RecurringLineItem", "Recurring", None, Decimal("20.00"))])
+        self.assertEqual([(p.id, p.amount, p.state) for p in snap.payments],
+                         [(self.payment.pk, Decimal("1.99"), "PAID")])
+        self.assertRaises(AttributeError, setattr, snap.cart, "state", "COMPLETED")
+        self.assertRaises(HiiCart.DoesNotExist, snapshot.build_snapshot, -1)
+
+    def test_json(self):
+        snap = snapshot.build_snapshot(self.cart.pk)
+        self.assertEqual(snapshot.CartSnapshot.from_json(snap.to_json()), snap)
+
+    def test_cache(self):
+        """Snapshots are cached until the cart or its rows are saved."""
+        snapshot.get_snapshot(self.cart.pk)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(snapshot.get_snapshot(self.cart.pk).cart.state, "OPEN")
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.cart.set_state("SUBMITTED")
+        self.assertEqual(snapshot.get_snapshot(self.cart.pk).cart.state, "SUBMITTED")
+        self.payment.state = "REFUND"
+        self.payment.save()
+        self.assertEqual(snapshot.get_snapshot(self.cart.pk).payments[0].state, "REFUND")
+        self.recurring.delete()
+        self.assertEqual(len(snapshot.get_snapshot(self.cart.pk).lineitems), 1)
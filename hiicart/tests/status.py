@@ -0,0 +1,79 @@
+import base
+import json
+import threading
+import time
+
+from decimal import Decimal
+from django.db import connection
+from django.http import Http404
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from hiicart import status, views
+from hiicart.models import Payment
+
+
+class StatusTestCase(base.HiiCartTestCase):
+    """Tests for the conditional-GET cart status view."""
+
+    def setUp(self):
+        super(StatusTestCase, self).setUp()
+        self.factory = RequestFactory()
+        self.poll_interval = status.POLL_INTERVAL
+
+    def tearDown(self):
+        status.POLL_INTERVAL = self.poll_interval
+        super(StatusTestCase, self).tearDown()
+
+    def _get(self, etag=None, **params):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        request = self.factory.get("/status/%s" % self.cart.cart_uuid, params, **headers)
+        return views.status(request, self.cart.cart_uuid)
+
+    def test_status(self):
+        self.cart.save()  # store the line item's total
+        Payment.objects.create(cart=self.cart, amount=Decimal("1.99"), state="PAID")
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual((data["state"], data["total"]), ("OPEN", "1.99"))
+        self.assertEqual(data["payments"], {"count": 1, "paid": "1.99", "refunded": "0.00",
+                                            "last_state": "PAID"})
+        self.assertRaises(Http404, views.status, self.factory.get("/"), "no-such-cart")
+
+    def test_refund(self):
+        """A refund counts once, from the refund payment, not the one refunded."""
+        Payment.objects.create(cart=self.cart, amount=Decimal("5.00"), state="PAID")
+        Payment.objects.create(cart=self.cart, amount=Decimal("1.99"), state="REFUND")
+        Payment.objects.create(cart=self.cart, amount=Decimal("-1.99"), state="REFUND")
+        data = json.loads(self._get().content)
+        self.assertEqual(data["payments"], {"count": 3, "paid": "5.00", "refunded": "1.99",
+                                            "last_state": "REFUND"})
+
+    def test_not_modified(self):
+        """An unchanged cart is a 304 from one query; changes give a new ETag."""
+        etag = self._get()["ETag"]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self._get(etag)
+        self.assertEqual((response.status_code, len(ctx.captured_queries)), (304, 1))
+        Payment.objects.create(cart=self.cart, amount=Decimal("1.99"), state="PENDING")
+        self.assertEqual(self._get(etag).status_code, 200)
+        etag = self._get()["ETag"]
+        self.cart.set_state("SUBMITTED")
+        self.assertEqual(self._get(etag).status_code, 200)
+
+    def test_long_poll(self):
+        """A save in the same process wakes a waiting request."""
+        status.POLL_INTERVAL = 10.0
+        version = status.cart_version(self.cart.cart_uuid)
+        started = time.time()
+        self.assertEqual(status.wait_for_change(version, 0.1), None)
+        self.cart.set_state("SUBMITTED")
+        # As if the save happened while waiting
+        threading.Timer(0.1, status._notify, (None,), {"instance": self.cart}).start()
+        fresh = status.wait_for_change(version, 5)
+        self.assertEqual(fresh.state, "SUBMITTED")
+        self.assertTrue(time.time() - started < 2)
+        self.assertEqual(status._waiters, {})
+        response = self._get(version.etag, wait="1")
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,149 @@
+import base
+import threading
+import time
+
+from decimal import Decimal
+from django.conf import settings
+
+from hiicart.models import HiiCart, HiiCartError, LineItem
+from hiicart.settings import SETTINGS as hiicart_settings
+
+resolved = []
+
+
+def allow_recurring(cart):
+    resolved.append([cart])
+    return {"ALLOW_RECURRING_COMP": True}
+
+
+def allow_recurring_many(carts):
+    resolved.append(carts)
+    return [{"ALLOW_RECURRING_COMP": True} for cart in carts]
+
+
+def fail_many(carts):
+    raise ValueError("Settings service is down")
+
+
+def settings_for_one(carts):
+    return [{}]
+
+
+def fail_second(cart):
+    if cart.bill_email == "second@example.com":
+        raise ValueError("No settings for this store")
+    return {}
+
+
+class SubmitManyTestCase(base.HiiCartTestCase):
+    """Tests for submitting carts in bulk."""
+
+    def setUp(self):
+        settings.HIICART_SETTINGS.setdefault("COMP", {})
+        super(SubmitManyTestCase, self).setUp()
+        self.old_settings = dict((key, hiicart_settings.get(key)) for key in
+                                 ("CART_SETTINGS_FN", "CART_SETTINGS_MANY_FN"))
+        del resolved[:]
+        self.other = HiiCart.objects.create(user=self.test_user,
+                                            bill_email="second@example.com")
+        LineItem.objects.create(cart=self.other, name="Other Item", quantity=1,
+                                sku="2", unit_price=Decimal("5.00"))
+        self.carts = [HiiCart.objects.get(pk=self.cart.pk),
+                      HiiCart.objects.get(pk=self.other.pk)]
+
+    def tearDown(self):
+        hiicart_settings.update(self.old_settings)
+        super(SubmitManyTestCase, self).tearDown()
+
+    def test_submit_many(self):
+        """Each cart is submitted, with a result per cart in order."""
+        results = HiiCart.submit_many(self.carts, "comp", workers=1)
+        self.assertEqual(results, [None, None])
+        for cart in self.carts:
+            cart = HiiCart.objects.get(pk=cart.pk)
+            self.assertEqual(cart.state, "COMPLETED")
+            self.assertEqual(cart.gateway, "comp")
+            self.assertEqual(cart.payments.get().amount, cart.total)
+
+    def test_cart_settings_fn(self):
+        """CART_SETTINGS_FN is called per cart before any is submitted."""
+        hiicart_settings["CART_SETTINGS_FN"] = "hiicart.tests.submit.allow_recurring"
+        self.cart.lineitems[0].delete()
+        self._add_recurring_item()
+        carts = [HiiCart.objects.get(pk=self.cart.pk)]
+        HiiCart.submit_many(carts, "comp", workers=1)
+        self.assertEqual(len(resolved), 1)
+        self.assertEqual(HiiCart.objects.get(pk=self.cart.pk).state, "RECURRING")
+
+    def test_cart_settings_many_fn(self):
+        """CART_SETTINGS_MANY_FN resolves every cart's settings in one call."""
+        hiicart_settings["CART_SETTINGS_FN"] = "hiicart.tests.submit.fail_second"
+        hiicart_settings["CART_SETTINGS_MANY_FN"] = "hiicart.tests.submit.allow_recurring_many"
+        self.cart.lineitems[0].delete()
+        self._add_recurring_item()
+        results = HiiCart.submit_many(self.carts, "comp", workers=1)
+        self.assertEqual(results, [None, None])
+        self.assertEqual(resolved, [self.carts])
+        self.assertEqual(HiiCart.objects.get(pk=self.cart.pk).state, "RECURRING")
+
+    def test_cart_settings_many_fn_fails(self):
+        """A failing CART_SETTINGS_MANY_FN falls back to CART_SETTINGS_FN."""
+        hiicart_settings["CART_SETTINGS_MANY_FN"] = "hiicart.tests.submit.fail_many"
+        hiicart_settings["CART_SETTINGS_FN"] = "hiicart.tests.submit.fail_second"
+        results = HiiCart.submit_many(self.carts, "comp", workers=1)
+        self.assertEqual(results[0], None)
+        self.assertTrue(isinstance(results[1], ValueError))
+        self.assertEqual(HiiCart.objects.get(pk=self.cart.pk).state, "COMPLETED")
+
+    def test_cart_settings_many_fn_short(self):
+        """Without CART_SETTINGS_FN every cart gets CART_SETTINGS_MANY_FN's error."""
+        hiicart_settings["CART_SETTINGS_FN"] = None
+        hiicart_settings["CART_SETTINGS_MANY_FN"] = "hiicart.tests.submit.settings_for_one"
+        results = HiiCart.submit_many(self.carts, "comp", workers=1)
+        self.assertTrue(all(isinstance(r, HiiCartError) for r in results))
+        self.assertTrue(results[0] is results[1])
+        self.assertEqual(HiiCart.objects.get(pk=self.cart.pk).state, "OPEN")
+
+    def test_partial_failure(self):
+        """A cart that fails gets its exception; the rest are submitted."""
+        hiicart_settings["CART_SETTINGS_FN"] = "hiicart.tests.submit.fail_second"
+        results = HiiCart.submit_many(self.carts, "comp", workers=1)
+        self.assertEqual(results[0], None)
+        self.assertTrue(isinstance(results[1], ValueError))
+        self.assertEqual(HiiCart.objects.get(pk=self.cart.pk).state, "COMPLETED")
+        self.assertEqual(HiiCart.objects.get(pk=self.other.pk).state, "OPEN")
+
+    def test_unknown_gateway(self):
+        """Gateway errors are reported per cart too."""
+        results = HiiCart.submit_many(self.carts, "nonesuch", workers=1)
+        self.assertTrue(all(isinstance(r, HiiCartError) for r in results))
+
+    def test_bounded_pool(self):
+        """Carts are submitted concurrently on at most `workers` threads."""
+        lock = threading.Lock()
+        running = [0, 0]
+        threads = set()
+
+        def fake_submit(pk):
+            def submit(*args):
+                with lock:
+                    running[0] += 1
+                    running[1] = max(running)
+                    threads.add(threading.current_thread())
+                time.sleep(0.05)
+                with lock:
+                    running[0] -= 1
+                if pk == 3:
+                    raise ValueError("Declined")
+                return pk
+            return submit
+
+        carts = [HiiCart(pk=pk) for pk in range(6)]
+        for cart in carts:
+            cart._submit = fake_submit(cart.pk)
+        results = HiiCart.submit_many(carts, "comp", workers=3)
+        self.assertEqual(results[:3] + results[4:], [0, 1, 2, 4, 5])
+        self.assertTrue(isinstance(results[3], ValueError))
+        self.assertEqual(running[1], 3)
+        self.assertEqual(len(threads), 3)
+        self.assertFalse(threading.current_thread() in threads)
@@ -0,0 +1,78 @@
+import base
+
+from datetime import timedelta
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from hiicart.models import HiiCart
+from hiicart.settings import SETTINGS as hiicart_settings
+from hiicart.sweeper import sweep_abandoned
+from hiicart.utils import cart_by_id
+
+
+class SweeperTestCase(base.HiiCartTestCase):
+    """Tests for sweeping stale carts to ABANDONED."""
+
+    def setUp(self):
+        super(SweeperTestCase, self).setUp()
+        self.now = timezone.now()
+        self.stale = []
+        for i in range(5):
+            cart = HiiCart.objects.create(user=self.test_user)
+            self.stale.append(cart.pk)
+        HiiCart.objects.filter(pk__in=self.stale[:3]).update(
+            last_updated=self.now - timedelta(days=40))
+        HiiCart.objects.filter(pk__in=self.stale[3:]).update(
+            _cart_state="SUBMITTED", last_updated=self.now - timedelta(days=8))
+        self.signals = []
+        HiiCart.cart_state_changed.connect(self._cart_state_changed)
+
+    def tearDown(self):
+        HiiCart.cart_state_changed.disconnect(self._cart_state_changed)
+        super(SweeperTestCase, self).tearDown()
+
+    def _cart_state_changed(self, sender, cart, old_state, new_state, **kwargs):
+        self.signals.append((cart.pk, old_state, new_state))
+
+    def test_sweep(self):
+        """Only carts older than their state's age are abandoned."""
+        ages = {"OPEN": timedelta(days=30), "SUBMITTED": timedelta(days=7)}
+        with CaptureQueriesContext(connection) as ctx:
+            counts = sweep_abandoned(ages, chunk_size=2, now=self.now)
+        self.assertEqual(counts, {"OPEN": 3, "SUBMITTED": 2})
+        updates = [q for q in ctx.captured_queries if "UPDATE " in q["sql"]]
+        # One UPDATE per chunk: OPEN in 2 + 1, SUBMITTED in 2
+        self.assertEqual(len(updates), 3)
+        states = dict(HiiCart.objects.filter(pk__in=self.stale).values_list("pk", "_cart_state"))
+        self.assertEqual(set(states.values()), set(["ABANDONED"]))
+        self.assertEqual(HiiCart.objects.get(pk=self.cart.pk).state, "OPEN")
+        self.assertEqual(sorted(self.signals),
+                         sorted([(pk, "OPEN", "ABANDONED") for pk in self.stale[:3]] +
+                                [(pk, "SUBMITTED", "ABANDONED") for pk in self.stale[3:]]))
+
+    def test_sweep_age(self):
+        """Carts newer than the age are left alone."""
+        counts = sweep_abandoned({"SUBMITTED": timedelta(days=10)}, now=self.now)
+        self.assertEqual(counts, {"SUBMITTED": 0})
+        self.assertEqual(self.signals, [])
+
+    def test_cached_carts(self):
+        """Swept carts are dropped from the cart cache."""
+        old_timeout = hiicart_settings["CART_CACHE_TIMEOUT"]
+        hiicart_settings["CART_CACHE_TIMEOUT"] = 60
+        try:
+            self.assertEqual(cart_by_id(self.stale[0]).state, "OPEN")
+            sweep_abandoned({"OPEN": timedelta(days=30)}, now=self.now)
+            self.assertEqual(cart_by_id(self.stale[0]).state, "ABANDONED")
+        finally:
+            hiicart_settings["CART_CACHE_TIMEOUT"] = old_timeout
+            cache.clear()
+
+    def test_late_payment(self):
+        """Abandoned carts can still be completed."""
+        sweep_abandoned({"OPEN": timedelta(days=30)}, now=self.now)
+        cart = HiiCart.objects.get(pk=self.stale[0])
+        cart.set_state("COMPLETED")
+        self.assertEqual(HiiCart.objects.get(pk=cart.pk).state, "COMPLETED")
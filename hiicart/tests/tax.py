@@ -0,0 +1,111 @@
+import base
+import os
+import shutil
+import tempfile
+
+from decimal import Decimal
+from StringIO import StringIO
+
+from hiicart import tax
+from hiicart.models import HiiCart, HiiCartError, LineItem
+from hiicart.settings import SETTINGS as hiicart_settings
+
+RATES = """country,region,postal_code,rate
+US,CA,,0.0725
+US,CA,941,0.08625
+US,CA,94103,0.0875
+US,,,0
+GB,,,0.20
+DE,,10,0.19
+"""
+
+
+class TaxTestCase(base.HiiCartTestCase):
+    """Tests for tax rate tables."""
+
+    def setUp(self):
+        super(TaxTestCase, self).setUp()
+        self.old_table = hiicart_settings["TAX_TABLE"]
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "tax.table")
+        tax.build_table(tax.read_csv(StringIO(RATES)), self.path)
+        hiicart_settings["TAX_TABLE"] = self.path
+        tax.reload()
+
+    def tearDown(self):
+        hiicart_settings["TAX_TABLE"] = self.old_table
+        tax.reload()
+        shutil.rmtree(self.dir)
+        super(TaxTestCase, self).tearDown()
+
+    def test_lookup(self):
+        """The most specific row for an address wins."""
+        self.assertEqual(tax.lookup("US", "CA", "94103-1234"),
+                         tax.TaxRate("US", "CA", "94103", Decimal("0.08750")))
+        self.assertEqual(tax.lookup("us", " ca", "94110").rate, Decimal("0.08625"))
+        self.assertEqual(tax.lookup("US", "CA", "90210").rate, Decimal("0.07250"))
+        self.assertEqual(tax.lookup("US", "NY", "10001").rate, Decimal("0"))
+        self.assertEqual(tax.lookup("DE", "Berlin", "10115").postal_code, "10")
+        self.assertEqual(tax.lookup("GB", "", "SW1A 1AA").rate, Decimal("0.20000"))
+        self.assertEqual(tax.lookup("FR", "", "75001"), None)
+        self.assertEqual(tax.lookup("", "CA", "94103"), None)
+
+    def test_build_errors(self):
+        """Rates and countries must fit tax_rate and tax_country and keys be unique."""
+        for rows in ([("US", "", "", Decimal("0.072501"))],
+                     [("US", "", "", Decimal("-0.1"))],
+                     [("US", "", "", Decimal("10"))],
+                     [("USA", "", "", Decimal("0.07"))],
+                     [("U1", "", "", Decimal("0.07"))],
+                     [("US", "CA", "", Decimal("0.07")), ("us", "ca", "", Decimal("0.08"))],
+                     [("", "CA", "", Decimal("0.07"))]):
+            self.assertRaises(HiiCartError, tax.build_table, rows, self.path)
+        self.assertRaises(HiiCartError, list, tax.read_csv(StringIO("country,rate\nUS,seven\n")))
+        self.assertEqual(os.listdir(self.dir), ["tax.table"])
+
+    def test_hot_reload(self):
+        """A replaced table is picked up without a restart."""
+        table = tax.get_table()
+        self.assertTrue(tax.get_table() is table)
+        tax.build_table([("US", "CA", "", Decimal("0.08"))], self.path)
+        tax._checked = 0
+        self.assertEqual(tax.lookup("US", "CA", "94103").rate, Decimal("0.08000"))
+        self.assertEqual(tax.lookup("GB"), None)
+        # The old table is still usable by whoever holds it
+        self.assertEqual(table.lookup("GB").rate, Decimal("0.20000"))
+
+    def test_no_table(self):
+        hiicart_settings["TAX_TABLE"] = None
+        self.assertRaises(HiiCartError, tax.lookup, "US")
+        hiicart_settings["TAX_TABLE"] = os.path.join(self.dir, "missing.table")
+        self.assertRaises(HiiCartError, tax.lookup, "US")
+
+    def test_apply_rate(self):
+        """Tax is rounded to cents as DecimalField rounds stored totals."""
+        items = [LineItem(quantity=1, unit_price=Decimal("0.10"), discount=Decimal("0"))]
+        self.assertEqual(tax.apply_rate(Decimal("0.125"), items), Decimal("0.01"))
+        items.append(LineItem(quantity=3, unit_price=Decimal("3.50"), discount=Decimal("1")))
+        self.assertEqual(tax.apply_rate(Decimal("0.08625"), items), Decimal("0.83"))
+
+    def test_calculate_tax(self):
+        """A cart's tax fields and total come from its shipping address."""
+        self.cart.bill_country = "GB"
+        self.cart.ship_country, self.cart.ship_state = "US", "CA"
+        self.cart.ship_postal_code = "94110"
+        found = self.cart.calculate_tax()
+        self.assertEqual(found.rate, Decimal("0.08625"))
+        self.assertEqual(self.cart.tax, Decimal("0.17"))
+        self.assertEqual(self.cart.total, Decimal("2.16"))
+        self.cart.save()
+        cart = HiiCart.objects.get(pk=self.cart.pk)
+        self.assertEqual((cart.tax, cart.tax_rate, cart.tax_country, cart.tax_region),
+                         (Decimal("0.17"), Decimal("0.08625"), "US", "CA"))
+        self.assertEqual(cart._total, Decimal("2.16"))
+        # Without a shipping country the billing address is used
+        cart.ship_country = ""
+        cart.calculate_tax()
+        self.assertEqual((cart.tax, cart.tax_country, cart.tax_region),
+                         (Decimal("0.40"), "GB", None))
+        cart.bill_country = "FR"
+        self.assertEqual(cart.calculate_tax(), None)
+        self.assertEqual((cart.tax, cart.tax_rate, cart.total), (None, None, Decimal("1.99")))
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+
+from hiicart.lib.unicodeconverter import UnicodeConverter, convertToUnicode, convertToUTF8
+
+
+class UnicodeConverterTestCase(TestCase):
+    """Tests for convertToUTF8 and its fast path."""
+
+    def setUp(self):
+        UnicodeConverter._detected.clear()
+
+    def test_utf8_returned_as_is(self):
+        markup = u"<name>Café</name>".encode("utf-8")
+        self.assertTrue(convertToUTF8(markup) is markup)
+        markup = "<name>Cafe</name>"
+        self.assertTrue(convertToUTF8(markup) is markup)
+
+    def test_unicode(self):
+        self.assertEqual(convertToUTF8(u"Caf\xe9"), "Caf\xc3\xa9")
+
+    def test_bom_stripped(self):
+        self.assertEqual(convertToUTF8("\xef\xbb\xbfCafe"), "Cafe")
+
+    def test_detection_cached(self):
+        markup = u"<name>Crème brûlée – Straße</name>".encode("windows-1252")
+        result = convertToUTF8(markup)
+        self.assertEqual(result, convertToUTF8(markup, fast=False))
+        self.assertEqual(UnicodeConverter._detected.values(),
+                         [UnicodeConverter(markup).originalEncoding])
+        self.assertEqual(convertToUTF8(markup), result)
+
+    def test_short_utf8(self):
+        # chardet guesses wrong for short UTF-8 inputs like this one
+        self.assertEqual(convertToUnicode(u"<a>Café</a>".encode("utf-8")), u"<a>Café</a>")
+
+    def test_legacy_matches(self):
+        for markup in ["<a>plain</a>", u"<a>é</a>"]:
+            self.assertEqual(convertToUTF8(markup), convertToUTF8(markup, fast=False))
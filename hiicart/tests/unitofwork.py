@@ -0,0 +1,77 @@
+import base
+
+from decimal import Decimal
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from hiicart.gateway.paypal.ipn import PaypalIPN
+from hiicart.lib.unitofwork import unit_of_work
+from hiicart.models import HiiCart, Payment
+
+
+class UnitOfWorkTestCase(base.HiiCartTestCase):
+    """Tests for coalescing writes and deferring signals."""
+
+    def setUp(self):
+        super(UnitOfWorkTestCase, self).setUp()
+        self.cart.hiicart_settings = dict(self.cart.hiicart_settings,
+                                          PAYPAL={"BUSINESS": "test@example.com"})
+        self.cart.save()
+        self.signals = []
+        HiiCart.cart_state_changed.connect(self._cart_state_changed)
+        Payment.payment_state_changed.connect(self._payment_state_changed)
+
+    def tearDown(self):
+        HiiCart.cart_state_changed.disconnect(self._cart_state_changed)
+        Payment.payment_state_changed.disconnect(self._payment_state_changed)
+        super(UnitOfWorkTestCase, self).tearDown()
+
+    def _cart_state_changed(self, sender, cart, old_state, new_state, **kwargs):
+        self.signals.append(("cart", old_state, new_state))
+
+    def _payment_state_changed(self, sender, payment, old_state, new_state, **kwargs):
+        self.signals.append(("payment", old_state, new_state))
+
+    def _accept_payment(self):
+        PaypalIPN(self.cart).accept_payment({
+            "txn_id": "1234", "mc_gross": "1.99", "payer_email": "buyer@example.com",
+            "first_name": "Test", "last_name": "Buyer"})
+
+    def test_coalesced_writes(self):
+        """Each cart and payment row is updated once."""
+        with CaptureQueriesContext(connection) as ctx:
+            with unit_of_work():
+                self._accept_payment()
+                self.assertEqual(self.signals, [])
+        updates = [q["sql"] for q in ctx.captured_queries if "UPDATE " in q["sql"]]
+        self.assertEqual(len([u for u in updates if "hiicart_hiicart" in u]), 1)
+        self.assertEqual(len([u for u in updates if "hiicart_payment" in u]), 1)
+        self.assertEqual(self.signals, [("payment", "PENDING", "PAID"),
+                                        ("cart", "OPEN", "COMPLETED")])
+        cart = HiiCart.objects.get(pk=self.cart.pk)
+        self.assertEqual(cart.state, "COMPLETED")
+        self.assertEqual(cart.bill_email, "buyer@example.com")
+        self.assertEqual(cart.payments.get().state, "PAID")
+
+    def test_rollback(self):
+        """Writes and signals are discarded when an exception escapes."""
+        def fail():
+            with unit_of_work():
+                self._accept_payment()
+                raise ValueError()
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(self.signals, [])
+        cart = HiiCart.objects.get(pk=self.cart.pk)
+        self.assertEqual(cart.state, "OPEN")
+        self.assertEqual(cart.payments.count(), 0)
+
+    def test_decorator(self):
+        """unit_of_work decorates functions, and nested ones join the outer."""
+        @unit_of_work
+        def accept():
+            with unit_of_work():
+                self._accept_payment()
+            self.assertEqual(self.signals, [])
+        accept()
+        self.assertEqual(HiiCart.objects.get(pk=self.cart.pk).state, "COMPLETED")
+        self.assertEqual(len(self.signals), 2)
@@ -11,6 +11,8 @@ from django.conf.urls import patterns, include
 
 urlpatterns = patterns('',
     (r'complete/?$',                'hiicart.views.complete'),
+    (r'^export/?$',                 'hiicart.views.export'),
+    (r'^status/(?P<cart_uuid>[-\w]+)/?$', 'hiicart.views.status'),
     (r'^amazon/',                   include(hiicart.gateway.amazon.urls)),
     (r'^google/',                   include(hiicart.gateway.google.urls)),
     (r'^paypal/',                   include(hiicart.gateway.paypal.urls)),
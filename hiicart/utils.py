@@ -7,8 +7,11 @@ import logging
 import traceback
 import sys
 from pprint import pformat
+from django.db.models import Q
 from django.http import HttpResponse, QueryDict
+from hiicart import cartcache
 from hiicart.models import CART_TYPES
+from hiicart.sharding import locate, use_shard
 try:
     import newrelic.agent
 except ImportError, e:
@@ -62,17 +65,49 @@ def format_data(data):
 def cart_by_id(id):
     for Cart in CART_TYPES:
         try:
-            return Cart.objects.get(pk=id)
+            return cartcache.get_cart(Cart, id)
         except Cart.DoesNotExist:
             pass
 
 
-def cart_by_uuid(uuid):
+def cart_by_uuid(uuid, for_read=False):
+    """Find a cart by uuid.  for_read looks on a read replica first and
+    doesn't restore archived carts.
+
+    With CART_CACHE_TIMEOUT set, found carts and unknown uuids are cached;
+    see hiicart.cartcache."""
+    cart = cartcache.find_uuid(uuid)
+    if cart is cartcache.MISSING:
+        return None
+    if cart is not None:
+        return cart
+    cart = _cart_by_uuid(uuid, for_read)
+    # Replica reads aren't cached, nor are misses that may be archived carts
+    if not for_read:
+        cartcache.remember_uuid(uuid, cart)
+    return cart
+
+
+def _cart_by_uuid(uuid, for_read):
+    if for_read:
+        for Cart in CART_TYPES:
+            try:
+                return Cart.objects.for_read().get(_cart_uuid=uuid)
+            except Cart.DoesNotExist:
+                pass
+    # Sharded carts are looked up on the shard the locator names
+    shard = locate(uuid)
     for Cart in CART_TYPES:
         try:
-            return Cart.objects.get(_cart_uuid=uuid)
+            return Cart.objects.using(shard).get(_cart_uuid=uuid)
         except Cart.DoesNotExist:
             pass
+    # Archived carts are brought back when something asks to change them
+    if for_read:
+        return None
+    from hiicart.archive import restore_cart
+    with use_shard(shard):
+        return restore_cart(uuid)
 
 
 def cart_by_email(email):
@@ -86,3 +121,36 @@ def cart_by_email(email):
             return Cart.objects.get(ship_email=email)
         except Cart.DoesNotExist:
             pass
+
+
+def keyset_chunks(queryset, chunk_size=500, field="pk"):
+    """
+    Yield lists of up to chunk_size objects from queryset.
+
+    Objects are ordered by `field` and then pk and each chunk starts after
+    the last key of the one before rather than at an OFFSET, so every chunk
+    is an index range scan and rows changed between chunks are not skipped
+    or repeated.
+    """
+    if field == "pk":
+        queryset = queryset.order_by("pk")
+    else:
+        queryset = queryset.order_by(field, "pk")
+    last = None
+    while True:
+        chunk_qs = queryset
+        if last is not None:
+            value, pk = last
+            if field == "pk":
+                chunk_qs = chunk_qs.filter(pk__gt=pk)
+            else:
+                chunk_qs = chunk_qs.filter(Q(**{field + "__gt": value}) |
+                                           Q(**{field: value, "pk__gt": pk}))
+        chunk = list(chunk_qs[:chunk_size])
+        if not chunk:
+            return
+        # Read the key now in case the caller changes the objects
+        last = (getattr(chunk[-1], field), chunk[-1].pk)
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
@@ -1,15 +1,78 @@
-from django.http import HttpResponseRedirect
+import json
 
-from hiicart.models import HiiCart
+from django.contrib.auth.decorators import user_passes_test
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         HttpResponseNotModified, HttpResponseRedirect,
+                         StreamingHttpResponse)
+
+from hiicart import status as cart_status
+from hiicart.export import FORMATS, export_lines, parse_when
 from hiicart.settings import SETTINGS as settings
+from hiicart.snapshot import get_snapshot
 
 def complete(request):
     """View to handle redirection after a cart is completed."""
     next = settings["CART_COMPLETE"] or  "/"
     cartid = request.session.get("cartid", None)
     if cartid:
-        cart = HiiCart.objects.get(pk=cartid)
+        cart = get_snapshot(cartid, for_read=True).cart
         next = cart.success_url if cart.success_url else next
         if cart.failure_url and request.GET.get("fail", None) == "1":
             next = cart.failure_url
     return HttpResponseRedirect(next)
+
+
+@user_passes_test(lambda user: user.is_active and user.is_staff)
+def export(request):
+    """Stream carts with their line items and payments to staff.
+
+    Takes the hiicart_export command's options as query parameters:
+    format, start, end, and repeated state and gateway."""
+    format = request.GET.get("format", "csv")
+    if format not in FORMATS:
+        return HttpResponseBadRequest("Unknown format: %s" % format)
+    try:
+        start = parse_when(request.GET.get("start"))
+        end = parse_when(request.GET.get("end"))
+    except ValueError, e:
+        return HttpResponseBadRequest(str(e))
+    lines = export_lines(format, start=start, end=end,
+                         states=request.GET.getlist("state"),
+                         gateways=request.GET.getlist("gateway"))
+    content_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response["Content-Disposition"] = "attachment; filename=hiicart-export.%s" % format
+    return response
+
+
+def _status_response(response, version):
+    response["ETag"] = version.etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@transaction.non_atomic_requests
+def status(request, cart_uuid):
+    """
+    JSON status of a cart: its state, total and a summary of its payments.
+
+    Answers 304 Not Modified when If-None-Match has the cart's current
+    ETag.  With ?wait=<seconds> as well, waits up to that long (at most
+    LONG_POLL_MAX) for the cart to change before answering.
+    """
+    version = cart_status.cart_version(cart_uuid)
+    if version is None:
+        raise Http404
+    if request.META.get("HTTP_IF_NONE_MATCH") == version.etag:
+        try:
+            wait = min(float(request.GET.get("wait", 0)), settings["LONG_POLL_MAX"])
+        except ValueError:
+            return HttpResponseBadRequest("wait must be a number of seconds")
+        if wait > 0:
+            version = cart_status.wait_for_change(version, wait) or version
+        if request.META["HTTP_IF_NONE_MATCH"] == version.etag:
+            return _status_response(HttpResponseNotModified(), version)
+    body = json.dumps(cart_status.status(version), cls=DjangoJSONEncoder)
+    return _status_response(HttpResponse(body, content_type="application/json"), version)